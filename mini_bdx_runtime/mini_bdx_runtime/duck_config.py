@@ -52,6 +52,9 @@ class DuckConfig:
             "phase_frequency_factor_offset", 0.0
         )
 
+        # streaming filters applied to the raw imu data, see imu_filters.py
+        self.imu_filter = self.json_config.get("imu_filter", {})
+
         expression_features = self.json_config.get("expression_features", {})
 
         self.eyes = expression_features.get("eyes", False)
@@ -1,17 +1,20 @@
-import board
-import digitalio
 import time
 
-LEFT_FOOT_PIN = board.D22
-RIGHT_FOOT_PIN = board.D27
+# board pin names
+LEFT_FOOT_PIN = "D22"
+RIGHT_FOOT_PIN = "D27"
 
 class FeetContacts:
     def __init__(self):
-        self.left_foot = digitalio.DigitalInOut(LEFT_FOOT_PIN)
+        # imported here so that this module can be imported off robot
+        import board
+        import digitalio
+
+        self.left_foot = digitalio.DigitalInOut(getattr(board, LEFT_FOOT_PIN))
         self.left_foot.direction = digitalio.Direction.INPUT
         self.left_foot.pull = digitalio.Pull.UP
 
-        self.right_foot = digitalio.DigitalInOut(RIGHT_FOOT_PIN)
+        self.right_foot = digitalio.DigitalInOut(getattr(board, RIGHT_FOOT_PIN))
         self.right_foot.direction = digitalio.Direction.INPUT
         self.right_foot.pull = digitalio.Pull.UP
 
@@ -0,0 +1,236 @@
+import numpy as np
+
+
+class MedianFilter:
+    """
+    Running median over the last n samples, vectorized over channels.
+    If spike_threshold is set, samples are passed through untouched unless they
+    are further than spike_threshold from the median (only spikes are replaced).
+    """
+
+    def __init__(self, nb_channels, n=3, spike_threshold=None):
+        self.n = n
+        self.spike_threshold = spike_threshold
+        self.buffer = np.zeros((n, nb_channels))
+        self.median = np.zeros(nb_channels)
+        self.out = np.zeros(nb_channels)
+        self.i = 0
+        self.initialized = False
+
+    def reset(self):
+        self.i = 0
+        self.initialized = False
+
+    def update(self, x):
+        if not self.initialized:
+            self.buffer[:] = x
+            self.initialized = True
+        else:
+            self.buffer[self.i] = x
+        self.i = (self.i + 1) % self.n
+
+        np.median(self.buffer, axis=0, out=self.median)
+        if self.spike_threshold is None:
+            self.out[:] = self.median
+        else:
+            np.copyto(self.out, x)
+            spikes = np.abs(self.out - self.median) > self.spike_threshold
+            np.copyto(self.out, self.median, where=spikes)
+        return self.out
+
+
+class Biquad:
+    """
+    Second order butterworth low pass (direct form II transposed), vectorized
+    over channels. State is initialized on the first sample so there is no
+    startup transient.
+    """
+
+    def __init__(self, nb_channels, sampling_freq, cutoff_frequency):
+        self.sampling_freq = float(sampling_freq)
+        self.cutoff_frequency = float(cutoff_frequency)
+        self.b0, self.b1, self.b2, self.a1, self.a2 = self.compute_coefficients()
+        self.z1 = np.zeros(nb_channels)
+        self.z2 = np.zeros(nb_channels)
+        self.tmp = np.zeros(nb_channels)
+        self.out = np.zeros(nb_channels)
+        self.initialized = False
+
+    def compute_coefficients(self):
+        w0 = 2 * np.pi * min(self.cutoff_frequency, 0.49 * self.sampling_freq)
+        w0 /= self.sampling_freq
+        alpha = np.sin(w0) / (2 * np.sqrt(0.5))  # Q = 1/sqrt(2)
+        cos_w0 = np.cos(w0)
+        a0 = 1 + alpha
+        b0 = (1 - cos_w0) / 2 / a0
+        b1 = (1 - cos_w0) / a0
+        b2 = b0
+        a1 = -2 * cos_w0 / a0
+        a2 = (1 - alpha) / a0
+        return b0, b1, b2, a1, a2
+
+    def reset(self):
+        self.initialized = False
+
+    def update(self, x):
+        if not self.initialized:
+            # steady state for a constant input x
+            np.multiply(x, 1 - self.b0, out=self.z1)
+            np.multiply(x, self.b2 - self.a2, out=self.z2)
+            self.initialized = True
+
+        # y = b0 * x + z1
+        np.multiply(x, self.b0, out=self.out)
+        self.out += self.z1
+        # z1 = b1 * x - a1 * y + z2
+        np.multiply(x, self.b1, out=self.z1)
+        np.multiply(self.out, self.a1, out=self.tmp)
+        self.z1 -= self.tmp
+        self.z1 += self.z2
+        # z2 = b2 * x - a2 * y
+        np.multiply(x, self.b2, out=self.z2)
+        np.multiply(self.out, self.a2, out=self.tmp)
+        self.z2 -= self.tmp
+        return self.out
+
+
+class MovingAverage:
+    """
+    Mean of the last window_size samples, vectorized over channels. Keeps a
+    running sum over a circular buffer, so an update costs the same whatever
+    the window size.
+    """
+
+    def __init__(self, nb_channels, window_size=10):
+        self.window_size = window_size
+        self.buffer = np.zeros((window_size, nb_channels))
+        self.sum = np.zeros(nb_channels)
+        self.out = np.zeros(nb_channels)
+        self.reset()
+
+    def reset(self):
+        self.i = 0
+        self.count = 0
+        self.buffer[:] = 0
+        self.sum[:] = 0
+
+    def update(self, x):
+        self.sum -= self.buffer[self.i]
+        self.buffer[self.i] = x
+        self.sum += self.buffer[self.i]
+        self.i = (self.i + 1) % self.window_size
+        self.count = min(self.count + 1, self.window_size)
+        if self.i == 0:
+            # resum once per window, so that rounding errors don't accumulate
+            np.sum(self.buffer, axis=0, out=self.sum)
+
+        np.divide(self.sum, self.count, out=self.out)
+        return self.out
+
+
+class LowPass:
+    """
+    First order low pass, vectorized over channels. cutoff_frequency can be a
+    scalar or one value per channel. State is initialized on the first sample.
+    """
+
+    def __init__(self, nb_channels, sampling_freq, cutoff_frequency):
+        self.sampling_freq = float(sampling_freq)
+        self.cutoff_frequency = np.broadcast_to(
+            np.asarray(cutoff_frequency, dtype=np.float64), (nb_channels,)
+        ).copy()
+        # same alpha as rl_utils.LowPassActionFilter
+        self.alpha = (1.0 / self.cutoff_frequency) / (
+            1.0 / self.sampling_freq + 1.0 / self.cutoff_frequency
+        )
+        self.one_minus_alpha = 1 - self.alpha
+        self.tmp = np.zeros(nb_channels)
+        self.out = np.zeros(nb_channels)
+        self.initialized = False
+
+    def reset(self):
+        self.initialized = False
+
+    def update(self, x):
+        if not self.initialized:
+            self.out[:] = x
+            self.initialized = True
+            return self.out
+
+        # y = alpha * y + (1 - alpha) * x
+        self.out *= self.alpha
+        np.multiply(x, self.one_minus_alpha, out=self.tmp)
+        self.out += self.tmp
+        return self.out
+
+
+# Filters for the policy's actions (motor targets), see make_action_filter
+ACTION_FILTERS = ["none", "lowpass", "moving_average", "butterworth"]
+
+
+def make_action_filter(
+    name, nb_channels, control_freq, cutoff_frequency=None, window_size=10
+):
+    if name == "none":
+        return None
+    if name in ["lowpass", "butterworth"] and cutoff_frequency is None:
+        raise ValueError(f"The {name} action filter needs a cutoff frequency")
+    if name == "lowpass":
+        return LowPass(nb_channels, control_freq, cutoff_frequency)
+    if name == "moving_average":
+        return MovingAverage(nb_channels, window_size)
+    if name == "butterworth":
+        return Biquad(nb_channels, control_freq, cutoff_frequency)
+    raise ValueError(f"Unknown action filter {name}, use one of {ACTION_FILTERS}")
+
+
+if __name__ == "__main__":
+    import time
+
+    from mini_bdx_runtime.rl_utils import ActionFilter, LowPassActionFilter
+
+    nb_channels = 14
+    actions = np.random.default_rng(0).uniform(-1, 1, (1000, nb_channels))
+
+    old_ma = ActionFilter(10)
+    ma = MovingAverage(nb_channels, 10)
+    old_lp = LowPassActionFilter(50, 10)
+    lp = LowPass(nb_channels, 50, 10)
+    lp.update(np.zeros(nb_channels))  # the old filter starts at 0
+    ma_diff = lp_diff = 0
+    for action in actions:
+        old_ma.push(action)
+        ma_diff = max(
+            ma_diff, np.abs(old_ma.get_filtered_action() - ma.update(action)).max()
+        )
+        old_lp.push(action)
+        lp_diff = max(
+            lp_diff, np.abs(old_lp.get_filtered_action() - lp.update(action)).max()
+        )
+    print("Max diff moving average : ", ma_diff)
+    print("Max diff low pass : ", lp_diff)
+
+    def bench(update):
+        s = time.perf_counter()
+        for action in actions:
+            update(action)
+        return (time.perf_counter() - s) / len(actions) * 1e6
+
+    for window_size in [10, 50]:
+        old_ma = ActionFilter(window_size)
+
+        def old_ma_update(action):
+            old_ma.push(action)
+            return old_ma.get_filtered_action()
+
+        print(
+            f"moving average ({window_size}) : {bench(old_ma_update):.1f}us ->"
+            f" {bench(MovingAverage(nb_channels, window_size).update):.1f}us"
+        )
+
+    def old_lp_update(action):
+        old_lp.push(action)
+        return old_lp.get_filtered_action()
+
+    print(f"low pass : {bench(old_lp_update):.1f}us -> {bench(lp.update):.1f}us")
+    print(f"butterworth : {bench(Biquad(nb_channels, 50, 10).update):.1f}us")
@@ -0,0 +1,143 @@
+# Always on "black box" for the walk loop : the last few seconds of per tick
+# state are kept in a preallocated ring buffer and written to disk when
+# something goes wrong (exception, signal, bus failure, fall). The dumps use
+# the run recorder's format, load them with run_recorder.load_recording().
+import math
+import os
+import time
+from threading import Thread
+
+import numpy as np
+
+from mini_bdx_runtime.run_recorder import make_schema, make_record_dtype, write_header
+
+
+def tilt_from_accelero(accelero):
+    """
+    Angle (rad) between the measured gravity and the imu's z axis, 0 when the
+    robot is upright
+    """
+    x, y, z = float(accelero[0]), float(accelero[1]), float(accelero[2])
+    return math.atan2(math.sqrt(x * x + y * y), z)
+
+
+class FlightRecorder:
+    def __init__(
+        self,
+        fields,
+        freq,
+        duration=10,
+        dump_dir=".",
+        metadata={},
+        tilt_threshold=None,
+    ):
+        """
+        fields as in RunRecorder. Keeps the last duration seconds at freq.
+        tilt_threshold (rad) : check_tilt() dumps when the tilt goes above it
+        """
+        self.schema = make_schema(fields)
+        self.dtype = make_record_dtype(self.schema)
+        self.size = max(1, int(duration * freq))
+        self.buffer = np.zeros(self.size, dtype=self.dtype)
+        self.i = 0
+        self.count = 0
+
+        self.dump_dir = dump_dir
+        self.metadata = metadata
+        self.tilt_threshold = tilt_threshold
+        self.tilted = False
+        self.dumps = []
+        self.writers = []
+
+    def record(self, timestamp, **values):
+        """
+        Missing fields are recorded as zeros
+        """
+        row = self.buffer[self.i]
+        row["timestamp"] = timestamp
+        for name in self.dtype.names[1:]:
+            row[name] = values.get(name, 0)
+        self.i = (self.i + 1) % self.size
+        self.count += 1
+
+    def snapshot(self):
+        """
+        Copy of the recorded ticks, oldest first
+        """
+        if self.count < self.size:
+            return self.buffer[: self.count].copy()
+        return np.concatenate((self.buffer[self.i :], self.buffer[: self.i]))
+
+    def dump(self, reason, block=True):
+        """
+        Writes the buffer to <dump_dir>/flight_<date>_<ms>_<reason>.rec. With
+        block=False, the file is written by a thread (only the copy of the
+        buffer is done by the caller). Returns the path
+        """
+        records = self.snapshot()
+        now = time.time()
+        date = time.strftime("%Y%m%d_%H%M%S", time.localtime(now))
+        path = os.path.join(
+            self.dump_dir, f"flight_{date}_{int(now * 1000) % 1000:03d}_{reason}.rec"
+        )
+        metadata = dict(self.metadata, reason=reason, dump_time=now)
+
+        def write():
+            with open(path, "wb") as f:
+                write_header(f, self.schema, metadata)
+                f.write(records.tobytes())
+            print(
+                f"[FlightRecorder] {reason} : last {len(records)} ticks saved to {path}"
+            )
+
+        if block:
+            write()
+        else:
+            writer = Thread(target=write)
+            writer.start()
+            self.writers.append(writer)
+        self.dumps.append(path)
+        return path
+
+    def check_tilt(self, accelero):
+        """
+        Dumps once when the tilt goes above tilt_threshold, rearmed when it
+        goes back under half of it. Returns the tilt
+        """
+        tilt = tilt_from_accelero(accelero)
+        if self.tilt_threshold is None:
+            return tilt
+        if not self.tilted and tilt > self.tilt_threshold:
+            self.tilted = True
+            self.dump("tilt", block=False)
+        elif self.tilted and tilt < self.tilt_threshold / 2:
+            self.tilted = False
+        return tilt
+
+    def wait(self):
+        for writer in self.writers:
+            writer.join()
+        self.writers = []
+
+
+if __name__ == "__main__":
+    from mini_bdx_runtime.run_recorder import load_recording
+
+    flight_recorder = FlightRecorder(
+        {"obs": 101, "action": 14, "accelero": 3}, freq=50, duration=10
+    )
+    obs = np.random.rand(101)
+    action = np.random.rand(14)
+    accelero = np.array([0, 0, 9.81])
+
+    nb_calls = 10000
+    s = time.perf_counter()
+    for i in range(nb_calls):
+        flight_recorder.record(time.time(), obs=obs, action=action, accelero=accelero)
+        flight_recorder.check_tilt(accelero)
+    print("record + check_tilt : ", (time.perf_counter() - s) / nb_calls * 1e6, "us")
+
+    path = flight_recorder.dump("test")
+    data, metadata = load_recording(path)
+    print(metadata, data["obs"].shape, np.all(np.diff(data["timestamp"]) >= 0))
+    os.remove(path)
@@ -0,0 +1,103 @@
+import math
+import time
+
+import numpy as np
+
+
+class GaitPhase:
+    """
+    Imitation phase of the gait, given to the policy as (cos, sin).
+
+    By default the phase advances by one step per tick (scaled by the phase
+    frequency factor), as before. With use_time, it follows the monotonic
+    clock instead, so it stays in sync with real time when a tick overruns or
+    is skipped. The tick counted phase is always tracked, phase_error is the
+    difference between the two (in periods).
+
+    Before the first update() the output is (0, 0), as before.
+    """
+
+    def __init__(self, nb_steps_in_period, control_freq, use_time=False):
+        self.nb_steps_in_period = nb_steps_in_period
+        self.control_freq = control_freq
+        self.use_time = use_time
+
+        self.phase = 0.0  # [0, 1[
+        self.tick_phase = 0.0
+        self.last_time = None
+        self.started = False
+
+    def reset_clock(self):
+        """
+        Call when the gait stops (pause), so that the time spent stopped doesn't
+        advance the phase
+        """
+        self.last_time = None
+
+    def update(self, frequency_factor=1.0, now=None):
+        if now is None:
+            now = time.monotonic()
+        # one step of the reference motion per nominal tick
+        nominal_dt = 1 / self.control_freq
+        if self.last_time is None:
+            dt = nominal_dt
+        else:
+            dt = now - self.last_time
+        self.last_time = now
+        self.started = True
+
+        step = frequency_factor / self.nb_steps_in_period
+        self.tick_phase = (self.tick_phase + step) % 1.0
+        if self.use_time:
+            self.phase = (self.phase + step * dt / nominal_dt) % 1.0
+        else:
+            self.phase = self.tick_phase
+
+    @property
+    def phase_error(self):
+        """
+        Phase minus tick counted phase, in periods ([-0.5, 0.5[)
+        """
+        return (self.phase - self.tick_phase + 0.5) % 1.0 - 0.5
+
+    def write(self, out):
+        """
+        Writes (cos, sin) of the phase in out (for example the observation's
+        slice)
+        """
+        if not self.started:
+            out[0] = 0.0
+            out[1] = 0.0
+            return out
+        angle = 2 * math.pi * self.phase
+        out[0] = math.cos(angle)
+        out[1] = math.sin(angle)
+        return out
+
+    def get(self):
+        return self.write(np.zeros(2))
+
+
+if __name__ == "__main__":
+    gait_phase = GaitPhase(27, 50)
+    print("Before the first update : ", gait_phase.get())
+    gait_phase.update()
+
+    out = np.zeros(2)
+    nb_calls = 100000
+    s = time.perf_counter()
+    for i in range(nb_calls):
+        gait_phase.write(out)
+    print("write : ", (time.perf_counter() - s) / nb_calls * 1e6, "us")
+    s = time.perf_counter()
+    for i in range(nb_calls):
+        np.array([np.cos(i / 27 * 2 * np.pi), np.sin(i / 27 * 2 * np.pi)])
+    print("np.cos/np.sin : ", (time.perf_counter() - s) / nb_calls * 1e6, "us")
+
+    # a 3 ticks overrun: the tick counted phase falls behind real time
+    gait_phase = GaitPhase(27, 50, use_time=True)
+    t = 0
+    for i in range(100):
+        t += 0.08 if i == 50 else 0.02
+        gait_phase.update(1.0, now=t)
+    print("Phase error after an overrun : ", gait_phase.phase_error, "periods")
@@ -10,7 +10,13 @@ import os
 from queue import Queue
 from threading import Thread
 import time
-from scipy.spatial.transform import Rotation as R
+from mini_bdx_runtime.rotation import (
+    PitchBias,
+    quat_is_valid,
+    quat_scalar_first_to_last,
+    euler_xyz_from_quat,
+    matrix_from_quat,
+)
 
 
 # TODO filter spikes
@@ -55,6 +61,7 @@ class Imu:
             )
 
         self.pitch_bias = self.nominal_pitch_bias + self.user_pitch_bias
+        self.pitch_bias_rot = PitchBias(np.deg2rad(self.pitch_bias))
 
         if self.calibrate:
             self.imu.mode = adafruit_bno055.NDOF_MODE
@@ -96,6 +103,9 @@ class Imu:
             print("Imu is running uncalibrated")
 
         self.last_imu_data = [0, 0, 0, 0]
+        # euler / matrix views of last_imu_data, computed once per sample
+        self.last_euler = None
+        self.last_mat = None
         self.imu_queue = Queue(maxsize=1)
         Thread(target=self.imu_worker, daemon=True).start()
 
@@ -108,31 +118,31 @@ class Imu:
             s = time.time()
             try:
                 # imu returns scalar first
-                raw_orientation = np.array(self.imu.quaternion).copy()  # quat
-                euler = (
-                    R.from_quat(raw_orientation, scalar_first=True)
-                    .as_euler("xyz")
-                    .copy()
-                )
+                raw_orientation = quat_scalar_first_to_last(self.imu.quaternion)
+                # all zeros until the fusion settles, skip these samples
+                if not quat_is_valid(raw_orientation):
+                    time.sleep(1 / self.sampling_freq)
+                    continue
+
+                # Converting to correct axes
+                # euler = self.convert_axes(euler)
+                # euler[2] = 0  # ignoring yaw
+
+                # gives scalar last, which is what isaac wants
+                final_orientation_quat = self.pitch_bias_rot.apply(raw_orientation)
             except Exception as e:
                 print("[IMU]:", e)
                 continue
 
-            # Converting to correct axes
-            # euler = self.convert_axes(euler)
-            euler[1] -= np.deg2rad(self.pitch_bias)
-            # euler[2] = 0  # ignoring yaw
-
-            # gives scalar last, which is what isaac wants
-            final_orientation_quat = R.from_euler("xyz", euler).as_quat()
-
-            self.imu_queue.put(final_orientation_quat.copy())
+            self.imu_queue.put(final_orientation_quat)
             took = time.time() - s
             time.sleep(max(0, 1 / self.sampling_freq - took))
 
     def get_data(self, euler=False, mat=False):
         try:
             self.last_imu_data = self.imu_queue.get(False)  # non blocking
+            self.last_euler = None
+            self.last_mat = None
         except Exception:
             pass
 
@@ -140,9 +150,13 @@ class Imu:
             if not euler and not mat:
                 return self.last_imu_data
             elif euler:
-                return R.from_quat(self.last_imu_data).as_euler("xyz")
+                if self.last_euler is None:
+                    self.last_euler = euler_xyz_from_quat(self.last_imu_data)
+                return self.last_euler
             elif mat:
-                return R.from_quat(self.last_imu_data).as_matrix()
+                if self.last_mat is None:
+                    self.last_mat = matrix_from_quat(self.last_imu_data)
+                return self.last_mat
 
         except Exception as e:
             print("[IMU]: ", e)
@@ -0,0 +1,218 @@
+import numpy as np
+
+from mini_bdx_runtime.filters import MedianFilter, Biquad
+
+GRAVITY = 9.81
+
+# Everything is disabled by default, the raw imu data goes through untouched
+DEFAULT_IMU_FILTER_CONFIG = {
+    "median_n": 0,  # 0 to disable, 3 or 5 are good values
+    "spike_threshold": None,  # only replace samples this far from the median
+    "lowpass_cutoff": None,  # Hz, None to disable
+    "gyro_bias_tracking": False,
+    "still_gyro_threshold": 0.05,  # rad/s
+    "still_accelero_threshold": 0.3,  # m/s^2, on the norm
+    "still_duration": 0.5,  # s
+    "gyro_bias_alpha": 0.01,
+}
+
+
+class GyroBiasTracker:
+    """
+    Estimates the gyro bias while the robot is standing still (low angular
+    rate and accelerometer norm close to g for still_duration) and removes it.
+    """
+
+    def __init__(
+        self,
+        sampling_freq,
+        still_gyro_threshold=0.05,
+        still_accelero_threshold=0.3,
+        still_duration=0.5,
+        alpha=0.01,
+    ):
+        self.still_gyro_threshold = still_gyro_threshold
+        self.still_accelero_threshold = still_accelero_threshold
+        self.still_samples = max(1, int(still_duration * sampling_freq))
+        self.alpha = alpha
+        self.bias = np.zeros(3)
+        self.tmp = np.zeros(3)
+        self.out = np.zeros(3)
+        self.still_count = 0
+
+    def reset(self):
+        self.bias[:] = 0
+        self.still_count = 0
+
+    def is_still(self, gyro, accelero):
+        np.subtract(gyro, self.bias, out=self.tmp)
+        return (
+            np.dot(self.tmp, self.tmp) < self.still_gyro_threshold**2
+            and abs(np.sqrt(np.dot(accelero, accelero)) - GRAVITY)
+            < self.still_accelero_threshold
+        )
+
+    def update(self, gyro, accelero):
+        if self.is_still(gyro, accelero):
+            self.still_count += 1
+        else:
+            self.still_count = 0
+
+        if self.still_count >= self.still_samples:
+            # bias += alpha * (gyro - bias)
+            np.subtract(gyro, self.bias, out=self.tmp)
+            self.tmp *= self.alpha
+            self.bias += self.tmp
+
+        np.subtract(gyro, self.bias, out=self.out)
+        return self.out
+
+
+class IMUFilter:
+    """
+    Streaming filter stage for raw gyro/accelero data.
+    gyro and accelero are stacked into one 6 channels vector so that each stage
+    is a single vectorized call :
+        median (spike rejection) -> gyro bias removal -> biquad low pass
+    """
+
+    def __init__(self, sampling_freq, config={}):
+        self.sampling_freq = sampling_freq
+        self.config = DEFAULT_IMU_FILTER_CONFIG.copy()
+        self.config.update(config)
+
+        self.x = np.zeros(6)
+
+        self.median = None
+        if self.config["median_n"] > 1:
+            self.median = MedianFilter(
+                6, self.config["median_n"], self.config["spike_threshold"]
+            )
+
+        self.gyro_bias = None
+        if self.config["gyro_bias_tracking"]:
+            self.gyro_bias = GyroBiasTracker(
+                sampling_freq,
+                self.config["still_gyro_threshold"],
+                self.config["still_accelero_threshold"],
+                self.config["still_duration"],
+                self.config["gyro_bias_alpha"],
+            )
+
+        self.lowpass = None
+        if self.config["lowpass_cutoff"] is not None:
+            self.lowpass = Biquad(6, sampling_freq, self.config["lowpass_cutoff"])
+
+    @property
+    def enabled(self):
+        return (
+            self.median is not None
+            or self.gyro_bias is not None
+            or self.lowpass is not None
+        )
+
+    def reset(self):
+        for f in [self.median, self.gyro_bias, self.lowpass]:
+            if f is not None:
+                f.reset()
+
+    def update(self, gyro, accelero):
+        """
+        Returns a view on the filtered [gyro, accelero] vector, copy it if you
+        need to keep it across calls
+        """
+        self.x[:3] = gyro
+        self.x[3:] = accelero
+        x = self.x
+
+        if self.median is not None:
+            x = self.median.update(x)
+
+        if self.gyro_bias is not None:
+            self.x[:3] = self.gyro_bias.update(x[:3], x[3:])
+            self.x[3:] = x[3:]
+            x = self.x
+
+        if self.lowpass is not None:
+            x = self.lowpass.update(x)
+
+        return x
+
+    def replay(self, gyros, acceleros):
+        """
+        Runs the filters over recorded (N, 3) gyro and accelero arrays, from a
+        fresh state. Returns the filtered (N, 3) gyros and acceleros
+        """
+        self.reset()
+        gyros = np.asarray(gyros, dtype=np.float64)
+        acceleros = np.asarray(acceleros, dtype=np.float64)
+        out = np.empty((len(gyros), 6))
+        for i in range(len(gyros)):
+            out[i] = self.update(gyros[i], acceleros[i])
+        return out[:, :3], out[:, 3:]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from mini_bdx_runtime.run_recorder import load_observations
+
+    parser = argparse.ArgumentParser(
+        description="Replay recorded imu data through the filters, for tuning"
+    )
+    parser.add_argument(
+        "-f",
+        "--file",
+        type=str,
+        required=True,
+        help="observations recorded with --save_obs (robot_saved_obs.rec or .pkl)",
+    )
+    parser.add_argument("--freq", type=float, default=50, help="sampling freq")
+    parser.add_argument("--median_n", type=int, default=0)
+    parser.add_argument("--spike_threshold", type=float, default=None)
+    parser.add_argument("--lowpass_cutoff", type=float, default=None)
+    parser.add_argument("--gyro_bias_tracking", action="store_true", default=False)
+    parser.add_argument("--no_plot", action="store_true", default=False)
+    args = parser.parse_args()
+
+    obs = load_observations(args.file)
+    gyros = obs[:, 0:3]
+    acceleros = obs[:, 3:6]
+
+    imu_filter = IMUFilter(
+        args.freq,
+        {
+            "median_n": args.median_n,
+            "spike_threshold": args.spike_threshold,
+            "lowpass_cutoff": args.lowpass_cutoff,
+            "gyro_bias_tracking": args.gyro_bias_tracking,
+        },
+    )
+    filtered_gyros, filtered_acceleros = imu_filter.replay(gyros, acceleros)
+
+    print("Samples :", len(obs))
+    print("gyro std raw / filtered :", gyros.std(0), filtered_gyros.std(0))
+    print(
+        "accelero std raw / filtered :", acceleros.std(0), filtered_acceleros.std(0)
+    )
+    if imu_filter.gyro_bias is not None:
+        print("Final gyro bias :", imu_filter.gyro_bias.bias)
+
+    if not args.no_plot:
+        import matplotlib.pyplot as plt
+
+        times = np.arange(len(obs)) / args.freq
+        plt.figure()
+        for axis in range(3):
+            plt.subplot(6, 1, axis + 1)
+            plt.plot(times, gyros[:, axis], label=f"gyro {axis} raw")
+            plt.plot(times, filtered_gyros[:, axis], label=f"gyro {axis} filtered")
+            plt.legend()
+            plt.subplot(6, 1, axis + 4)
+            plt.plot(times, acceleros[:, axis], label=f"accelero {axis} raw")
+            plt.plot(
+                times, filtered_acceleros[:, axis], label=f"accelero {axis} filtered"
+            )
+            plt.legend()
+        plt.tight_layout()
+        plt.show()
@@ -0,0 +1,358 @@
+# Binary IMU streaming, to look at the duck's imu from other computers (see
+# scripts/imu_server.py and scripts/imu_client.py).
+#
+# Frames are fixed size (FRAME, little endian) : magic, flags, sequence
+# number, timestamp (s, server clock), quaternion (scalar last), gyro and
+# accelero. The flags tell which of the quaternion / raw data are valid.
+#
+# TCP : a client sends a REQUEST (magic, rate in Hz) after connecting, and can
+# send another one at any time to change its rate. Each client gets the
+# frames at its own rate, a client too slow to keep up loses frames instead of
+# slowing down the others.
+# UDP multicast : the frames are sent to a group at a fixed rate, for any
+# number of listeners.
+import math
+import selectors
+import socket
+import struct
+import time
+from threading import Thread
+
+import numpy as np
+
+MAGIC = 0xD0C5
+FRAME = struct.Struct("<HHId4f3f3f")
+REQUEST = struct.Struct("<Hf")
+HAS_QUAT = 1
+HAS_RAW = 2
+DEFAULT_PORT = 1234
+DEFAULT_MULTICAST = ("239.255.13.37", 5007)
+
+
+def pack_imu_frame(buffer, seq, timestamp, data):
+    """
+    data is a quaternion (imu.Imu) or a {"gyro", "accelero"} dict (raw_imu.Imu,
+    sim_sensors imus)
+    """
+    if isinstance(data, dict):
+        FRAME.pack_into(
+            buffer,
+            0,
+            MAGIC,
+            HAS_RAW,
+            seq,
+            timestamp,
+            0.0,
+            0.0,
+            0.0,
+            1.0,
+            *data["gyro"],
+            *data["accelero"],
+        )
+    else:
+        FRAME.pack_into(
+            buffer, 0, MAGIC, HAS_QUAT, seq, timestamp, *data, 0, 0, 0, 0, 0, 0
+        )
+
+
+def unpack_imu_frame(buffer):
+    """
+    Returns a dict, or None if the frame is invalid
+    """
+    values = FRAME.unpack_from(buffer)
+    if values[0] != MAGIC:
+        return None
+    flags = values[1]
+    frame = {"seq": values[2], "timestamp": values[3]}
+    if flags & HAS_QUAT:
+        frame["quat"] = np.array(values[4:8])
+    if flags & HAS_RAW:
+        frame["gyro"] = np.array(values[8:11])
+        frame["accelero"] = np.array(values[11:14])
+    return frame
+
+
+def parse_group(group):
+    """
+    "ip:port" or "ip" (default port)
+    """
+    if ":" in group:
+        ip, port = group.rsplit(":", 1)
+        return ip, int(port)
+    return group, DEFAULT_MULTICAST[1]
+
+
+class StreamClient:
+    def __init__(self, conn, address):
+        self.conn = conn
+        self.address = address
+        self.rate = 0  # no frames until the client's request
+        self.next_time = 0.0
+        self.pending = b""  # rest of a partially sent frame
+        self.request_buffer = b""
+        self.nb_sent = 0
+        self.nb_dropped = 0
+
+
+class IMUStreamServer:
+    def __init__(
+        self,
+        imu,
+        freq=50,
+        host="0.0.0.0",
+        port=DEFAULT_PORT,
+        multicast=None,
+        multicast_rate=30,
+        max_rate=None,
+    ):
+        """
+        imu is anything with a non blocking get_data(), read at freq in the
+        server's thread, whatever the number of clients. Only new samples are
+        sent (get_data() returns the same object until there is one). The
+        clients' rates are capped at max_rate (freq by default). multicast is
+        an (ip, port) group, or None
+        """
+        self.imu = imu
+        # the imus return their cached last_imu_data when there is no new
+        # sample, starting with a placeholder
+        self.last_data = getattr(imu, "last_imu_data", None)
+        self.freq = freq
+        self.max_rate = freq if max_rate is None else max_rate
+
+        self.selector = selectors.DefaultSelector()
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_socket.bind((host, port))
+        self.server_socket.listen()
+        self.server_socket.setblocking(False)
+        self.selector.register(self.server_socket, selectors.EVENT_READ)
+        self.clients = {}
+
+        self.multicast = multicast
+        self.multicast_rate = multicast_rate
+        self.multicast_socket = None
+        if self.multicast is not None:
+            self.multicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.multicast_socket.setsockopt(
+                socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1
+            )
+            self.multicast_socket.setblocking(False)
+        self.next_multicast_time = 0.0
+
+        self.frame = bytearray(FRAME.size)
+        self.seq = 0
+        self.nb_multicast_dropped = 0
+        self.stop = False
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def accept(self):
+        try:
+            conn, address = self.server_socket.accept()
+        except OSError as e:
+            # e.g. the client reset the connection before it was accepted
+            print("[IMUStreamServer] accept :", e)
+            return
+        conn.setblocking(False)
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.clients[conn] = StreamClient(conn, address)
+        self.selector.register(conn, selectors.EVENT_READ)
+        print(f"[IMUStreamServer] Connection from {address}")
+
+    def drop_client(self, client, reason):
+        self.selector.unregister(client.conn)
+        client.conn.close()
+        del self.clients[client.conn]
+        print(
+            f"[IMUStreamServer] {client.address} disconnected ({reason}),"
+            f" {client.nb_sent} frames sent, {client.nb_dropped} dropped"
+        )
+
+    def read_request(self, client):
+        try:
+            data = client.conn.recv(1024)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.drop_client(client, e)
+            return
+        if not data:
+            self.drop_client(client, "closed")
+            return
+        client.request_buffer += data
+        while len(client.request_buffer) >= REQUEST.size:
+            magic, rate = REQUEST.unpack_from(client.request_buffer)
+            client.request_buffer = client.request_buffer[REQUEST.size :]
+            if magic != MAGIC or not math.isfinite(rate):
+                self.drop_client(client, "invalid request")
+                return
+            client.rate = min(max(rate, 0), self.max_rate)
+            client.next_time = time.monotonic()
+            print(f"[IMUStreamServer] {client.address} rate {client.rate:.1f}Hz")
+
+    def send(self, client, data):
+        """
+        Non blocking, returns False if the client was dropped
+        """
+        try:
+            sent = client.conn.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError as e:
+            self.drop_client(client, e)
+            return False
+        client.pending = bytes(data[sent:])
+        if len(client.pending) > 0:
+            # the frames are skipped until the socket can take the rest
+            self.selector.modify(
+                client.conn, selectors.EVENT_READ | selectors.EVENT_WRITE
+            )
+        return True
+
+    def flush(self, client):
+        if self.send(client, client.pending) and len(client.pending) == 0:
+            self.selector.modify(client.conn, selectors.EVENT_READ)
+
+    def publish(self, now):
+        for client in list(self.clients.values()):
+            if client.rate <= 0 or now < client.next_time:
+                continue
+            # late clients don't get a burst of frames to catch up
+            client.next_time = max(client.next_time + 1 / client.rate, now)
+            if len(client.pending) > 0:
+                client.nb_dropped += 1
+                continue
+            if self.send(client, self.frame):
+                client.nb_sent += 1
+
+        if self.multicast_socket is not None and now >= self.next_multicast_time:
+            self.next_multicast_time = max(
+                self.next_multicast_time + 1 / self.multicast_rate, now
+            )
+            try:
+                self.multicast_socket.sendto(self.frame, self.multicast)
+            except OSError:
+                self.nb_multicast_dropped += 1
+
+    def run(self):
+        next_sample = time.monotonic()
+        while not self.stop:
+            timeout = max(0, next_sample - time.monotonic())
+            for key, mask in self.selector.select(timeout):
+                if key.fileobj is self.server_socket:
+                    self.accept()
+                    continue
+                client = self.clients.get(key.fileobj)
+                if client is not None and mask & selectors.EVENT_WRITE:
+                    self.flush(client)
+                client = self.clients.get(key.fileobj)
+                if client is not None and mask & selectors.EVENT_READ:
+                    self.read_request(client)
+
+            now = time.monotonic()
+            if now < next_sample:
+                continue
+            next_sample = max(next_sample + 1 / self.freq, now)
+
+            try:
+                data = self.imu.get_data()
+                if data is None or data is self.last_data:
+                    continue
+                self.last_data = data
+                pack_imu_frame(self.frame, self.seq, time.time(), data)
+            except Exception as e:
+                print("[IMUStreamServer] imu :", e)
+                continue
+            self.seq += 1
+            self.publish(now)
+
+        for client in list(self.clients.values()):
+            self.drop_client(client, "server stopped")
+        self.selector.close()
+        self.server_socket.close()
+        if self.multicast_socket is not None:
+            self.multicast_socket.close()
+
+    def close(self):
+        self.stop = True
+        self.thread.join()
+
+
+class IMUStreamClient:
+    def __init__(self, host=None, port=DEFAULT_PORT, rate=30, multicast=None):
+        """
+        Connects to host:port and asks for rate Hz, or listens to a multicast
+        (ip, port) group. The frames are read by a thread, get_frame() returns
+        the last one
+        """
+        self.multicast = multicast
+        if multicast is None:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            while True:
+                try:
+                    self.sock.connect((host, port))
+                    break
+                except OSError as e:
+                    print(e)
+                    time.sleep(0.5)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.set_rate(rate)
+        else:
+            ip, port = multicast
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.sock.bind(("", port))
+            membership = struct.pack("4s4s", socket.inet_aton(ip), bytes(4))
+            self.sock.setsockopt(
+                socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership
+            )
+
+        self.last_frame = None
+        self.nb_frames = 0
+        self.connected = True
+        Thread(target=self.receive_worker, daemon=True).start()
+
+    def set_rate(self, rate):
+        self.sock.sendall(REQUEST.pack(MAGIC, rate))
+
+    def receive_worker(self):
+        buffer = bytearray(FRAME.size)
+        view = memoryview(buffer)
+        while True:
+            try:
+                if self.multicast is None:
+                    received = 0
+                    while received < FRAME.size:
+                        n = self.sock.recv_into(view[received:])
+                        if n == 0:
+                            raise ConnectionError("closed by the server")
+                        received += n
+                else:
+                    if self.sock.recv_into(buffer) != FRAME.size:
+                        continue
+            except OSError as e:
+                if self.connected:  # not closed by close()
+                    print("[IMUStreamClient]", e)
+                self.connected = False
+                return
+
+            frame = unpack_imu_frame(buffer)
+            if frame is None:
+                continue
+            self.last_frame = frame
+            self.nb_frames += 1
+
+    def get_frame(self):
+        return self.last_frame
+
+    def get_imu(self):
+        """
+        Last quaternion (scalar last), like the previous pickle client
+        """
+        if self.last_frame is None or "quat" not in self.last_frame:
+            return [0, 0, 0, 1]
+        return self.last_frame["quat"]
+
+    def close(self):
+        self.connected = False
+        self.sock.close()
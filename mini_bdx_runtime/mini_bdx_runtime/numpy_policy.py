@@ -0,0 +1,226 @@
+# Pure numpy executor for small MLP policies exported to onnx.
+# For a batch of one, onnxruntime's per call overhead can be bigger than the
+# actual math. This reads the onnx graph, checks that it only uses supported
+# ops (Gemm/MatMul/elementwise/activations/Split), extracts the weights into
+# contiguous float32 arrays and runs the forward pass with preallocated
+# intermediates.
+import numpy as np
+
+SUPPORTED_OPS = [
+    "Gemm",
+    "MatMul",
+    "Add",
+    "Sub",
+    "Mul",
+    "Div",
+    "Relu",
+    "LeakyRelu",
+    "Elu",
+    "Sigmoid",
+    "Tanh",
+    "Split",
+    "Identity",
+]
+
+
+class UnsupportedGraphError(Exception):
+    pass
+
+
+def get_attributes(node):
+    import onnx
+
+    return {a.name: onnx.helper.get_attribute_value(a) for a in node.attribute}
+
+
+class NumpyMLP:
+    def __init__(self, onnx_model_path, batch_size=1):
+        try:
+            import onnx
+            from onnx import numpy_helper
+        except ImportError:
+            raise UnsupportedGraphError("The onnx package is needed to read the graph")
+
+        model = onnx.load(onnx_model_path)
+        graph = model.graph
+
+        self.constants = {
+            init.name: np.ascontiguousarray(numpy_helper.to_array(init), np.float32)
+            for init in graph.initializer
+        }
+        graph_inputs = [i for i in graph.input if i.name not in self.constants]
+        if len(graph_inputs) != 1 or len(graph.output) != 1:
+            raise UnsupportedGraphError("Only single input/output graphs are supported")
+
+        self.input_name = graph_inputs[0].name
+        self.output_name = graph.output[0].name
+        dims = graph_inputs[0].type.tensor_type.shape.dim
+        input_size = dims[-1].dim_value
+
+        # every tensor of the graph, preallocated (or views for Split/Identity)
+        self.buffers = {self.input_name: np.zeros((batch_size, input_size), np.float32)}
+        self.steps = []
+        for node in graph.node:
+            if node.op_type == "Constant":
+                attrs = get_attributes(node)
+                self.constants[node.output[0]] = np.ascontiguousarray(
+                    numpy_helper.to_array(attrs["value"]), np.float32
+                )
+                continue
+            if node.op_type not in SUPPORTED_OPS:
+                raise UnsupportedGraphError(f"Unsupported op {node.op_type}")
+            self.add_step(node)
+
+        if self.output_name not in self.buffers:
+            raise UnsupportedGraphError("Graph output is not computed")
+
+        self.input_buffer = self.buffers[self.input_name]
+        self.output_buffer = self.buffers[self.output_name]
+
+    def get(self, name):
+        if name in self.constants:
+            return self.constants[name]
+        if name in self.buffers:
+            return self.buffers[name]
+        raise UnsupportedGraphError(f"Unknown tensor {name}")
+
+    def alloc(self, name, shape):
+        self.buffers[name] = np.zeros(shape, np.float32)
+        return self.buffers[name]
+
+    def add_step(self, node):
+        op = node.op_type
+        attrs = get_attributes(node)
+        ins = [self.get(name) for name in node.input if name != ""]
+
+        if op == "Gemm":
+            if attrs.get("transA", 0):
+                raise UnsupportedGraphError("Gemm with transA is not supported")
+            if node.input[1] not in self.constants:
+                raise UnsupportedGraphError("Gemm weights must be constant")
+            x = ins[0]
+            w = ins[1].T if attrs.get("transB", 0) else ins[1]
+            w = np.ascontiguousarray(w * attrs.get("alpha", 1.0), np.float32)
+            out = self.alloc(node.output[0], (x.shape[0], w.shape[1]))
+            b = None
+            if len(ins) > 2:
+                b = np.ascontiguousarray(ins[2] * attrs.get("beta", 1.0), np.float32)
+
+            def gemm():
+                np.dot(x, w, out=out)
+                if b is not None:
+                    np.add(out, b, out=out)
+
+            self.steps.append(gemm)
+        elif op == "MatMul":
+            x, w = ins
+            if w.ndim != 2 or x.ndim != 2:
+                raise UnsupportedGraphError("Only 2D MatMul is supported")
+            out = self.alloc(node.output[0], (x.shape[0], w.shape[1]))
+            self.steps.append(lambda: np.dot(x, w, out=out))
+        elif op in ["Add", "Sub", "Mul", "Div"]:
+            func = {
+                "Add": np.add,
+                "Sub": np.subtract,
+                "Mul": np.multiply,
+                "Div": np.divide,
+            }[op]
+            a, b = ins
+            out = self.alloc(node.output[0], np.broadcast_shapes(a.shape, b.shape))
+            self.steps.append(lambda: func(a, b, out=out))
+        elif op == "Relu":
+            x = ins[0]
+            out = self.alloc(node.output[0], x.shape)
+            self.steps.append(lambda: np.maximum(x, 0, out=out))
+        elif op == "LeakyRelu":
+            x = ins[0]
+            alpha = attrs.get("alpha", 0.01)
+            out = self.alloc(node.output[0], x.shape)
+            self.steps.append(lambda: np.maximum(x, alpha * x, out=out))
+        elif op == "Elu":
+            x = ins[0]
+            alpha = attrs.get("alpha", 1.0)
+            out = self.alloc(node.output[0], x.shape)
+
+            def elu():
+                np.minimum(x, 0, out=out)
+                np.expm1(out, out=out)
+                np.multiply(out, alpha, out=out)
+                np.copyto(out, x, where=x > 0)
+
+            self.steps.append(elu)
+        elif op == "Sigmoid":
+            x = ins[0]
+            out = self.alloc(node.output[0], x.shape)
+
+            def sigmoid():
+                # 0.5 * (1 + tanh(x / 2)), doesn't overflow like 1 / (1 + exp(-x))
+                np.multiply(x, 0.5, out=out)
+                np.tanh(out, out=out)
+                np.multiply(out, 0.5, out=out)
+                np.add(out, 0.5, out=out)
+
+            self.steps.append(sigmoid)
+        elif op == "Tanh":
+            x = ins[0]
+            out = self.alloc(node.output[0], x.shape)
+            self.steps.append(lambda: np.tanh(x, out=out))
+        elif op == "Split":
+            # outputs are views on the input, nothing to run
+            x = ins[0]
+            axis = attrs.get("axis", 0) % x.ndim
+            if "split" in attrs:
+                split = list(attrs["split"])
+            elif len(ins) > 1:
+                split = [int(s) for s in ins[1]]
+            else:
+                size = x.shape[axis] // len(node.output)
+                split = [size] * len(node.output)
+            start = 0
+            for name, size in zip(node.output, split):
+                index = [slice(None)] * x.ndim
+                index[axis] = slice(start, start + size)
+                self.buffers[name] = x[tuple(index)]
+                start += size
+        elif op == "Identity":
+            self.buffers[node.output[0]] = ins[0]
+
+    def forward(self):
+        for step in self.steps:
+            step()
+        return self.output_buffer
+
+    def infer(self, inputs):
+        """
+        inputs is (batch_size, input_size) or (input_size,) for a batch of 1.
+        Warning: returns a view on the output buffer, overwritten by the next call
+        """
+        if np.ndim(inputs) == 1:
+            self.input_buffer[0] = inputs
+            return self.forward()[0]
+        self.input_buffer[:] = inputs
+        return self.forward()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import onnxruntime
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--onnx_model_path", type=str, required=True)
+    parser.add_argument("-n", "--nb_calls", type=int, default=1000)
+    args = parser.parse_args()
+
+    mlp = NumpyMLP(args.onnx_model_path)
+    sess = onnxruntime.InferenceSession(
+        args.onnx_model_path, providers=["CPUExecutionProvider"]
+    )
+    inputs = np.random.uniform(size=mlp.input_buffer.shape[1]).astype(np.float32)
+    ref = sess.run(None, {mlp.input_name: [inputs]})[0][0]
+    print("Max diff with onnxruntime: ", np.abs(mlp.infer(inputs) - ref).max())
+
+    start = time.perf_counter()
+    for i in range(args.nb_calls):
+        mlp.infer(inputs)
+    print("Average time: ", (time.perf_counter() - start) / args.nb_calls)
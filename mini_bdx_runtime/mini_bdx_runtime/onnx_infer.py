@@ -1,16 +1,271 @@
+import json
+import os
+import platform
+import time
+
+import numpy as np
 import onnxruntime
 
+from mini_bdx_runtime.numpy_policy import NumpyMLP, UnsupportedGraphError
+from mini_bdx_runtime.policy_profiler import PolicyProfiler
+from mini_bdx_runtime.remote_policy import RemotePolicyClient
+
+# Session profiles, can be selected by name or given as a dict.
+# - intra_op_num_threads / inter_op_num_threads : 0 lets onnxruntime decide
+# - graph_optimization_level : "disable", "basic", "extended" or "all"
+# - execution_mode : "sequential" or "parallel"
+# - allow_spinning : busy wait between ops. Fast, but steals cpu from the
+#   sensor threads on the pi
+# - optimized_model_cache : path where the optimized graph is saved on first
+#   run and loaded from on the next ones. True uses
+#   <model>.<profile>.ort<version>.opt.onnx. The settings that produced it are
+#   saved next to it (<cache>.json) and checked before reusing it, the "all"
+#   level graphs are specific to the machine
+SESSION_PROFILES = {
+    "default": {},
+    "pi": {
+        "intra_op_num_threads": 1,
+        "inter_op_num_threads": 1,
+        "graph_optimization_level": "all",
+        "execution_mode": "sequential",
+        "allow_spinning": False,
+        "optimized_model_cache": True,
+    },
+}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def get_session_profile(session_profile):
+    if session_profile is None:
+        return {}
+    if isinstance(session_profile, str):
+        if session_profile not in SESSION_PROFILES:
+            raise ValueError(
+                f"Unknown session profile {session_profile}, use one of {list(SESSION_PROFILES.keys())} or a dict"
+            )
+        return SESSION_PROFILES[session_profile]
+    return session_profile
+
+
+def optimized_model_key(onnx_model_path, profile):
+    """
+    What an optimized model depends on, saved with the cache
+    """
+    return {
+        "source": os.path.abspath(onnx_model_path),
+        "source_mtime": os.path.getmtime(onnx_model_path),
+        "onnxruntime": onnxruntime.__version__,
+        "graph_optimization_level": profile.get("graph_optimization_level"),
+        "machine": platform.machine(),
+    }
+
+
+def make_session(onnx_model_path, session_profile=None, profile_prefix=None):
+    """
+    Creates the InferenceSession for onnx_model_path following session_profile
+    (see SESSION_PROFILES). If profile_prefix is set, onnxruntime's profiler is
+    enabled and writes its trace to <profile_prefix>_<date>.json
+    """
+    profile = get_session_profile(session_profile)
+    so = onnxruntime.SessionOptions()
+    if profile_prefix is not None:
+        so.enable_profiling = True
+        so.profile_file_prefix = profile_prefix
+
+    if "intra_op_num_threads" in profile:
+        so.intra_op_num_threads = profile["intra_op_num_threads"]
+    if "inter_op_num_threads" in profile:
+        so.inter_op_num_threads = profile["inter_op_num_threads"]
+    if "execution_mode" in profile:
+        so.execution_mode = EXECUTION_MODES[profile["execution_mode"]]
+    if "allow_spinning" in profile:
+        spinning = "1" if profile["allow_spinning"] else "0"
+        so.add_session_config_entry("session.intra_op.allow_spinning", spinning)
+        so.add_session_config_entry("session.inter_op.allow_spinning", spinning)
+    if "graph_optimization_level" in profile:
+        so.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[
+            profile["graph_optimization_level"]
+        ]
+
+    model_path = onnx_model_path
+    cache = profile.get("optimized_model_cache", None)
+    save_key = None
+    if cache:
+        if cache is True:
+            name = session_profile if isinstance(session_profile, str) else "custom"
+            cache = (
+                f"{os.path.splitext(onnx_model_path)[0]}.{name}"
+                f".ort{onnxruntime.__version__}.opt.onnx"
+            )
+        key = optimized_model_key(onnx_model_path, profile)
+        cached_key = None
+        if os.path.exists(cache) and os.path.exists(cache + ".json"):
+            cached_key = json.load(open(cache + ".json"))
+        if cached_key == key:
+            # already optimized with the same settings, don't redo it
+            print(f"[OnnxInfer] Loading cached optimized model {cache}")
+            model_path = cache
+            so.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS["disable"]
+        else:
+            print(f"[OnnxInfer] Saving optimized model to {cache}")
+            so.optimized_model_filepath = cache
+            save_key = key
+
+    session = onnxruntime.InferenceSession(
+        model_path, sess_options=so, providers=["CPUExecutionProvider"]
+    )
+    if save_key is not None:
+        # once the optimized model is written
+        json.dump(save_key, open(cache + ".json", "w"), indent=4)
+    return session
+
+
+# "auto" benchmarks onnxruntime against the numpy executor and keeps the fastest
+BACKENDS = ["onnxruntime", "numpy", "auto"]
+
+
+def static_shape(shape):
+    # dynamic dims (batch) are strings or None in onnxruntime, we use 1
+    return tuple(d if isinstance(d, int) else 1 for d in shape)
+
 
 class OnnxInfer:
-    def __init__(self, onnx_model_path, input_name="obs", awd=False):
+    def __init__(
+        self,
+        onnx_model_path,
+        input_name="obs",
+        awd=False,
+        session_profile=None,
+        io_binding=False,
+        backend="onnxruntime",
+        profile_calls=0,
+        remote=None,
+        remote_timeout=0.005,
+    ):
         self.onnx_model_path = onnx_model_path
-        self.ort_session = onnxruntime.InferenceSession(
-            self.onnx_model_path, providers=["CPUExecutionProvider"]
+
+        # profiles the first profile_calls inferences (onnxruntime backend)
+        self.profiler = None
+        profile_prefix = None
+        if profile_calls > 0:
+            self.profiler = PolicyProfiler(profile_calls)
+            profile_prefix = os.path.splitext(onnx_model_path)[0] + "_profile"
+
+        self.ort_session = make_session(
+            self.onnx_model_path, session_profile, profile_prefix
         )
         self.input_name = input_name
         self.awd = awd
+        self.latency = None
+
+        self.io_binding = None
+        if io_binding:
+            self.setup_io_binding()
+
+        self.numpy_policy = None
+        if backend in ["numpy", "auto"]:
+            self.setup_numpy_policy(auto=backend == "auto")
+        elif backend != "onnxruntime":
+            raise ValueError(f"Unknown backend {backend}, use one of {BACKENDS}")
+        self.backend = "numpy" if self.numpy_policy is not None else "onnxruntime"
+
+        # remote is "host:port" of a policy server (scripts/policy_server.py).
+        # The local backend is kept as the fallback when the reply misses
+        # remote_timeout
+        self.remote = None
+        if remote is not None:
+            if not self.awd:
+                raise ValueError(
+                    "Remote inference only supports single observations (awd)"
+                )
+            action_size = static_shape(self.ort_session.get_outputs()[0].shape)[-1]
+            self.remote = RemotePolicyClient(remote, remote_timeout, action_size)
+
+    def setup_numpy_policy(self, auto=False, nb_calls=200):
+        """
+        Loads the numpy executor, checks that it matches onnxruntime, and with
+        auto only keeps it if it is faster
+        """
+        try:
+            numpy_policy = NumpyMLP(self.onnx_model_path)
+        except UnsupportedGraphError as e:
+            if not auto:
+                raise
+            print("[OnnxInfer] numpy backend not available :", e)
+            return
+
+        inputs = self.dummy_inputs()
+        ort_infer = self.infer_onnxruntime
+        max_diff = np.abs(ort_infer(inputs) - numpy_policy.infer(inputs)).max()
+        if max_diff > 1e-4:
+            raise UnsupportedGraphError(
+                f"numpy backend doesn't match onnxruntime (max diff {max_diff})"
+            )
+
+        if auto:
+            ort_time = np.median(benchmark(ort_infer, inputs, nb_calls))
+            numpy_time = np.median(benchmark(numpy_policy.infer, inputs, nb_calls))
+            print(
+                f"[OnnxInfer] onnxruntime : {ort_time * 1e6:.1f}us, numpy : {numpy_time * 1e6:.1f}us"
+            )
+            if numpy_time >= ort_time:
+                return
+
+        print("[OnnxInfer] Using the numpy backend")
+        self.numpy_policy = numpy_policy
+
+    def setup_io_binding(self):
+        """
+        Binds preallocated float32 input/output buffers to the session, so
+        infer() doesn't convert the inputs or allocate outputs anymore.
+        """
+        input_meta = self.ort_session.get_inputs()[0]
+        output_meta = self.ort_session.get_outputs()[0]
+        self.input_buffer = np.zeros(static_shape(input_meta.shape), np.float32)
+        self.output_buffer = np.zeros(static_shape(output_meta.shape), np.float32)
+        # the OrtValues share the numpy buffers memory
+        self.input_ortvalue = onnxruntime.OrtValue.ortvalue_from_numpy(
+            self.input_buffer
+        )
+        self.output_ortvalue = onnxruntime.OrtValue.ortvalue_from_numpy(
+            self.output_buffer
+        )
+        self.io_binding = self.ort_session.io_binding()
+        self.io_binding.bind_ortvalue_input(self.input_name, self.input_ortvalue)
+        self.io_binding.bind_ortvalue_output(output_meta.name, self.output_ortvalue)
 
     def infer(self, inputs):
+        if self.remote is not None:
+            action = self.remote.infer(inputs)
+            if action is not None:
+                return action
+        if self.profiler is not None and self.profiler.active:
+            return self.infer_profiled(inputs)
+        return self.infer_backend(inputs)
+
+    def infer_backend(self, inputs):
+        if self.numpy_policy is not None:
+            return self.numpy_policy.infer(inputs)
+        return self.infer_onnxruntime(inputs)
+
+    def infer_onnxruntime(self, inputs):
+        if self.io_binding is not None:
+            if self.awd:
+                self.input_buffer[0] = inputs
+            else:
+                self.input_buffer[:] = inputs
+            return self.infer_bound()
         if self.awd:
             outputs = self.ort_session.run(None, {self.input_name: [inputs]})
             return outputs[0][0]
@@ -20,24 +275,171 @@ class OnnxInfer:
             )
             return outputs[0]
 
+    def infer_profiled(self, inputs):
+        """
+        Same as infer_onnxruntime without io binding, with each step timed
+        separately. Prints the report once profile_calls calls are done
+        """
+        s = time.perf_counter()
+        if self.awd:
+            inputs = np.asarray([inputs], dtype=np.float32)
+        else:
+            inputs = inputs.astype("float32")
+        t1 = time.perf_counter()
+        outputs = self.ort_session.run(None, {self.input_name: inputs})
+        t2 = time.perf_counter()
+        action = outputs[0][0] if self.awd else outputs[0]
+        t3 = time.perf_counter()
+        self.profiler.add(t1 - s, t2 - t1, t3 - t2)
+
+        if not self.profiler.active:
+            profile_path = self.ort_session.end_profiling()
+            self.profiler.make_report(profile_path)
+            self.profiler.print_report()
+
+        return action
+
+    def infer_bound(self):
+        """
+        Runs the policy on what is already in input_buffer (with io_binding).
+        Warning: returns a view on the output buffer, which is overwritten by
+        the next call
+        """
+        self.ort_session.run_with_iobinding(self.io_binding)
+        if self.awd:
+            return self.output_buffer[0]
+        return self.output_buffer
+
+    def dummy_inputs(self, seed=0):
+        obs_size = static_shape(self.ort_session.get_inputs()[0].shape)[-1]
+        inputs = np.random.default_rng(seed).uniform(-1, 1, size=obs_size)
+        if not self.awd:
+            inputs = inputs[np.newaxis]
+        return inputs
+
+    def warmup(self, nb_warmup_calls=50, nb_calls=200):
+        """
+        Runs the policy on dummy observations so that the lazy allocations and
+        kernel selection don't land on the first control ticks, then measures
+        the steady state latency. Returns the latency stats in seconds
+        """
+        inputs = self.dummy_inputs()
+        # infer_backend, so that the warmup doesn't use up the profiled calls
+        benchmark(self.infer_backend, inputs, nb_warmup_calls)
+        times = benchmark(self.infer_backend, inputs, nb_calls)
+        self.latency = {
+            "mean": float(times.mean()),
+            "p50": float(np.percentile(times, 50)),
+            "p99": float(np.percentile(times, 99)),
+            "max": float(times.max()),
+        }
+        print(
+            "[OnnxInfer] Warmup done, latency : "
+            + ", ".join(f"{k} {v * 1000:.2f}ms" for k, v in self.latency.items())
+        )
+        return self.latency
+
+    def check_latency(self, control_freq, budget_ratio=0.5, strict=True):
+        """
+        Checks that the p99 latency measured by warmup() fits in budget_ratio
+        of the control period. If not, raises (strict) or prints a warning,
+        with the highest control_freq that would fit.
+        """
+        if self.latency is None:
+            self.warmup()
+        budget = budget_ratio / control_freq
+        p99 = self.latency["p99"]
+        if p99 <= budget:
+            return True
+
+        suggested_freq = int(budget_ratio / p99)
+        msg = (
+            f"[OnnxInfer] p99 latency {p99 * 1000:.2f}ms doesn't fit the policy budget"
+            f" of {budget * 1000:.2f}ms at {control_freq}Hz ({budget_ratio * 100:.0f}% of the period)."
+            f" Try control_freq <= {suggested_freq}"
+        )
+        if strict:
+            raise RuntimeError(msg)
+        print(msg)
+        return False
+
+
+def benchmark(infer, inputs, nb_calls=1000):
+    times = []
+    for i in range(nb_calls):
+        start = time.perf_counter()
+        infer(inputs)
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
 
 if __name__ == "__main__":
     import argparse
-    import numpy as np
-    import time
 
     parser = argparse.ArgumentParser()
     parser.add_argument("-o", "--onnx_model_path", type=str, required=True)
+    parser.add_argument(
+        "--session_profile",
+        type=str,
+        default=None,
+        choices=list(SESSION_PROFILES.keys()),
+    )
+    parser.add_argument("-n", "--nb_calls", type=int, default=1000)
+    parser.add_argument("--backend", type=str, default="onnxruntime", choices=BACKENDS)
+    parser.add_argument(
+        "-c",
+        "--control_freq",
+        type=float,
+        default=None,
+        help="check that the policy fits in this control frequency",
+    )
+    parser.add_argument(
+        "--profile",
+        type=int,
+        default=0,
+        help="profile this many calls with onnxruntime's profiler and print a per operator report",
+    )
     args = parser.parse_args()
 
-    oi = OnnxInfer(args.onnx_model_path, awd=True)
-    inputs = np.random.uniform(size=54).astype(np.float32)
-    inputs = np.arange(47).astype(np.float32)
-    times = []
-    for i in range(1000):
-        start = time.time()
-        print(oi.infer(inputs))
-        times.append(time.time() - start)
+    if args.profile > 0:
+        oi_profiled = OnnxInfer(
+            args.onnx_model_path,
+            awd=True,
+            session_profile=args.session_profile,
+            profile_calls=args.profile,
+        )
+        inputs = oi_profiled.dummy_inputs()
+        for i in range(args.profile):
+            oi_profiled.infer(inputs)
+
+    oi = OnnxInfer(
+        args.onnx_model_path,
+        awd=True,
+        session_profile=args.session_profile,
+        backend=args.backend,
+    )
+    oi_bound = OnnxInfer(
+        args.onnx_model_path,
+        awd=True,
+        session_profile=args.session_profile,
+        io_binding=True,
+    )
+    if args.control_freq is not None:
+        oi.warmup()
+        oi.check_latency(args.control_freq, strict=False)
+
+    obs_size = static_shape(oi.ort_session.get_inputs()[0].shape)[-1]
+    inputs = np.random.uniform(size=obs_size)
+    print(oi.infer(inputs))
 
-    print("Average time: ", sum(times) / len(times))
-    print("Average fps: ", 1 / (sum(times) / len(times)))
+    print(
+        "Max diff with io binding: ",
+        np.abs(oi.infer(inputs) - oi_bound.infer(inputs)).max(),
+    )
+    for name, _oi in [(oi.backend, oi), ("io binding", oi_bound)]:
+        benchmark(_oi.infer, inputs, 100)  # warmup
+        times = benchmark(_oi.infer, inputs, args.nb_calls)
+        print(f"[{name}]")
+        print("Average time: ", times.mean())
+        print("Median time: ", np.median(times))
+        print("Average fps: ", 1 / times.mean())
@@ -0,0 +1,107 @@
+import json
+from collections import defaultdict
+
+import numpy as np
+
+
+def parse_ort_profile(profile_path):
+    """
+    Aggregates an onnxruntime profiling trace (json) into per operator and per
+    node kernel times, and the total time of each run. Times are in seconds
+    """
+    events = json.load(open(profile_path, "r"))
+
+    ops = defaultdict(lambda: {"total": 0.0, "count": 0})
+    nodes = defaultdict(lambda: {"total": 0.0, "count": 0, "op": ""})
+    runs = []
+    for event in events:
+        if event.get("cat") == "Node" and event["name"].endswith("_kernel_time"):
+            op = event.get("args", {}).get("op_name", "?")
+            node = event["name"][: -len("_kernel_time")]
+            dur = event["dur"] * 1e-6
+            ops[op]["total"] += dur
+            ops[op]["count"] += 1
+            nodes[node]["total"] += dur
+            nodes[node]["count"] += 1
+            nodes[node]["op"] = op
+        elif event.get("cat") == "Session" and event["name"] == "model_run":
+            runs.append(event["dur"] * 1e-6)
+
+    return dict(ops), dict(nodes), np.array(runs)
+
+
+class PolicyProfiler:
+    """
+    Collects the python side timings of OnnxInfer.infer (input conversion,
+    session run, output unpacking) for nb_calls calls, and builds the report
+    with onnxruntime's own trace.
+    """
+
+    def __init__(self, nb_calls):
+        self.nb_calls = nb_calls
+        self.input_times = []
+        self.run_times = []
+        self.output_times = []
+        self.report = None
+
+    @property
+    def active(self):
+        return len(self.run_times) < self.nb_calls
+
+    def add(self, input_time, run_time, output_time):
+        self.input_times.append(input_time)
+        self.run_times.append(run_time)
+        self.output_times.append(output_time)
+
+    def make_report(self, profile_path):
+        ops, nodes, runs = parse_ort_profile(profile_path)
+        nb_calls = len(self.run_times)
+        # the trace can also hold runs made outside of the profiled calls
+        # (warmup), so the kernel times are averaged over the traced runs
+        nb_runs = max(1, len(runs))
+        kernel_time = sum(op["total"] for op in ops.values()) / nb_runs
+        ort_run_time = runs.mean() if len(runs) > 0 else 0.0
+
+        self.report = {
+            "profile_path": profile_path,
+            "nb_calls": nb_calls,
+            "nb_runs": nb_runs,
+            "ops": ops,
+            "nodes": nodes,
+            # per call averages
+            "input_conversion": float(np.mean(self.input_times)),
+            "session_run": float(np.mean(self.run_times)),
+            "output_unpacking": float(np.mean(self.output_times)),
+            "ort_model_run": float(ort_run_time),
+            "kernels": float(kernel_time),
+        }
+        return self.report
+
+    def print_report(self, nb_nodes=5):
+        r = self.report
+        nb_runs = r["nb_runs"]
+        total_kernels = max(1e-12, r["kernels"] * nb_runs)
+        print(
+            f"[Profiler] {r['nb_calls']} profiled calls ({nb_runs} runs in the trace), trace in {r['profile_path']}"
+        )
+        print(f"{'op':<20}{'calls':>8}{'mean (us)':>12}{'per infer (us)':>16}{'%':>8}")
+        for op, v in sorted(r["ops"].items(), key=lambda x: -x[1]["total"]):
+            print(
+                f"{op:<20}{v['count']:>8}{v['total'] / v['count'] * 1e6:>12.1f}"
+                f"{v['total'] / nb_runs * 1e6:>16.1f}{v['total'] / total_kernels * 100:>8.1f}"
+            )
+
+        print(f"Slowest {nb_nodes} nodes :")
+        nodes = sorted(r["nodes"].items(), key=lambda x: -x[1]["total"])
+        for name, v in nodes[:nb_nodes]:
+            print(f"  {name} ({v['op']}) : {v['total'] / v['count'] * 1e6:.1f}us")
+
+        python_overhead = r["session_run"] - r["ort_model_run"]
+        framework_overhead = r["ort_model_run"] - r["kernels"]
+        print("Per call (us) :")
+        print(f"  input conversion  : {r['input_conversion'] * 1e6:.1f}")
+        print(f"  session.run       : {r['session_run'] * 1e6:.1f}")
+        print(f"    python binding  : {python_overhead * 1e6:.1f}")
+        print(f"    ort framework   : {framework_overhead * 1e6:.1f}")
+        print(f"    kernels         : {r['kernels'] * 1e6:.1f}")
+        print(f"  output unpacking  : {r['output_unpacking'] * 1e6:.1f}")
@@ -0,0 +1,107 @@
+from collections import deque
+from threading import Thread, Event
+import time
+
+import numpy as np
+
+
+class LatencyStats:
+    """
+    Running latency statistics, keeps the last window values for percentiles
+    """
+
+    def __init__(self, window=1000):
+        self.values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def update(self, value):
+        self.values.append(value)
+        self.last = value
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / max(1, self.count)
+
+    def percentile(self, p):
+        if len(self.values) == 0:
+            return 0.0
+        return float(np.percentile(self.values, p))
+
+    def summary(self, name):
+        return (
+            f"{name} : mean {self.mean() * 1000:.2f}ms,"
+            f" p99 {self.percentile(99) * 1000:.2f}ms, max {self.max * 1000:.2f}ms"
+        )
+
+
+class PolicyWorker:
+    """
+    Runs policy.infer() on a worker thread, so the control thread can do the
+    servo bus I/O while the policy runs.
+
+    submit(obs) starts the inference, get_result() waits for it. Only one
+    inference can be in flight. An exception raised by policy.infer() is
+    raised again by get_result().
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.obs = None
+        self.action = None
+        self.error = None
+        self.pending = False
+        self.submit_time = 0.0
+
+        self.inference_time = LatencyStats()
+        self.wait_time = LatencyStats()
+
+        self.obs_ready = Event()
+        self.action_ready = Event()
+        Thread(target=self.worker, daemon=True).start()
+
+    def worker(self):
+        while True:
+            self.obs_ready.wait()
+            self.obs_ready.clear()
+            s = time.time()
+            try:
+                # copy, infer may return a view on a reused buffer (io binding)
+                self.action = np.array(self.policy.infer(self.obs))
+                self.error = None
+            except Exception as e:
+                # kept for get_result(), the worker stays alive
+                self.action = None
+                self.error = e
+            self.inference_time.update(time.time() - s)
+            self.action_ready.set()
+
+    def submit(self, obs):
+        if self.pending:
+            raise RuntimeError("An inference is already in flight")
+        self.obs = np.array(obs)
+        self.pending = True
+        self.submit_time = time.time()
+        self.action_ready.clear()
+        self.obs_ready.set()
+
+    def get_result(self, timeout=None):
+        """
+        Returns (action, submit_time) for the last submitted observation, or
+        (None, None) if nothing was submitted or on timeout
+        """
+        if not self.pending:
+            return None, None
+        s = time.time()
+        if not self.action_ready.wait(timeout):
+            return None, None
+        self.wait_time.update(time.time() - s)
+        self.pending = False
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return self.action, self.submit_time
@@ -1,16 +1,110 @@
-import numpy as np
+import math
+import os
 import pickle
+import time
+import zipfile
+
+import numpy as np
+
+
+def mmap_npz_member(path, name):
+    """
+    Memory maps an array stored in an uncompressed .npz (np.savez), returns
+    None if it is compressed
+    """
+    with zipfile.ZipFile(path) as zf:
+        info = zf.getinfo(name + ".npy")
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+        with open(path, "rb") as f:
+            # local file header, the extra field can differ from the central one
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(f.read(4), "<u2")
+            f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+    return np.memmap(
+        path,
+        dtype=dtype,
+        mode="r",
+        offset=offset,
+        shape=shape,
+        order="F" if fortran_order else "C",
+    )
+
+
+class GridAxis:
+    """
+    Index lookup on a sorted grid axis. O(1) if the grid is uniform (up to the
+    rounding of the values), searchsorted otherwise
+    """
+
+    def __init__(self, values, tolerance=0.01):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.size = len(self.values)
+        steps = np.diff(self.values)
+        self.step = float(steps.mean()) if self.size > 1 else 1.0
+        self.start = float(self.values[0])
+        self.uniform = bool(
+            np.all(np.abs(steps - self.step) <= tolerance * abs(self.step))
+        )
+        # for the nearest node lookup on non uniform grids
+        self.midpoints = (self.values[1:] + self.values[:-1]) / 2
+
+    def nearest(self, v):
+        if self.uniform:
+            if np.isscalar(v):
+                # the usual case (one command), much cheaper without numpy
+                i = round((v - self.start) / self.step)
+                return min(max(i, 0), self.size - 1)
+            i = np.rint((v - self.start) / self.step)
+            return np.clip(i, 0, self.size - 1).astype(int)
+        return np.searchsorted(self.midpoints, v)
+
+    def cell(self, v):
+        """
+        Returns the index of the lower node of the cell containing v and the
+        weight of the upper node, v is clipped to the grid
+        """
+        if self.size == 1:
+            return np.zeros(np.shape(v), int), np.zeros(np.shape(v))
+        if self.uniform:
+            if np.isscalar(v):
+                i = math.floor((v - self.start) / self.step)
+                i = min(max(i, 0), self.size - 2)
+            else:
+                i = np.floor((v - self.start) / self.step)
+                i = np.clip(i, 0, self.size - 2).astype(int)
+        else:
+            i = np.searchsorted(self.values, v, side="right") - 1
+            i = np.clip(i, 0, self.size - 2)
+        w = (v - self.values[i]) / (self.values[i + 1] - self.values[i])
+        return i, np.clip(w, 0.0, 1.0)
+
 
 class PolyReferenceMotion:
-    def __init__(self, polynomial_coefficients: str):
-        data = pickle.load(open(polynomial_coefficients, "rb"))
+    def __init__(self, polynomial_coefficients: str, interpolate=False):
+        """
+        polynomial_coefficients is the .pkl from the reference motion
+        generator, or its .npz conversion (see save_npz()), which is much
+        faster to load.
+
+        With interpolate, the coefficients are blended between the 8
+        neighbouring grid nodes (trilinear) instead of using the nearest one,
+        so the motion doesn't jump when the commands cross a cell boundary
+        """
+        self.interpolate = interpolate
         self.dx_range = [0, 0]
         self.dy_range = [0, 0]
         self.dtheta_range = [0, 0]
         self.dxs = []
         self.dys = []
         self.dthetas = []
-        self.data_array = []
+        self.coefficients = None
         self.period = None
         self.fps = None
         self.frame_offsets = None
@@ -18,7 +112,16 @@ class PolyReferenceMotion:
         self.start_offset = None
         self.nb_steps_in_period = None
 
-        self.process(data)
+        s = time.time()
+        if os.path.splitext(polynomial_coefficients)[1] == ".npz":
+            self.load_npz(polynomial_coefficients)
+        else:
+            data = pickle.load(open(polynomial_coefficients, "rb"))
+            self.process(data)
+        self.setup_grid()
+        print(
+            f"[Poly ref data] Loaded {polynomial_coefficients} in {(time.time() - s) * 1000:.1f}ms"
+        )
 
     def process(self, data):
         print("[Poly ref data] Processing ...")
@@ -61,58 +164,131 @@ class PolyReferenceMotion:
             if dy not in _data[dx]:
                 _data[dx][dy] = {}
 
-            if dtheta not in _data[dx][dy]:
-                _data[dx][dy][dtheta] = data[name]
-
-            _coeffs = data[name]["coefficients"]
-
-            coeffs = []
-            for k, v in _coeffs.items():
-                coeffs.append(v)
-            _data[dx][dy][dtheta] = coeffs
+            _data[dx][dy][dtheta] = list(data[name]["coefficients"].values())
 
         self.dxs = sorted(self.dxs)
         self.dys = sorted(self.dys)
         self.dthetas = sorted(self.dthetas)
 
-        nb_dx = len(self.dxs)
-        nb_dy = len(self.dys)
-        nb_dtheta = len(self.dthetas)
+        # (nb_dx, nb_dy, nb_dtheta, nb_channels, degree), lowest degree first
+        self.coefficients = np.array(
+            [
+                [[_data[dx][dy][dtheta] for dtheta in self.dthetas] for dy in self.dys]
+                for dx in self.dxs
+            ],
+            dtype=np.float64,
+        )
+
+        print("[Poly ref data] Done processing")
 
-        self.data_array = nb_dx * [None]
-        for x, dx in enumerate(self.dxs):
-            self.data_array[x] = nb_dy * [None]
-            for y, dy in enumerate(self.dys):
-                self.data_array[x][y] = nb_dtheta * [None]
-                for th, dtheta in enumerate(self.dthetas):
-                    self.data_array[x][y][th] = _data[dx][dy][dtheta]
+    def save_npz(self, path):
+        """
+        Saves the grid axes, the metadata and the coefficient tensor. Not
+        compressed, so that the tensor can be memory mapped by load_npz()
+        """
+        np.savez(
+            path,
+            dxs=np.array(self.dxs),
+            dys=np.array(self.dys),
+            dthetas=np.array(self.dthetas),
+            coefficients=np.ascontiguousarray(self.coefficients),
+            period=self.period,
+            fps=self.fps,
+            startend_double_support_ratio=self.startend_double_support_ratio,
+            frame_offset_names=np.array(list(self.frame_offsets.keys())),
+            frame_offset_values=np.array(list(self.frame_offsets.values())),
+        )
 
-        self.data_array = self.data_array
+    def load_npz(self, path):
+        data = np.load(path)
+        self.dxs = data["dxs"].tolist()
+        self.dys = data["dys"].tolist()
+        self.dthetas = data["dthetas"].tolist()
+        self.dx_range = [min(0, self.dxs[0]), max(0, self.dxs[-1])]
+        self.dy_range = [min(0, self.dys[0]), max(0, self.dys[-1])]
+        self.dtheta_range = [min(0, self.dthetas[0]), max(0, self.dthetas[-1])]
 
-        print("[Poly ref data] Done processing")
+        self.coefficients = mmap_npz_member(path, "coefficients")
+        if self.coefficients is None:
+            self.coefficients = data["coefficients"]
 
-    def vel_to_index(self, dx, dy, dtheta):
+        self.period = float(data["period"])
+        self.fps = int(data["fps"])
+        self.startend_double_support_ratio = float(
+            data["startend_double_support_ratio"]
+        )
+        self.frame_offsets = dict(
+            zip(
+                data["frame_offset_names"].tolist(),
+                data["frame_offset_values"].tolist(),
+            )
+        )
+        self.start_offset = int(self.startend_double_support_ratio * self.fps)
+        self.nb_steps_in_period = int(self.period * self.fps)
 
-        dx = np.clip(dx, self.dx_range[0], self.dx_range[1])
-        dy = np.clip(dy, self.dy_range[0], self.dy_range[1])
-        dtheta = np.clip(dtheta, self.dtheta_range[0], self.dtheta_range[1])
+    def setup_grid(self):
+        self.dx_axis = GridAxis(self.dxs)
+        self.dy_axis = GridAxis(self.dys)
+        self.dtheta_axis = GridAxis(self.dthetas)
 
-        ix = np.argmin(np.abs(np.array(self.dxs) - dx))
-        iy = np.argmin(np.abs(np.array(self.dys) - dy))
-        itheta = np.argmin(np.abs(np.array(self.dthetas) - dtheta))
+    def vel_to_index(self, dx, dy, dtheta):
+        """
+        Nearest grid node, the velocities are clipped to the grid
+        """
+        ix = self.dx_axis.nearest(dx)
+        iy = self.dy_axis.nearest(dy)
+        itheta = self.dtheta_axis.nearest(dtheta)
 
         return int(ix), int(iy), int(itheta)
 
+    def interpolate_coefficients(self, dx, dy, dtheta):
+        """
+        Trilinear blend of the coefficients of the cell containing the
+        velocities, (nb_channels, degree). The polynomials being linear in
+        their coefficients, it's the same as blending the reference motions
+        """
+        weights = np.ones(())
+        index = []
+        for axis, v in [
+            (self.dx_axis, dx),
+            (self.dy_axis, dy),
+            (self.dtheta_axis, dtheta),
+        ]:
+            i, w = axis.cell(v)
+            index.append(slice(i, i + 2))
+            axis_weights = np.array([1 - w, w])[: min(2, axis.size)]
+            weights = np.multiply.outer(weights, axis_weights)
+        block = self.coefficients[tuple(index)]
+        return np.dot(weights.reshape(-1), block.reshape(weights.size, -1)).reshape(
+            block.shape[3:]
+        )
+
+    def get_coefficients(self, dx, dy, dtheta):
+        if self.interpolate:
+            return self.interpolate_coefficients(dx, dy, dtheta)
+        ix, iy, itheta = self.vel_to_index(dx, dy, dtheta)
+        return self.coefficients[ix, iy, itheta]
+
     def sample_polynomial(self, t, coeffs):
-        ret = []
-        for c in coeffs:
-            ret.append(np.polyval(np.flip(c), t))
+        """
+        Evaluates all the channels at once (Horner), coeffs is
+        (nb_channels, degree). t can be a scalar, returns (nb_channels,), or a
+        vector of T time points, returns (T, nb_channels)
+        """
+        t = np.asarray(t)[..., np.newaxis]
+        ret = np.broadcast_to(coeffs[:, -1], t.shape[:-1] + coeffs.shape[:1]).copy()
+        for k in range(coeffs.shape[1] - 2, -1, -1):
+            ret *= t
+            ret += coeffs[:, k]
 
         return ret
 
     def get_reference_motion(self, dx, dy, dtheta, i):
-        ix, iy, itheta = self.vel_to_index(dx, dy, dtheta)
-        t = i % self.nb_steps_in_period / self.nb_steps_in_period
+        """
+        i is the frame index in the period, or a vector of them
+        """
+        coeffs = self.get_coefficients(dx, dy, dtheta)
+        t = np.asarray(i) % self.nb_steps_in_period / self.nb_steps_in_period
         t = np.clip(t, 0.0, 1.0)  # safeguard
-        ret = self.sample_polynomial(t, self.data_array[ix][iy][itheta])
-        return ret
\ No newline at end of file
+        ret = self.sample_polynomial(t, coeffs)
+        return ret
@@ -1,6 +1,3 @@
-import adafruit_bno055
-import board
-import busio
 import numpy as np
 import os
 import pickle
@@ -9,14 +6,27 @@ from queue import Queue
 from threading import Thread
 import time
 
+from mini_bdx_runtime.imu_filters import IMUFilter
+
 
-# TODO filter spikes
 class Imu:
     def __init__(
-        self, sampling_freq, user_pitch_bias=0, calibrate=False, upside_down=True
+        self,
+        sampling_freq,
+        user_pitch_bias=0,
+        calibrate=False,
+        upside_down=True,
+        filter_config={},
     ):
         self.sampling_freq = sampling_freq
         self.calibrate = calibrate
+        # spike rejection / low pass / gyro bias, see imu_filters.py
+        self.imu_filter = IMUFilter(sampling_freq, filter_config)
+
+        # imported here so that this module can be imported off robot
+        import adafruit_bno055
+        import board
+        import busio
 
         i2c = busio.I2C(board.SCL, board.SDA)
         self.imu = adafruit_bno055.BNO055_I2C(i2c)
@@ -138,6 +148,11 @@ class Imu:
 
             accelero[0] -= self.x_offset
 
+            if self.imu_filter.enabled:
+                filtered = self.imu_filter.update(gyro, accelero)
+                gyro = filtered[:3].copy()
+                accelero = filtered[3:].copy()
+
             data = {
                 "gyro": gyro,
                 "accelero": accelero,
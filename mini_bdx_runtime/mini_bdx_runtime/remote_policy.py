@@ -0,0 +1,131 @@
+# Remote policy inference over UDP, to run bigger policies on a host computer
+# (see scripts/policy_server.py).
+#
+# Each datagram is a header (magic, number of floats, sequence number) followed
+# by the float32 little endian payload. The request carries the observation,
+# the reply carries the action with the same sequence number. Replies that
+# arrive after their deadline are dropped when reading the next one.
+import socket
+import struct
+import time
+
+import numpy as np
+
+from mini_bdx_runtime.policy_worker import LatencyStats
+
+MAGIC = 0xD0C4
+HEADER = struct.Struct("<HHI")
+MAX_FLOATS = 1024
+MAX_FRAME_SIZE = HEADER.size + 4 * MAX_FLOATS
+DEFAULT_PORT = 4321
+
+
+def parse_address(address):
+    """
+    "host:port" or "host" (default port)
+    """
+    if ":" in address:
+        host, port = address.rsplit(":", 1)
+        return host, int(port)
+    return address, DEFAULT_PORT
+
+
+def pack_frame(buffer, seq, values):
+    """
+    Writes a frame in buffer (a bytearray of at least frame_size(len(values))),
+    returns its size
+    """
+    HEADER.pack_into(buffer, 0, MAGIC, len(values), seq)
+    np.frombuffer(buffer, np.float32, len(values), HEADER.size)[:] = values
+    return HEADER.size + 4 * len(values)
+
+
+def unpack_frame(buffer, size):
+    """
+    Returns (seq, values), values being a view on buffer, or (None, None) if the
+    frame is invalid
+    """
+    if size < HEADER.size:
+        return None, None
+    magic, nb_floats, seq = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or size != HEADER.size + 4 * nb_floats:
+        return None, None
+    return seq, np.frombuffer(buffer, np.float32, nb_floats, HEADER.size)
+
+
+class RemotePolicyClient:
+    def __init__(self, address, timeout=0.005, action_size=None):
+        """
+        timeout is the deadline (s) for the reply, infer() returns None when it
+        is missed so that the caller can fall back to a local policy. Replies
+        with another number of floats than action_size are rejected the same
+        way (a server running another policy)
+        """
+        self.address = parse_address(address)
+        self.timeout = timeout
+        self.action_size = action_size
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.connect(self.address)
+
+        self.seq = 0
+        self.send_buffer = bytearray(MAX_FRAME_SIZE)
+        self.recv_buffer = bytearray(MAX_FRAME_SIZE)
+
+        self.rtt = LatencyStats()
+        self.nb_calls = 0
+        self.nb_timeouts = 0
+        self.nb_errors = 0
+        self.nb_dropped = 0  # late or invalid replies
+        self.nb_wrong_size = 0
+
+    @property
+    def nb_fallbacks(self):
+        return self.nb_timeouts + self.nb_errors + self.nb_wrong_size
+
+    def infer(self, inputs):
+        self.nb_calls += 1
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        start = time.perf_counter()
+        deadline = start + self.timeout
+
+        try:
+            size = pack_frame(self.send_buffer, self.seq, inputs)
+            self.sock.send(memoryview(self.send_buffer)[:size])
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.nb_timeouts += 1
+                    return None
+                self.sock.settimeout(remaining)
+                size = self.sock.recv_into(self.recv_buffer)
+                seq, action = unpack_frame(self.recv_buffer, size)
+                if seq == self.seq:
+                    break
+                self.nb_dropped += 1
+        except socket.timeout:
+            self.nb_timeouts += 1
+            return None
+        except OSError:
+            # server not running (connection refused) or network down
+            self.nb_errors += 1
+            return None
+
+        if self.action_size is not None and len(action) != self.action_size:
+            self.nb_wrong_size += 1
+            return None
+
+        self.rtt.update(time.perf_counter() - start)
+        return action.copy()
+
+    def summary(self):
+        fallback_ratio = self.nb_fallbacks / max(1, self.nb_calls) * 100
+        return (
+            f"[RemotePolicy] {self.address[0]}:{self.address[1]}, {self.nb_calls} calls, "
+            f"{self.nb_fallbacks} local fallbacks ({fallback_ratio:.1f}%, {self.nb_timeouts} timeouts, "
+            f"{self.nb_errors} errors, {self.nb_wrong_size} wrong sizes), {self.nb_dropped} late replies dropped\n"
+            + self.rtt.summary("[RemotePolicy] Round trip")
+        )
+
+    def close(self):
+        self.sock.close()
@@ -7,7 +7,7 @@
 #
 import numpy as np
 
-mujoco_joints_order = [
+isaac_joints_order = [
     "left_hip_yaw",
     "left_hip_roll",
     "left_hip_pitch",
@@ -26,74 +26,173 @@ mujoco_joints_order = [
     "right_ankle",
 ]
 
-isaac_joints_order = [
+# legs first, then the head (what isaac_to_mujoco gives)
+mujoco_joints_order = [
     "left_hip_yaw",
     "left_hip_roll",
     "left_hip_pitch",
     "left_knee",
     "left_ankle",
+    "right_hip_yaw",
+    "right_hip_roll",
+    "right_hip_pitch",
+    "right_knee",
+    "right_ankle",
     "neck_pitch",
     "head_pitch",
     "head_yaw",
     "head_roll",
     "left_antenna",
     "right_antenna",
-    "right_hip_yaw",
-    "right_hip_roll",
-    "right_hip_pitch",
-    "right_knee",
-    "right_ankle",
 ]
 
+# Joint orders registry. The permutations between two orders are built once
+# and cached. The hardware order (HWI.joints) is registered as "hwi" by
+# check_joint_orders()
+JOINT_ORDERS = {
+    "isaac": isaac_joints_order,
+    "mujoco": mujoco_joints_order,
+}
+_permutations = {}
+
+
+def register_joint_order(name, joints_order):
+    JOINT_ORDERS[name] = list(joints_order)
+    for key in [key for key in _permutations if name in key]:
+        del _permutations[key]
+
+
+def get_permutation(src, dst):
+    """
+    Index array such that values_dst = values_src[..., permutation]. dst can
+    be a subset of src (isaac -> hwi drops the antennas)
+    """
+    key = (src, dst)
+    if key not in _permutations:
+        src_order = JOINT_ORDERS[src]
+        missing = [joint for joint in JOINT_ORDERS[dst] if joint not in src_order]
+        if len(missing) > 0:
+            raise ValueError(f"Can't remap {src} to {dst}, {src} lacks {missing}")
+        _permutations[key] = np.array(
+            [src_order.index(joint) for joint in JOINT_ORDERS[dst]]
+        )
+    return _permutations[key]
+
+
+def remap_joints(values, src, dst, out=None):
+    """
+    values is (..., nb_joints) in the src order, any leading batch shape
+    """
+    return np.asarray(values).take(get_permutation(src, dst), axis=-1, out=out)
+
 
 def isaac_to_mujoco(joints):
-    new_joints = [
-        # left leg
-        joints[0],
-        joints[1],
-        joints[2],
-        joints[3],
-        joints[4],
-        # right leg
-        joints[11],
-        joints[12],
-        joints[13],
-        joints[14],
-        joints[15],
-        # head
-        joints[5],
-        joints[6],
-        joints[7],
-        joints[8],
-        joints[9],
-        joints[10],
-    ]
-    return new_joints
+    return remap_joints(joints, "isaac", "mujoco")
 
 
 def mujoco_to_isaac(joints):
-    new_joints = [
-        # left leg
-        joints[0],
-        joints[1],
-        joints[2],
-        joints[3],
-        joints[4],
-        # head
-        joints[10],
-        joints[11],
-        joints[12],
-        joints[13],
-        joints[14],
-        joints[15],
-        # right leg
-        joints[5],
-        joints[6],
-        joints[7],
-        joints[8],
-        joints[9],
-    ]
-    return new_joints
+    return remap_joints(joints, "mujoco", "isaac")
+
+
+def check_joint_orders(hwi, duck_config):
+    """
+    Checks at startup that the joint orders of the hardware (HWI.joints,
+    init_pos, zero_pos), the config's offsets and the registry agree, and
+    registers the hardware order as "hwi"
+    """
+    hwi_order = list(hwi.joints.keys())
+    errors = []
+    for name, joints in [
+        ("HWI.init_pos", hwi.init_pos),
+        ("HWI.zero_pos", hwi.zero_pos),
+    ]:
+        if list(joints.keys()) != hwi_order:
+            errors.append(f"{name} is not in the HWI.joints order")
+
+    missing = [joint for joint in hwi_order if joint not in duck_config.joints_offset]
+    if len(missing) > 0:
+        errors.append(f"joints_offsets in the duck config lacks {missing}")
+
+    for name, order in JOINT_ORDERS.items():
+        unknown = [joint for joint in order if joint not in isaac_joints_order]
+        if len(unknown) > 0 or len(set(order)) != len(order):
+            errors.append(f"{name} joint order has unknown or duplicated joints")
+    if sorted(mujoco_joints_order) != sorted(isaac_joints_order):
+        errors.append("mujoco joint order is not a permutation of the isaac one")
+
+    # the policy's actions are in the isaac order, without the antennas
+    policy_order = [joint for joint in isaac_joints_order if "antenna" not in joint]
+    if hwi_order != policy_order:
+        errors.append(
+            f"HWI.joints order {hwi_order} doesn't match the policy's {policy_order}"
+        )
+
+    if len(errors) > 0:
+        raise ValueError("Inconsistent joint orders :\n  " + "\n  ".join(errors))
+
+    register_joint_order("hwi", hwi_order)
+
+
+# Observation layouts, the fields are concatenated in this order to build the
+# policy's observation (see RLWalk.make_obs)
+OBS_LAYOUTS = {
+    "walk": [
+        "gyro",
+        "accelero",
+        "commands",
+        "dof_pos",
+        "dof_vel",
+        "last_action",
+        "last_last_action",
+        "last_last_last_action",
+        "motor_targets",
+        "feet_contacts",
+        "imitation_phase",
+    ],
+    # same without the gait phase, for standing / expressive policies
+    "standing": [
+        "gyro",
+        "accelero",
+        "commands",
+        "dof_pos",
+        "dof_vel",
+        "last_action",
+        "last_last_action",
+        "last_last_last_action",
+        "motor_targets",
+        "feet_contacts",
+    ],
+}
+
+OBS_FIELD_SIZES = {
+    "gyro": 3,
+    "accelero": 3,
+    "commands": 7,
+    "dof_pos": 14,
+    "dof_vel": 14,
+    "last_action": 14,
+    "last_last_action": 14,
+    "last_last_last_action": 14,
+    "motor_targets": 14,
+    "feet_contacts": 2,
+    "imitation_phase": 2,
+}
+
+
+def get_obs_size(obs_layout):
+    return sum(OBS_FIELD_SIZES[field] for field in obs_layout)
+
+
+def get_obs_slices(obs_layout):
+    """
+    {field: slice of the field in the observation}
+    """
+    slices = {}
+    start = 0
+    for field in obs_layout:
+        slices[field] = slice(start, start + OBS_FIELD_SIZES[field])
+        start += OBS_FIELD_SIZES[field]
+    return slices
 
 
 # TODO ADD BACK
@@ -0,0 +1,150 @@
+# Small numpy-only quaternion helpers, used in the IMU hot path instead of
+# scipy.spatial.transform.Rotation (building a Rotation object per sample is
+# expensive on the Pi).
+#
+# Conventions match scipy's defaults :
+# - quaternions are scalar last [x, y, z, w] unless stated otherwise
+# - "xyz" euler angles are extrinsic (same as R.from_euler("xyz", ...))
+import math
+
+import numpy as np
+
+# below this norm a quaternion is treated as invalid (the BNO055 reports all
+# zeros before its fusion settles)
+MIN_QUAT_NORM = 1e-6
+
+
+def quat_is_valid(q):
+    x, y, z, w = map(float, q)
+    return x * x + y * y + z * z + w * w >= MIN_QUAT_NORM**2
+
+
+def quat_normalize(q):
+    q = np.asarray(q, dtype=np.float64)
+    return q / np.linalg.norm(q)
+
+
+def quat_scalar_first_to_last(q):
+    return np.array([q[1], q[2], q[3], q[0]], dtype=np.float64)
+
+
+def quat_from_euler_xyz(euler, out=None):
+    """
+    Equivalent to R.from_euler("xyz", euler).as_quat()
+    """
+    hr, hp, hy = 0.5 * euler[0], 0.5 * euler[1], 0.5 * euler[2]
+    cr, sr = math.cos(hr), math.sin(hr)
+    cp, sp = math.cos(hp), math.sin(hp)
+    cy, sy = math.cos(hy), math.sin(hy)
+    if out is None:
+        out = np.empty(4)
+    out[0] = sr * cp * cy - cr * sp * sy
+    out[1] = cr * sp * cy + sr * cp * sy
+    out[2] = cr * cp * sy - sr * sp * cy
+    out[3] = cr * cp * cy + sr * sp * sy
+    return out
+
+
+def euler_xyz_from_quat(q, out=None):
+    """
+    Equivalent to R.from_quat(q).as_euler("xyz"). A zero quaternion gives
+    zeros (identity) instead of dividing by its norm
+    """
+    x, y, z, w = map(float, q)
+    n = x * x + y * y + z * z + w * w
+    if out is None:
+        out = np.empty(3)
+    if n < MIN_QUAT_NORM**2:
+        out[:] = 0.0
+        return out
+    out[0] = math.atan2(2.0 * (w * x + y * z), n - 2.0 * (x * x + y * y))
+    out[1] = math.asin(max(-1.0, min(1.0, 2.0 * (w * y - z * x) / n)))
+    out[2] = math.atan2(2.0 * (w * z + x * y), n - 2.0 * (y * y + z * z))
+    return out
+
+
+def matrix_from_quat(q, out=None):
+    """
+    Equivalent to R.from_quat(q).as_matrix(). A zero quaternion gives the
+    identity
+    """
+    x, y, z, w = map(float, q)
+    n = x * x + y * y + z * z + w * w
+    if n < MIN_QUAT_NORM**2:
+        x, y, z, w, n = 0.0, 0.0, 0.0, 1.0, 1.0
+    s = 2.0 / n
+    xx, yy, zz = x * x * s, y * y * s, z * z * s
+    xy, xz, yz = x * y * s, x * z * s, y * z * s
+    wx, wy, wz = w * x * s, w * y * s, w * z * s
+    if out is None:
+        out = np.empty((3, 3))
+    out[0, 0] = 1.0 - (yy + zz)
+    out[0, 1] = xy - wz
+    out[0, 2] = xz + wy
+    out[1, 0] = xy + wz
+    out[1, 1] = 1.0 - (xx + zz)
+    out[1, 2] = yz - wx
+    out[2, 0] = xz - wy
+    out[2, 1] = yz + wx
+    out[2, 2] = 1.0 - (xx + yy)
+    return out
+
+
+class PitchBias:
+    """
+    Applies a pitch offset (in radians) to an orientation quaternion, the same
+    way as doing quat -> euler("xyz") -> euler[1] -= bias -> quat.
+
+    The pitch sits between roll and yaw in the extrinsic xyz decomposition, so
+    the offset can't be folded into a single constant quaternion on either side
+    when roll and yaw are non zero. We keep the closed form euler round trip,
+    which is cheap without scipy and gives the same (normalized, same sign)
+    quaternion as the scipy version.
+    """
+
+    def __init__(self, pitch_bias):
+        self.pitch_bias = float(pitch_bias)
+        self._euler = np.empty(3)
+
+    def apply(self, q, out=None):
+        """
+        A zero quaternion is handled as the identity (see euler_xyz_from_quat),
+        check quat_is_valid() first to skip such samples
+        """
+        euler_xyz_from_quat(q, out=self._euler)
+        self._euler[1] -= self.pitch_bias
+        return quat_from_euler_xyz(self._euler, out=out)
+
+
+if __name__ == "__main__":
+    import time
+    from scipy.spatial.transform import Rotation as R
+
+    quats = R.random(1000, random_state=0).as_quat()
+    bias = np.deg2rad(3.0)
+    pb = PitchBias(bias)
+
+    max_err = 0.0
+    for q in quats:
+        euler = R.from_quat(q).as_euler("xyz")
+        max_err = max(max_err, np.abs(euler - euler_xyz_from_quat(q)).max())
+        max_err = max(
+            max_err, np.abs(R.from_quat(q).as_matrix() - matrix_from_quat(q)).max()
+        )
+        euler[1] -= bias
+        ref = R.from_euler("xyz", euler).as_quat()
+        max_err = max(max_err, np.abs(ref - pb.apply(q)).max())
+    print("Max error vs scipy: ", max_err)
+
+    s = time.time()
+    for q in quats:
+        euler = R.from_quat(q).as_euler("xyz")
+        euler[1] -= bias
+        R.from_euler("xyz", euler).as_quat()
+    print("scipy : ", (time.time() - s) / len(quats) * 1e6, "us")
+
+    out = np.empty(4)
+    s = time.time()
+    for q in quats:
+        pb.apply(q, out=out)
+    print("numpy : ", (time.time() - s) / len(quats) * 1e6, "us")
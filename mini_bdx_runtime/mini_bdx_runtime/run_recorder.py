@@ -0,0 +1,231 @@
+# Streaming binary recorder for the walk runs.
+#
+# File layout :
+#   MAGIC (8 bytes), header size (uint32), json header, records
+# The header holds the record schema (name, dtype, shape of each field, in
+# order) and free metadata. Records are fixed width (a numpy structured
+# dtype) and appended in chunks by a background thread, so the memory used
+# doesn't grow with the run and a crash only loses the last chunk.
+import json
+import os
+import pickle
+import queue
+import struct
+from threading import Thread
+
+import numpy as np
+
+MAGIC = b"DUCKREC1"
+HEADER_SIZE = struct.Struct("<I")
+
+
+def make_record_dtype(schema):
+    """
+    schema is a list of (name, dtype, shape)
+    """
+    return np.dtype([(name, dtype, tuple(shape)) for name, dtype, shape in schema])
+
+
+def make_schema(fields):
+    """
+    fields is {name: shape} (float32), or {name: (dtype, shape)}. A float64
+    "timestamp" field is always added first
+    """
+    schema = [("timestamp", "<f8", ())]
+    for name, field in fields.items():
+        if isinstance(field, tuple) and isinstance(field[0], str):
+            dtype, shape = field
+        else:
+            dtype, shape = "<f4", field
+        shape = (shape,) if isinstance(shape, int) else tuple(shape)
+        schema.append((name, np.dtype(dtype).str, shape))
+    return schema
+
+
+def write_header(f, schema, metadata):
+    dtype = make_record_dtype(schema)
+    header = json.dumps(
+        {
+            "schema": [[name, dtype, list(shape)] for name, dtype, shape in schema],
+            "record_size": dtype.itemsize,
+            "metadata": metadata,
+        }
+    ).encode()
+    f.write(MAGIC)
+    f.write(HEADER_SIZE.pack(len(header)))
+    f.write(header)
+
+
+class RunRecorder:
+    def __init__(self, path, fields, metadata={}, chunk_size=50, nb_chunks=8):
+        """
+        fields is {name: shape} (float32), or {name: (dtype, shape)}, see
+        make_schema(). Up to nb_chunks chunks can wait for the writer thread, records are
+        dropped (and counted) past that instead of blocking the caller
+        """
+        self.path = path
+        self.schema = make_schema(fields)
+        self.dtype = make_record_dtype(self.schema)
+
+        self.file = open(path, "wb")
+        write_header(self.file, self.schema, metadata)
+        self.file.flush()
+
+        self.chunk_size = chunk_size
+        self.free_chunks = queue.Queue()
+        for i in range(nb_chunks):
+            self.free_chunks.put(np.zeros(chunk_size, dtype=self.dtype))
+        self.full_chunks = queue.Queue()
+        self.chunk = self.free_chunks.get()
+        self.i = 0
+
+        self.nb_records = 0
+        self.nb_dropped = 0
+
+        self.writer = Thread(target=self.write_chunks, daemon=True)
+        self.writer.start()
+
+    def write_chunks(self):
+        while True:
+            chunk, size = self.full_chunks.get()
+            if chunk is None:
+                break
+            self.file.write(chunk[:size].tobytes())
+            self.file.flush()
+            chunk[:] = np.zeros(1, dtype=self.dtype)
+            self.free_chunks.put(chunk)
+
+    def record(self, timestamp, **values):
+        """
+        Missing fields are recorded as zeros
+        """
+        if self.chunk is None:
+            # the writer is behind, wait for a free chunk without blocking
+            try:
+                self.chunk = self.free_chunks.get_nowait()
+            except queue.Empty:
+                self.nb_dropped += 1
+                return
+
+        row = self.chunk[self.i]
+        row["timestamp"] = timestamp
+        for name, value in values.items():
+            row[name] = value
+        self.i += 1
+        self.nb_records += 1
+
+        if self.i == self.chunk_size:
+            self.full_chunks.put((self.chunk, self.i))
+            self.chunk = None
+            self.i = 0
+
+    def close(self):
+        if self.chunk is not None and self.i > 0:
+            self.full_chunks.put((self.chunk, self.i))
+        self.full_chunks.put((None, 0))
+        self.writer.join()
+        self.file.close()
+        print(
+            f"[RunRecorder] {self.nb_records} records saved to {self.path}"
+            + (f", {self.nb_dropped} dropped" if self.nb_dropped > 0 else "")
+        )
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a run recording")
+        (size,) = HEADER_SIZE.unpack(f.read(HEADER_SIZE.size))
+        header = json.loads(f.read(size))
+    header["data_offset"] = len(MAGIC) + HEADER_SIZE.size + size
+    return header
+
+
+def load_recording(path, mmap=True):
+    """
+    Returns ({field name: array}, metadata). The arrays are memory mapped
+    views unless mmap is False. A truncated last record (crash) is ignored
+    """
+    header = read_header(path)
+    dtype = make_record_dtype(header["schema"])
+    nb_records = (os.path.getsize(path) - header["data_offset"]) // dtype.itemsize
+    if mmap and nb_records > 0:
+        records = np.memmap(
+            path,
+            dtype=dtype,
+            mode="r",
+            offset=header["data_offset"],
+            shape=(nb_records,),
+        )
+    else:
+        records = np.fromfile(
+            path, dtype=dtype, count=nb_records, offset=header["data_offset"]
+        )
+    return {name: records[name] for name in dtype.names}, header["metadata"]
+
+
+def is_recording(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_observations(path):
+    """
+    Observations from a run recording, or from a pickled list (older
+    --save_obs files, mujoco)
+    """
+    if is_recording(path):
+        data, metadata = load_recording(path)
+        return np.array(data["obs"])
+    return np.asarray(pickle.load(open(path, "rb")))
+
+
+def load_actuator_recording(path):
+    """
+    Actuator recording from capture_actuators.py (run recording) or
+    record_data.py (pickle). Returns a dict with times (T,), goal, position,
+    speed, load, current (T, nb_motors) and the capture settings
+    """
+    if is_recording(path):
+        data, metadata = load_recording(path, mmap=False)
+        rec = {name: data[name] for name in data}
+        rec["times"] = rec.pop("timestamp")
+        rec["motors"] = metadata.get("ids", list(range(rec["goal"].shape[1])))
+        rec.update(metadata)
+        return rec
+
+    # record_data.py / new_record_data.py pickles, one motor
+    data = pickle.load(open(path, "rb"))
+    column = lambda name: np.asarray(data[name], dtype=np.float64)[:, np.newaxis]
+    return {
+        "times": np.asarray(data["times"], dtype=np.float64),
+        "goal": column("goal_positions"),
+        "position": column("positions"),
+        "speed": column("speeds"),
+        "load": column("loads"),
+        "current": column("currents"),
+        "motors": [0],
+        "kp": data.get("kp"),
+        "kd": data.get("kd"),
+        "acceleration": data.get("acceleration"),
+        "profile": "step",
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", type=str)
+    args = parser.parse_args()
+
+    data, metadata = load_recording(args.file)
+    print("Metadata : ", metadata)
+    for name, values in data.items():
+        print(f"  {name} : {values.shape} {values.dtype}")
+    if len(data["timestamp"]) > 1:
+        dts = np.diff(data["timestamp"])
+        print(
+            f"{len(dts) + 1} records, mean period {dts.mean() * 1000:.2f}ms,"
+            f" max {dts.max() * 1000:.2f}ms"
+        )
@@ -1,12 +1,17 @@
 import time
 
 import numpy as np
-import rustypot
 from mini_bdx_runtime.duck_config import DuckConfig
 
 
 class HWI:
-    def __init__(self, duck_config: DuckConfig, usb_port: str = "/dev/ttyACM0"):
+    def __init__(
+        self, duck_config: DuckConfig, usb_port: str = "/dev/ttyACM0", io=None
+    ):
+        """
+        io replaces the rustypot bus (same methods), e.g. sim_sensors.SimServoBus
+        to run without the servos
+        """
 
         self.duck_config = duck_config
 
@@ -74,7 +79,11 @@ class HWI:
         self.kds = np.ones(len(self.joints)) * 0  # default kd
         self.low_torque_kps = np.ones(len(self.joints)) * 2
 
-        self.io = rustypot.feetech(usb_port, 1000000)
+        if io is None:
+            import rustypot
+
+            io = rustypot.feetech(usb_port, 1000000)
+        self.io = io
 
     def set_kps(self, kps):
         self.kps = kps
@@ -0,0 +1,417 @@
+# Off robot replacements for raw_imu.Imu, feet_contacts.FeetContacts and the
+# servo bus of rustypot_position_hwi.HWI. They expose the same interface
+# (get_data() / get() / stop(), the rustypot methods) so the walk loop can run
+# on a plain linux box, for benchmarks and regression tests.
+#
+# - "sim" : synthetic data (noise, bias, sample rate, dropout)
+# - "replay" : streams recorded sensor data with its original timing
+import pickle
+import time
+from queue import Queue
+from threading import Thread
+
+import numpy as np
+
+from mini_bdx_runtime.imu_filters import IMUFilter, GRAVITY
+from mini_bdx_runtime.run_recorder import is_recording, load_recording
+from mini_bdx_runtime.rustypot_position_hwi import HWI
+
+SENSOR_BACKENDS = ["hardware", "sim", "replay"]
+
+
+def load_sensor_log(path, freq=50):
+    """
+    Loads recorded sensor data. Accepts either :
+    - a run recording from --save_obs (run_recorder.RunRecorder)
+    - a pickled dict with "times", "gyro", "accelero" and "feet_contacts" keys
+    - a list of observations saved with --save_obs (no timestamps, so they are
+      assumed to be spaced by 1/freq)
+    Returns a dict of numpy arrays, times starting at 0
+    """
+    if is_recording(path):
+        data, metadata = load_recording(path)
+        log = {
+            "times": np.array(data["timestamp"]),
+            "gyro": np.array(data["gyro"], dtype=np.float64),
+            "accelero": np.array(data["accelero"], dtype=np.float64),
+            "feet_contacts": np.array(data["feet_contacts"], dtype=np.float64),
+        }
+        log["times"] = log["times"] - log["times"][0]
+        return log
+
+    data = pickle.load(open(path, "rb"))
+    if isinstance(data, dict):
+        log = {k: np.asarray(data[k], dtype=np.float64) for k in data.keys()}
+    else:
+        obs = np.asarray(data, dtype=np.float64)
+        log = {
+            "times": np.arange(len(obs)) / freq,
+            "gyro": obs[:, 0:3],
+            "accelero": obs[:, 3:6],
+            # obs layout, see RLWalk.get_obs : [..., feet_contacts, phase]
+            "feet_contacts": obs[:, -4:-2],
+        }
+    log["times"] = log["times"] - log["times"][0]
+    return log
+
+
+class SimImu:
+    """
+    Synthetic raw imu : gravity along z plus bias and gaussian noise.
+    dropout is the probability that a sample is lost (get_data then returns
+    the previous one, like when the real imu misses a read).
+    """
+
+    def __init__(
+        self,
+        sampling_freq,
+        gyro_noise=0.01,
+        accelero_noise=0.05,
+        gyro_bias=[0.0, 0.0, 0.0],
+        accelero_bias=[0.0, 0.0, 0.0],
+        dropout=0.0,
+        seed=0,
+        filter_config={},
+    ):
+        self.sampling_freq = sampling_freq
+        self.gyro_noise = gyro_noise
+        self.accelero_noise = accelero_noise
+        self.gyro_bias = np.array(gyro_bias, dtype=np.float64)
+        self.accelero_bias = np.array(accelero_bias, dtype=np.float64)
+        self.accelero_bias[2] += GRAVITY
+        self.dropout = dropout
+        self.rng = np.random.default_rng(seed)
+        self.imu_filter = IMUFilter(sampling_freq, filter_config)
+
+        self.nb_samples = 0
+        self.nb_dropped = 0
+        self.stop_event = False
+
+        self.last_imu_data = {
+            "gyro": [0, 0, 0],
+            "accelero": [0, 0, 0],
+        }
+        self.imu_queue = Queue(maxsize=1)
+        Thread(target=self.imu_worker, daemon=True).start()
+
+    def imu_worker(self):
+        while not self.stop_event:
+            s = time.time()
+            self.nb_samples += 1
+            if self.rng.random() < self.dropout:
+                self.nb_dropped += 1
+            else:
+                gyro = self.gyro_bias + self.gyro_noise * self.rng.standard_normal(3)
+                accelero = self.accelero_bias + (
+                    self.accelero_noise * self.rng.standard_normal(3)
+                )
+                if self.imu_filter.enabled:
+                    filtered = self.imu_filter.update(gyro, accelero)
+                    gyro = filtered[:3].copy()
+                    accelero = filtered[3:].copy()
+                data = {
+                    "gyro": gyro,
+                    "accelero": accelero,
+                }
+                self.put_latest(data)
+
+            took = time.time() - s
+            time.sleep(max(0, 1 / self.sampling_freq - took))
+
+    def put_latest(self, data):
+        # drop the unread sample instead of blocking, so the timing holds
+        try:
+            self.imu_queue.get(False)
+        except Exception:
+            pass
+        self.imu_queue.put(data)
+
+    def get_data(self):
+        try:
+            self.last_imu_data = self.imu_queue.get(False)  # non blocking
+        except Exception:
+            pass
+
+        return self.last_imu_data
+
+    def stop(self):
+        self.stop_event = True
+
+
+class ReplayImu:
+    """
+    Streams the gyro/accelero of a sensor log (see load_sensor_log) following
+    the recorded timestamps. Loops over the log if loop is True.
+    """
+
+    def __init__(self, log, loop=True, filter_config={}, freq=50):
+        if isinstance(log, str):
+            log = load_sensor_log(log, freq)
+        self.times = log["times"]
+        self.gyros = log["gyro"]
+        self.acceleros = log["accelero"]
+        self.loop = loop
+        self.duration = self.times[-1] + (self.times[-1] / max(1, len(self.times) - 1))
+        self.imu_filter = IMUFilter(freq, filter_config)
+
+        self.done = False
+        self.stop_event = False
+
+        self.last_imu_data = {
+            "gyro": [0, 0, 0],
+            "accelero": [0, 0, 0],
+        }
+        self.imu_queue = Queue(maxsize=1)
+        Thread(target=self.imu_worker, daemon=True).start()
+
+    def imu_worker(self):
+        start = time.time()
+        i = 0
+        while not self.stop_event:
+            if i >= len(self.times):
+                if not self.loop:
+                    self.done = True
+                    return
+                i = 0
+                start += self.duration
+
+            # wait for the sample's original timestamp
+            time.sleep(max(0, start + self.times[i] - time.time()))
+
+            gyro = self.gyros[i].copy()
+            accelero = self.acceleros[i].copy()
+            if self.imu_filter.enabled:
+                filtered = self.imu_filter.update(gyro, accelero)
+                gyro = filtered[:3].copy()
+                accelero = filtered[3:].copy()
+            data = {
+                "gyro": gyro,
+                "accelero": accelero,
+            }
+            self.put_latest(data)
+            i += 1
+
+    def put_latest(self, data):
+        # drop the unread sample instead of blocking, so the timing holds
+        try:
+            self.imu_queue.get(False)
+        except Exception:
+            pass
+        self.imu_queue.put(data)
+
+    def get_data(self):
+        try:
+            self.last_imu_data = self.imu_queue.get(False)  # non blocking
+        except Exception:
+            pass
+
+        return self.last_imu_data
+
+    def stop(self):
+        self.stop_event = True
+
+
+class SimServoBus:
+    """
+    Stands in for rustypot.feetech in HWI. The positions follow the goals as
+    a first order with time constant tau (s), capped at max_velocity (rad/s)
+    """
+
+    def __init__(self, tau=0.02, max_velocity=5.24):
+        self.tau = tau
+        self.max_velocity = max_velocity
+        self.goals = {}
+        self.positions = {}
+        self.velocities = {}
+        self.last_update = time.time()
+
+    def update(self):
+        now = time.time()
+        dt = now - self.last_update
+        self.last_update = now
+        if dt <= 0:
+            return
+        for id, goal in self.goals.items():
+            position = self.positions.get(id, 0.0)
+            step = (goal - position) * (1 - np.exp(-dt / self.tau))
+            step = np.clip(step, -self.max_velocity * dt, self.max_velocity * dt)
+            self.positions[id] = position + step
+            self.velocities[id] = step / dt
+
+    def set_kps(self, ids, kps):
+        pass
+
+    def set_kds(self, ids, kds):
+        pass
+
+    def disable_torque(self, ids):
+        self.update()
+        for id in ids:
+            self.goals.pop(id, None)
+            self.velocities[id] = 0.0
+
+    def write_goal_position(self, ids, positions):
+        self.update()
+        for id, position in zip(ids, positions):
+            self.goals[id] = float(position)
+
+    def read_present_position(self, ids):
+        self.update()
+        return [self.positions.get(id, 0.0) for id in ids]
+
+    def read_present_velocity(self, ids):
+        self.update()
+        return [self.velocities.get(id, 0.0) for id in ids]
+
+
+class SimFeetContacts:
+    """
+    Synthetic feet contacts. Both feet are on the ground by default. If a
+    period is given, the feet alternate (with double support phases lasting
+    double_support_ratio of each half period).
+    """
+
+    def __init__(self, period=None, double_support_ratio=0.2):
+        self.period = period
+        self.double_support_ratio = double_support_ratio
+        self.start = time.time()
+
+    def get(self):
+        if self.period is None:
+            return [True, True]
+
+        phase = ((time.time() - self.start) % self.period) / self.period
+        half_phase = (phase % 0.5) * 2
+        if half_phase < self.double_support_ratio:
+            return [True, True]
+        # left foot swings during the first half, right during the second
+        return [phase >= 0.5, phase < 0.5]
+
+    def stop(self):
+        pass
+
+
+class ReplayFeetContacts:
+    """
+    Returns the feet contacts of a sensor log at the current elapsed time.
+    """
+
+    def __init__(self, log, loop=True, freq=50):
+        if isinstance(log, str):
+            log = load_sensor_log(log, freq)
+        self.times = log["times"]
+        self.feet_contacts = log["feet_contacts"] > 0.5
+        self.loop = loop
+        self.duration = self.times[-1] + (self.times[-1] / max(1, len(self.times) - 1))
+        self.start = time.time()
+
+    def get(self):
+        t = time.time() - self.start
+        if self.loop:
+            t = t % self.duration
+        i = np.searchsorted(self.times, t, side="right") - 1
+        i = min(max(i, 0), len(self.times) - 1)
+        return [bool(self.feet_contacts[i][0]), bool(self.feet_contacts[i][1])]
+
+    def stop(self):
+        pass
+
+
+def make_imu(
+    backend,
+    sampling_freq,
+    user_pitch_bias=0,
+    upside_down=True,
+    filter_config={},
+    sensor_log=None,
+    **sim_kwargs,
+):
+    """
+    sim_kwargs are SimImu's settings (gyro_noise, accelero_noise, gyro_bias,
+    accelero_bias, dropout, seed, and rate to sample at another frequency
+    than sampling_freq), only used by the sim backend
+    """
+    if backend == "hardware":
+        from mini_bdx_runtime.raw_imu import Imu
+
+        return Imu(
+            sampling_freq=sampling_freq,
+            user_pitch_bias=user_pitch_bias,
+            upside_down=upside_down,
+            filter_config=filter_config,
+        )
+    elif backend == "sim":
+        rate = sim_kwargs.pop("rate", sampling_freq)
+        return SimImu(rate, filter_config=filter_config, **sim_kwargs)
+    elif backend == "replay":
+        if sensor_log is None:
+            raise ValueError("The replay imu backend needs a sensor log")
+        return ReplayImu(sensor_log, filter_config=filter_config, freq=sampling_freq)
+    else:
+        raise ValueError(f"Unknown sensor backend {backend}, use {SENSOR_BACKENDS}")
+
+
+def make_feet_contacts(backend, sensor_log=None, freq=50):
+    if backend == "hardware":
+        from mini_bdx_runtime.feet_contacts import FeetContacts
+
+        return FeetContacts()
+    elif backend == "sim":
+        return SimFeetContacts()
+    elif backend == "replay":
+        if sensor_log is None:
+            raise ValueError("The replay feet contacts backend needs a sensor log")
+        return ReplayFeetContacts(sensor_log, freq=freq)
+    else:
+        raise ValueError(f"Unknown sensor backend {backend}, use {SENSOR_BACKENDS}")
+
+
+def make_hwi(backend, duck_config, serial_port="/dev/ttyACM0"):
+    """
+    The real servos for "hardware", a SimServoBus for "sim" and "replay" (no
+    rustypot or serial port needed)
+    """
+    if backend == "hardware":
+        return HWI(duck_config, serial_port)
+    elif backend in ["sim", "replay"]:
+        return HWI(duck_config, serial_port, io=SimServoBus())
+    else:
+        raise ValueError(f"Unknown sensor backend {backend}, use {SENSOR_BACKENDS}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", type=str, default="sim", choices=["sim", "replay"])
+    parser.add_argument("--sensor_log", type=str, default=None)
+    parser.add_argument("--freq", type=float, default=50)
+    parser.add_argument("--gyro_noise", type=float, default=0.01, help="rad/s, sim")
+    parser.add_argument("--accelero_noise", type=float, default=0.05, help="m/s^2, sim")
+    parser.add_argument("--dropout", type=float, default=0.0, help="sim")
+    args = parser.parse_args()
+
+    log = None
+    if args.sensor_log is not None:
+        log = load_sensor_log(args.sensor_log, args.freq)
+
+    sim_kwargs = {}
+    if args.backend == "sim":
+        sim_kwargs = {
+            "gyro_noise": args.gyro_noise,
+            "accelero_noise": args.accelero_noise,
+            "dropout": args.dropout,
+        }
+    imu = make_imu(args.backend, args.freq, sensor_log=log, **sim_kwargs)
+    feet_contacts = make_feet_contacts(args.backend, sensor_log=log, freq=args.freq)
+    try:
+        while True:
+            data = imu.get_data()
+            print("gyro", np.around(data["gyro"], 3))
+            print("accelero", np.around(data["accelero"], 3))
+            print("feet contacts", feet_contacts.get())
+            print("---")
+            time.sleep(1 / 25)
+    except KeyboardInterrupt:
+        imu.stop()
+        feet_contacts.stop()
@@ -0,0 +1,281 @@
+"""
+Batch analysis of actuator recordings (capture_actuators.py .rec files, or
+the pickles from record_data.py), processed in parallel by a process pool.
+
+For each file and motor : rise time (10-90%), overshoot, settling time (2%),
+steady state error, tracking latency and load / current statistics. Rise,
+overshoot and settling are only defined for steps, the latency is the dead
+time for steps and the goal to position lag (cross correlation) otherwise.
+
+    python analyze_step_responses.py captures/ -o summary.csv --plot sweep.png
+"""
+
+import argparse
+import csv
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from mini_bdx_runtime.run_recorder import load_actuator_recording
+
+COLUMNS = [
+    "file",
+    "motor",
+    "kp",
+    "kd",
+    "acceleration",
+    "profile",
+    "rate",
+    "step",
+    "rise_time",
+    "overshoot",
+    "settling_time",
+    "steady_state_error",
+    "latency",
+    "mean_abs_load",
+    "max_abs_load",
+    "mean_abs_current",
+    "max_abs_current",
+]
+
+
+def step_metrics(times, goal, position, settling_band=0.02):
+    """
+    Step response of one motor, the step is the difference between the final
+    goal and the position when the goal changed (or at the start)
+    """
+    changes = np.flatnonzero(goal != goal[0])
+    i0 = changes[0] if len(changes) > 0 else 0
+    t = times[i0:] - times[i0]
+    pos = position[i0:]
+    target = goal[-1]
+    step = target - pos[0]
+    if abs(step) < 1e-6:
+        return dict.fromkeys(
+            ["step", "rise_time", "overshoot", "settling_time", "latency"], np.nan
+        )
+
+    # normalized response, 0 at the start, 1 at the goal
+    y = (pos - pos[0]) / step
+
+    def first_time_above(level):
+        above = np.flatnonzero(y >= level)
+        return t[above[0]] if len(above) > 0 else np.nan
+
+    outside = np.flatnonzero(np.abs(y - 1) > settling_band)
+    if len(outside) == 0:
+        settling_time = 0.0
+    elif outside[-1] + 1 < len(t):
+        settling_time = t[outside[-1] + 1]
+    else:
+        settling_time = np.nan  # never settled
+
+    return {
+        "step": step,
+        "rise_time": first_time_above(0.9) - first_time_above(0.1),
+        "overshoot": max(0.0, y.max() - 1) * 100,  # %
+        "settling_time": settling_time,
+        "latency": first_time_above(settling_band),
+    }
+
+
+def tracking_lag(times, goal, position, max_lag=0.5):
+    """
+    Lag (s) maximizing the cross correlation between the goal and the
+    position, both resampled on a uniform grid
+    """
+    dt = np.median(np.diff(times))
+    grid = np.arange(times[0], times[-1], dt)
+    g = np.interp(grid, times, goal)
+    p = np.interp(grid, times, position)
+    g -= g.mean()
+    p -= p.mean()
+    n = len(grid)
+    max_shift = min(int(max_lag / dt), n - 1)
+    # correlation of the goal with the position delayed by k samples
+    corr = np.correlate(p, g, mode="full")[n - 1 : n + max_shift]
+    corr /= n - np.arange(len(corr))  # unbiased, fewer overlapping samples
+    return np.argmax(corr) * dt
+
+
+def analyze_file(path):
+    """
+    Returns one summary row per motor
+    """
+    rec = load_actuator_recording(path)
+    times = rec["times"]
+    tail = times >= times[-1] - 0.1 * (times[-1] - times[0])
+    rows = []
+    for m, motor in enumerate(rec["motors"]):
+        goal = rec["goal"][:, m].astype(np.float64)
+        position = rec["position"][:, m].astype(np.float64)
+        valid = ~np.isnan(position)  # failed reads
+        row = {
+            "file": os.path.basename(path),
+            "motor": motor,
+            "kp": rec.get("kp"),
+            "kd": rec.get("kd"),
+            "acceleration": rec.get("acceleration"),
+            "profile": rec.get("profile", "step"),
+            "rate": (len(times) - 1) / (times[-1] - times[0]),
+        }
+        if rec.get("profile", "step") == "step":
+            row.update(step_metrics(times[valid], goal[valid], position[valid]))
+        else:
+            row.update(
+                dict.fromkeys(["step", "rise_time", "overshoot", "settling_time"])
+            )
+            row["latency"] = tracking_lag(times[valid], goal[valid], position[valid])
+        row["steady_state_error"] = np.nanmean((goal - position)[tail])
+        load = np.abs(rec["load"][:, m])
+        current = np.abs(rec["current"][:, m])
+        row["mean_abs_load"] = np.nanmean(load)
+        row["max_abs_load"] = np.nanmax(load)
+        row["mean_abs_current"] = np.nanmean(current)
+        row["max_abs_current"] = np.nanmax(current)
+        rows.append(row)
+    return rows
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.4g}"
+    return str(value)
+
+
+def print_table(rows, columns):
+    cells = [[format_value(row[c]) for c in columns] for row in rows]
+    widths = [max([len(c)] + [len(r[i]) for r in cells]) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+
+
+def write_csv(rows, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({c: format_value(row[c]) for c in COLUMNS})
+
+
+def plot_sweep(paths, rows, output=None):
+    """
+    The normalized responses of every file on one axis, and the step metrics
+    against kp (one line per kd)
+    """
+    import matplotlib
+
+    if output is not None:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(2, 2, figsize=(14, 9))
+    ax = axes[0, 0]
+    for path in paths:
+        rec = load_actuator_recording(path)
+        for m, motor in enumerate(rec["motors"]):
+            goal, position = rec["goal"][:, m], rec["position"][:, m]
+            label = f"{os.path.basename(path)} [{motor}]"
+            if rec.get("profile", "step") == "step" and goal[-1] != position[0]:
+                y = (position - position[0]) / (goal[-1] - position[0])
+                ax.plot(rec["times"], y, label=label)
+    ax.axhline(1.0, color="k", linestyle="--", linewidth=0.5)
+    ax.set_title("Normalized step responses")
+    ax.set_xlabel("s")
+    if len(ax.lines) <= 20:
+        ax.legend(fontsize="x-small")
+
+    metrics = [
+        (axes[0, 1], "rise_time", "Rise time (s)"),
+        (axes[1, 0], "overshoot", "Overshoot (%)"),
+        (axes[1, 1], "settling_time", "Settling time (s)"),
+    ]
+    steps = [r for r in rows if r["profile"] == "step" and r["kp"] is not None]
+    kds = sorted(set(r["kd"] for r in steps), key=lambda kd: (kd is None, kd))
+    for ax, metric, title in metrics:
+        for kd in kds:
+            points = sorted((r["kp"], r[metric]) for r in steps if r["kd"] == kd)
+            if len(points) > 0:
+                kps, values = zip(*points)
+                ax.plot(kps, values, "o-", label=f"kd {kd}")
+        ax.set_title(title)
+        ax.set_xlabel("kp")
+        if len(kds) > 0:
+            ax.legend(fontsize="small")
+
+    plt.tight_layout()
+    if output is not None:
+        plt.savefig(output)
+        print(f"Plots saved to {output}")
+    else:
+        plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "inputs", nargs="+", help="recordings (.rec or .pkl) or directories of them"
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, default=None, help="summary table (csv)"
+    )
+    parser.add_argument(
+        "--plot",
+        type=str,
+        default=None,
+        help="save the comparison plots to this file instead of showing them",
+    )
+    parser.add_argument("--no_plot", action="store_true", default=False)
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="worker processes (default: cpus)"
+    )
+    args = parser.parse_args()
+
+    paths = []
+    for input_path in args.inputs:
+        if os.path.isdir(input_path):
+            for ext in ["rec", "pkl"]:
+                paths.extend(glob.glob(os.path.join(input_path, f"*.{ext}")))
+        else:
+            paths.append(input_path)
+    paths = sorted(paths)
+    if len(paths) == 0:
+        raise ValueError(f"No recordings found in {args.inputs}")
+
+    s = time.time()
+    rows = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for path, file_rows in zip(paths, executor.map(analyze_file, paths)):
+            rows.extend(file_rows)
+    rows.sort(key=lambda r: [(r[c] is None, r[c]) for c in ["kp", "kd", "file"]])
+    print(f"Analyzed {len(paths)} files in {time.time() - s:.2f}s\n")
+
+    print_table(
+        rows,
+        [
+            "file",
+            "motor",
+            "kp",
+            "kd",
+            "rate",
+            "rise_time",
+            "overshoot",
+            "settling_time",
+            "steady_state_error",
+            "latency",
+            "mean_abs_load",
+            "max_abs_current",
+        ],
+    )
+    if args.output is not None:
+        write_csv(rows, args.output)
+        print(f"\nSummary saved to {args.output}")
+
+    if not args.no_plot:
+        plot_sweep(paths, rows, args.plot)
@@ -0,0 +1,347 @@
+"""
+High rate actuator capture, replaces record_data.py / new_record_data.py.
+
+Each sample is one sync write of the goal positions (no reply), then one sync
+read of the whole present state block of the STS3215 memory table (position,
+speed, load, voltage, temperature, ..., current) for all the motors, instead
+of four single register transactions per motor and a sleep. Samples are taken
+as fast as the bus allows (or at --rate).
+
+The motors answer the sync read one after the other, each motor's state is
+timestamped when its reply is parsed (read_time), so the skew between motors
+is one reply (~0.3ms at 1Mbps). With --no_sync_read (firmwares without sync
+read), each motor is read by its own transaction and the skew is one full
+transaction per motor.
+
+The goal follows a scripted profile (step, sine or chirp) around --offset, the
+samples are streamed to a run recording (run_recorder.py), one file per kp/kd
+combination :
+
+    python capture_actuators.py --ids 1 --profile step --amplitude 90 --kps 8 16 32
+    python capture_actuators.py --ids 1 2 --profile chirp --f0 0.5 --f1 10 -d 10
+
+Load them with run_recorder.load_actuator_recording(), the metadata holds the
+capture settings.
+"""
+
+import argparse
+import os
+import time
+from itertools import chain
+
+import numpy as np
+from pypot.feetech import FeetechSTS3215IO
+
+from mini_bdx_runtime.run_recorder import RunRecorder
+
+# STS3215 memory table
+GOAL_POSITION_ADDRESS = 42
+PRESENT_ADDRESS = 56  # present position, first register of the block
+PRESENT_LENGTH = 15  # up to the present current (69-70)
+
+STEPS_PER_RAD = 4096 / (2 * np.pi)
+CENTER_STEP = 2048
+
+BROADCAST_ID = 0xFE
+SYNC_READ = 0x82  # feetech's, pypot's v1 protocol only knows the USB2AX one
+
+
+def sign_magnitude(value, sign_bit):
+    if value & (1 << sign_bit):
+        return -(value & ((1 << sign_bit) - 1))
+    return value
+
+
+def convert_load(raw_load):
+    # same convention as record_data.py
+    sign = -1
+    if raw_load > 1023:
+        raw_load -= 1024
+        sign = 1
+    return sign * raw_load * 0.001
+
+
+def decode_present(block):
+    """
+    block is the PRESENT_LENGTH bytes read from PRESENT_ADDRESS. Returns
+    position (rad), speed (rad/s), load, voltage (V), temperature (C),
+    current (mA)
+    """
+    position = block[0] | block[1] << 8  # unsigned steps, 0..4095
+    speed = block[2] | block[3] << 8
+    load = block[4] | block[5] << 8
+    current = block[13] | block[14] << 8
+    return (
+        (position - CENTER_STEP) / STEPS_PER_RAD,
+        sign_magnitude(speed, 15) / STEPS_PER_RAD,
+        convert_load(load),
+        block[6] * 0.1,
+        block[7],
+        sign_magnitude(current, 15) * 6.5,
+    )
+
+
+def make_profile(name, amplitude, frequency=1.0, f0=0.5, f1=10.0, duration=3.0):
+    """
+    Returns goal(t), in rad relative to the offset
+    """
+    if name == "step":
+        return lambda t: amplitude
+    if name == "sine":
+        return lambda t: amplitude * np.sin(2 * np.pi * frequency * t)
+    if name == "chirp":
+        # linear frequency sweep from f0 to f1 over the duration
+        k = (f1 - f0) / duration
+        return lambda t: amplitude * np.sin(2 * np.pi * (f0 * t + k * t * t / 2))
+    raise ValueError(f"Unknown profile {name}, expected step, sine or chirp")
+
+
+class FeetechBus:
+    """
+    Raw packet access to a pypot FeetechSTS3215IO. pypot has no public API for
+    this, all the private members it relies on (_send_packet, _protocol,
+    _serial, _serial_lock, flush(_force_lock)) are used here only. Written
+    against the pypot version pinned in setup.cfg
+    (pollen-robotics/pypot@support-feetech-sts3215, AbstractDxlIO of pypot 5.x)
+    """
+
+    def __init__(self, io):
+        self.io = io
+        self.protocol = io._protocol
+
+    def sync_write(self, address, length, couples):
+        self.io._send_packet(
+            self.protocol.DxlSyncWritePacket(address, length, couples),
+            wait_for_status_packet=False,
+        )
+
+    def read(self, id, address, length):
+        """
+        One read transaction, returns the bytes or None
+        """
+        status = self.io._send_packet(
+            self.protocol.DxlReadDataPacket(id, address, length)
+        )
+        if not status or len(status.parameters) < length:
+            return None
+        return status.parameters
+
+    def sync_read(self, ids, address, length, clock=time.perf_counter):
+        """
+        One sync read, the motors reply in turn. Returns {id: (bytes, clock()
+        when the reply was parsed)}, the motors that didn't reply are missing
+        """
+        packet = self.protocol.DxlInstructionPacket(
+            BROADCAST_ID, SYNC_READ, tuple(chain((address, length), ids))
+        )
+        header_length = self.protocol.DxlPacketHeader.length
+        replies = {}
+        with self.io._serial_lock:
+            self.io.flush(_force_lock=True)
+            self.io._serial.write(packet.to_string())
+            for _ in ids:
+                data = self.io._serial.read(header_length)
+                if len(data) < header_length:
+                    break  # timeout, the next replies are lost too
+                try:
+                    header = self.protocol.DxlPacketHeader.from_string(data)
+                    data += self.io._serial.read(header.packet_length)
+                    status = self.protocol.DxlStatusPacket.from_string(data)
+                except ValueError:
+                    break  # out of sync with the replies
+                if len(status.parameters) >= length:
+                    replies[status.id] = (status.parameters, clock())
+        return replies
+
+
+class ActuatorCapture:
+    def __init__(self, io, ids, sync_read=True):
+        """
+        io is a pypot FeetechSTS3215IO. sync_read False reads each motor with
+        its own transaction
+        """
+        self.bus = FeetechBus(io)
+        self.ids = list(ids)
+        self.sync_read = sync_read
+
+    def write_goals(self, goals):
+        """
+        goals in rad, one sync write for all the motors
+        """
+        couples = []
+        for id, goal in zip(self.ids, goals):
+            step = int(round(goal * STEPS_PER_RAD)) + CENTER_STEP
+            couples.extend((id, step & 0xFF, (step >> 8) & 0xFF))
+        self.bus.sync_write(GOAL_POSITION_ADDRESS, 2, couples)
+
+    def read_present(self, start):
+        """
+        Returns [(values or None, read time relative to start)] for each motor
+        """
+        clock = lambda: time.perf_counter() - start
+        if self.sync_read:
+            replies = self.bus.sync_read(
+                self.ids, PRESENT_ADDRESS, PRESENT_LENGTH, clock
+            )
+            failed = (None, clock())
+            return [
+                (
+                    (decode_present(replies[id][0]), replies[id][1])
+                    if id in replies
+                    else failed
+                )
+                for id in self.ids
+            ]
+
+        states = []
+        for id in self.ids:
+            block = self.bus.read(id, PRESENT_ADDRESS, PRESENT_LENGTH)
+            states.append((None if block is None else decode_present(block), clock()))
+        return states
+
+    def run(self, recorder, profile, offset, duration, rate=0):
+        """
+        Follows offset + profile(t) for duration seconds, rate 0 is as fast as
+        possible. Returns the number of samples and of failed reads
+        """
+        nb_motors = len(self.ids)
+        goals = np.zeros(nb_motors)
+        state = np.zeros((6, nb_motors))
+        read_times = np.zeros(nb_motors)
+        nb_samples = 0
+        nb_errors = 0
+
+        start = time.perf_counter()
+        next_t = start
+        while True:
+            t = time.perf_counter() - start
+            if t > duration:
+                break
+            goals[:] = offset + profile(t)
+            self.write_goals(goals)
+            for i, (values, read_time) in enumerate(self.read_present(start)):
+                read_times[i] = read_time
+                if values is None:
+                    nb_errors += 1
+                    state[:, i] = np.nan
+                else:
+                    state[:, i] = values
+            recorder.record(
+                t,
+                goal=goals,
+                read_time=read_times,
+                position=state[0],
+                speed=state[1],
+                load=state[2],
+                voltage=state[3],
+                temperature=state[4],
+                current=state[5],
+            )
+            nb_samples += 1
+
+            if rate > 0:
+                next_t += 1 / rate
+                time.sleep(max(0, next_t - time.perf_counter()))
+
+        return nb_samples, nb_errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=str, default="/dev/ttyACM0")
+    parser.add_argument("--ids", type=int, nargs="+", default=[1])
+    parser.add_argument(
+        "--profile", type=str, default="step", choices=["step", "sine", "chirp"]
+    )
+    parser.add_argument("--amplitude", type=float, default=90, help="deg")
+    parser.add_argument(
+        "--offset", type=float, default=0, help="deg, start position of the profile"
+    )
+    parser.add_argument("--frequency", type=float, default=1.0, help="Hz, sine")
+    parser.add_argument("--f0", type=float, default=0.5, help="Hz, chirp start")
+    parser.add_argument("--f1", type=float, default=10.0, help="Hz, chirp end")
+    parser.add_argument("-d", "--duration", type=float, default=3.0, help="s")
+    parser.add_argument(
+        "--rate", type=float, default=0, help="Hz, 0 samples as fast as possible"
+    )
+    parser.add_argument("--kps", type=int, nargs="+", default=[32])
+    parser.add_argument("--kds", type=int, nargs="+", default=[0])
+    parser.add_argument("--acceleration", type=int, default=0)
+    parser.add_argument(
+        "--settle", type=float, default=3.0, help="s, wait at the start position"
+    )
+    parser.add_argument(
+        "--no_sync_read",
+        action="store_true",
+        default=False,
+        help="one read transaction per motor, for firmwares without sync read",
+    )
+    parser.add_argument("-o", "--output_dir", type=str, default="captures")
+    parser.add_argument(
+        "--firmware", type=str, default="", help="firmware note saved in the metadata"
+    )
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    io = FeetechSTS3215IO(args.port)
+    capture = ActuatorCapture(io, args.ids, sync_read=not args.no_sync_read)
+    nb_motors = len(args.ids)
+
+    amplitude = np.deg2rad(args.amplitude)
+    offset = np.deg2rad(args.offset)
+    profile = make_profile(
+        args.profile, amplitude, args.frequency, args.f0, args.f1, args.duration
+    )
+
+    io.set_acceleration({id: args.acceleration for id in args.ids})
+    for kp in args.kps:
+        for kd in args.kds:
+            print(f"kp: {kp}, kd: {kd}")
+            io.set_P_coefficient({id: kp for id in args.ids})
+            io.set_D_coefficient({id: kd for id in args.ids})
+
+            # the step starts from the offset, the others from profile(0)
+            start = offset if args.profile == "step" else offset + profile(0)
+            capture.write_goals([start] * nb_motors)
+            time.sleep(args.settle)
+
+            path = os.path.join(args.output_dir, f"{args.profile}_kp_{kp}_kd_{kd}.rec")
+            recorder = RunRecorder(
+                path,
+                fields={
+                    "goal": nb_motors,
+                    "read_time": ("<f8", nb_motors),
+                    "position": nb_motors,
+                    "speed": nb_motors,
+                    "load": nb_motors,
+                    "voltage": nb_motors,
+                    "temperature": nb_motors,
+                    "current": nb_motors,
+                },
+                metadata={
+                    "ids": args.ids,
+                    "kp": kp,
+                    "kd": kd,
+                    "acceleration": args.acceleration,
+                    "profile": args.profile,
+                    "amplitude": amplitude,
+                    "offset": offset,
+                    "frequency": args.frequency,
+                    "f0": args.f0,
+                    "f1": args.f1,
+                    "duration": args.duration,
+                    "rate": args.rate,
+                    "firmware": args.firmware,
+                    "sync_read": not args.no_sync_read,
+                    "start_time": time.time(),
+                },
+                chunk_size=200,
+            )
+            nb_samples, nb_errors = capture.run(
+                recorder, profile, offset, args.duration, args.rate
+            )
+            recorder.close()
+            print(
+                f"{nb_samples} samples in {args.duration}s ({nb_samples / args.duration:.0f}Hz),"
+                f" {nb_errors} failed reads"
+            )
@@ -0,0 +1,48 @@
+"""
+Converts polynomial_coefficients.pkl to the .npz format, which loads much faster
+on the robot (memory mapped coefficient tensor, no key parsing).
+
+    python convert_poly_coefficients.py -i polynomial_coefficients.pkl
+"""
+
+import argparse
+import os
+
+import numpy as np
+
+from mini_bdx_runtime.poly_reference_motion import PolyReferenceMotion
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i", "--input", type=str, default="polynomial_coefficients.pkl"
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, default=None, help="defaults to <input>.npz"
+    )
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.input)[0] + ".npz"
+
+    PRM = PolyReferenceMotion(args.input)
+    PRM.save_npz(output)
+    print(f"Saved {output}, coefficients {PRM.coefficients.shape}")
+
+    # both formats must give the same reference motion
+    converted = PolyReferenceMotion(output)
+    i = np.arange(converted.nb_steps_in_period)
+    max_diff = 0
+    for dx in PRM.dxs:
+        for dy in PRM.dys:
+            for dtheta in PRM.dthetas:
+                max_diff = max(
+                    max_diff,
+                    np.abs(
+                        PRM.get_reference_motion(dx, dy, dtheta, i)
+                        - converted.get_reference_motion(dx, dy, dtheta, i)
+                    ).max(),
+                )
+    print("Max diff : ", max_diff)
+    print(
+        "Size : ", os.path.getsize(args.input), "->", os.path.getsize(output), "bytes"
+    )
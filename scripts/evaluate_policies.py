@@ -0,0 +1,189 @@
+"""
+Offline comparison of onnx policies on recorded observations (--save_obs
+recordings, or pickled lists from mujoco), without the robot.
+
+The policies are exported with a batch size of 1, their batch dimension is made
+dynamic so that thousands of observations go through in a few large batches.
+The first policy is the reference, the others are compared to it.
+
+    python evaluate_policies.py -o ref.onnx new.onnx --obs robot_saved_obs.rec
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import onnx
+
+from mini_bdx_runtime.onnx_infer import OnnxInfer, make_session
+from mini_bdx_runtime.run_recorder import load_observations
+
+
+def make_dynamic_batch(model, batch_dim="batch"):
+    """
+    Replaces the first dimension of the graph's inputs and outputs with a named
+    dynamic dimension. The intermediate shapes are dropped, onnxruntime infers
+    them again
+    """
+    graph = model.graph
+    initializers = set(init.name for init in graph.initializer)
+    for value in list(graph.input) + list(graph.output):
+        if value.name in initializers:
+            continue
+        dims = value.type.tensor_type.shape.dim
+        if len(dims) > 0:
+            dims[0].Clear()
+            dims[0].dim_param = batch_dim
+    del graph.value_info[:]
+
+    for node in graph.node:
+        if node.op_type in ["Reshape", "Expand", "Tile"]:
+            print(
+                f"Warning : {node.op_type} node {node.name} may have the batch size hardcoded"
+            )
+    return model
+
+
+class BatchedPolicy:
+    def __init__(self, onnx_model_path, session_profile=None):
+        self.onnx_model_path = onnx_model_path
+        model = make_dynamic_batch(onnx.load(onnx_model_path))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, os.path.basename(onnx_model_path))
+            onnx.save(model, path)
+            self.session = make_session(path, session_profile)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def infer(self, observations, batch_size):
+        """
+        Returns the actions and the time taken by each batch
+        """
+        actions = []
+        times = []
+        for start in range(0, len(observations), batch_size):
+            batch = observations[start : start + batch_size]
+            s = time.perf_counter()
+            actions.append(self.session.run(None, {self.input_name: batch})[0])
+            times.append(time.perf_counter() - s)
+        return np.concatenate(actions), np.array(times)
+
+
+def describe_batches(nb_observations, batch_size):
+    """
+    "3 batches of 1024 + 1 of 109", "1 batch of 109"
+    """
+    nb_full, rest = divmod(nb_observations, batch_size)
+    parts = []
+    if nb_full > 0:
+        parts.append(f"{nb_full} batch{'es' if nb_full > 1 else ''} of {batch_size}")
+    if rest > 0:
+        parts.append(f"1 batch of {rest}" if nb_full == 0 else f"1 of {rest}")
+    return " + ".join(parts)
+
+
+def compare(reference_actions, actions):
+    errors = np.abs(actions - reference_actions)
+    return {
+        "max_error": errors.max(),
+        "rms_error": np.sqrt(np.mean(errors**2)),
+        "per_joint_max_error": errors.max(axis=0),
+        "per_joint_mean_error": errors.mean(axis=0),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-o",
+        "--onnx_model_paths",
+        nargs="+",
+        required=True,
+        help="the first one is the reference",
+    )
+    parser.add_argument(
+        "--obs",
+        nargs="+",
+        required=True,
+        help="recorded observations (robot_saved_obs.rec from --save_obs, or a pickled list)",
+    )
+    parser.add_argument("-b", "--batch_size", type=int, default=1024)
+    parser.add_argument("--session_profile", type=str, default=None)
+    parser.add_argument(
+        "--max_error",
+        type=float,
+        default=None,
+        help="exit with an error if a policy's max action error is above this",
+    )
+    parser.add_argument(
+        "--check_single",
+        type=int,
+        default=100,
+        help="check the batched reference against single inferences on this many observations, 0 to skip",
+    )
+    parser.add_argument(
+        "--single_tolerance",
+        type=float,
+        default=1e-5,
+        help="exit with an error if the batched and single inferences differ by more than this",
+    )
+    args = parser.parse_args()
+
+    observation_sets = {
+        path: np.ascontiguousarray(load_observations(path), dtype=np.float32)
+        for path in args.obs
+    }
+    for path, observations in observation_sets.items():
+        print(f"Loaded {len(observations)} observations from {path}")
+
+    policies = [
+        BatchedPolicy(path, args.session_profile) for path in args.onnx_model_paths
+    ]
+
+    # the batched graph must give the same actions as the original one
+    if args.check_single > 0:
+        single = OnnxInfer(args.onnx_model_paths[0], awd=True)
+        observations = next(iter(observation_sets.values()))[: args.check_single]
+        single_actions = np.array([single.infer(obs) for obs in observations])
+        batched_actions, _ = policies[0].infer(observations, args.batch_size)
+        print(
+            "Batched vs single inference max diff : ",
+            np.abs(batched_actions - single_actions).max(),
+        )
+        if not np.allclose(batched_actions, single_actions, atol=args.single_tolerance):
+            print(
+                f"FAILED : the batched inference differs from the single one"
+                f" (tolerance {args.single_tolerance})"
+            )
+            exit(1)
+
+    failed = False
+    for obs_path, observations in observation_sets.items():
+        print(f"\n=== {obs_path} ({len(observations)} observations)")
+        reference_actions = None
+        for policy in policies:
+            actions, times = policy.infer(observations, args.batch_size)
+            print(f"[{policy.onnx_model_path}]")
+            print(
+                f"  {describe_batches(len(observations), args.batch_size)} :"
+                f" {times.sum() * 1000:.1f}ms,"
+                f" {len(observations) / times.sum():.0f} obs/s"
+            )
+            if reference_actions is None:
+                reference_actions = actions
+                continue
+
+            res = compare(reference_actions, actions)
+            print("  Max action error : ", res["max_error"])
+            print("  RMS action error : ", res["rms_error"])
+            print("  Per joint max error : ", np.around(res["per_joint_max_error"], 4))
+            print(
+                "  Per joint mean error : ", np.around(res["per_joint_mean_error"], 4)
+            )
+            if args.max_error is not None and res["max_error"] > args.max_error:
+                print(f"  FAILED : max error above {args.max_error}")
+                failed = True
+
+    if failed:
+        exit(1)
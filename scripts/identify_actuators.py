@@ -0,0 +1,271 @@
+"""
+Identification of the STS3215 servo dynamics from actuator recordings
+(capture_actuators.py .rec files or record_data.py pickles), to replace the
+hand tuned guesses.
+
+Model (per unit of inertia, goal and position in rad) :
+
+    e = deadzone(goal(t - latency) - position, backlash)
+    acceleration = (stiffness + stiffness_per_kp * kp) * e
+                   - (damping + damping_per_kd * kd) * velocity
+                   - friction * sign(velocity)
+    |velocity| <= max_velocity
+
+The linear parameters are fitted by least squares on all the samples of all
+the recordings at once, for every (latency, backlash) pair of a grid (the
+backlash candidates are solved as one batch), the best pair is kept. The
+fitted model is then simulated on each recording to check it.
+
+    python identify_actuators.py captures/ -o sts3215_model.json
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from mini_bdx_runtime.run_recorder import load_actuator_recording
+
+LINEAR_PARAMETERS = [
+    "stiffness",
+    "stiffness_per_kp",
+    "damping",
+    "damping_per_kd",
+    "friction",
+]
+
+
+def smooth(x, window):
+    if window <= 1:
+        return x
+    kernel = np.ones(window) / window
+    padded = np.pad(x, (window // 2, window - 1 - window // 2), mode="edge")
+    return np.convolve(padded, kernel, mode="valid")
+
+
+def prepare_recording(path, dt=None, smoothing=5):
+    """
+    Resamples each motor of a recording on a uniform grid. The goal is held
+    from its write time (timestamp), the position is placed at its read time
+    when it was recorded, so the latency is the one from the write to the
+    motion. Returns a list of dicts (one per motor)
+    """
+    rec = load_actuator_recording(path)
+    times = rec["times"]
+    read_times = rec.get("read_time")
+    if dt is None:
+        dt = float(np.median(np.diff(times)))
+    grid = np.arange(times[0], times[-1], dt)
+
+    motors = []
+    for m, motor in enumerate(rec["motors"]):
+        position_times = times if read_times is None else read_times[:, m]
+        position = rec["position"][:, m].astype(np.float64)
+        valid = ~np.isnan(position)  # failed reads
+        position = smooth(
+            np.interp(grid, position_times[valid], position[valid]), smoothing
+        )
+        velocity = smooth(np.gradient(position, dt), smoothing)
+        motors.append(
+            {
+                "name": f"{os.path.basename(path)} [{motor}]",
+                "dt": dt,
+                "t": grid,
+                "goal_times": times,
+                "goal": rec["goal"][:, m].astype(np.float64),
+                "position": position,
+                "velocity": velocity,
+                "acceleration": np.gradient(velocity, dt),
+                "kp": float(rec.get("kp") or 0),
+                "kd": float(rec.get("kd") or 0),
+            }
+        )
+    return motors
+
+
+def delayed_goal(motor, latency):
+    """
+    Goal seen by the servo at each grid time. Before the first write it is
+    the initial position (the captures start settled at their first goal)
+    """
+    i = np.searchsorted(motor["goal_times"], motor["t"] - latency, side="right") - 1
+    return np.where(i >= 0, motor["goal"][np.maximum(i, 0)], motor["position"][0])
+
+
+def deadzone(e, width):
+    """
+    e with the [-width, width] band removed, width can be a (B, 1) column to
+    get the B candidates at once
+    """
+    return np.sign(e) * np.maximum(np.abs(e) - width, 0.0)
+
+
+def fit_linear(motors, latency, backlashes, max_velocity):
+    """
+    Least squares of the linear parameters for one latency and all the
+    backlash candidates. Returns (B, nb_parameters) parameters and the
+    (B,) residual RMS
+    """
+    errors = []
+    columns = []
+    targets = []
+    for motor in motors:
+        # the velocity saturated samples don't follow the linear model
+        keep = np.abs(motor["velocity"]) < 0.9 * max_velocity
+        errors.append((delayed_goal(motor, latency) - motor["position"])[keep])
+        velocity = motor["velocity"][keep]
+        columns.append(
+            np.stack(
+                [
+                    -velocity,
+                    -motor["kd"] * velocity,
+                    -np.sign(velocity),
+                    np.full(len(velocity), motor["kp"]),
+                ]
+            )
+        )
+        targets.append(motor["acceleration"][keep])
+    e = deadzone(np.concatenate(errors), backlashes[:, np.newaxis])  # (B, N)
+    velocity_terms = np.concatenate(columns, axis=1)  # (4, N)
+    y = np.concatenate(targets)
+
+    B, N = e.shape
+    X = np.empty((B, N, len(LINEAR_PARAMETERS)))
+    X[:, :, 0] = e
+    X[:, :, 1] = e * velocity_terms[3]
+    X[:, :, 2:] = velocity_terms[:3].T
+    # batched normal equations
+    XtX = np.matmul(X.transpose(0, 2, 1), X)
+    Xty = np.matmul(X.transpose(0, 2, 1), y)
+    # pseudo inverse : with a single kp (or kd) in the recordings, the per kp
+    # term can't be separated, the minimum norm solution is kept
+    params = np.einsum("bij,bj->bi", np.linalg.pinv(XtX), Xty)
+    residuals = y - np.matmul(X, params[:, :, np.newaxis])[:, :, 0]
+    return params, np.sqrt(np.mean(residuals**2, axis=1)), np.std(y)
+
+
+def identify(motors, latencies, backlashes):
+    max_velocity = float(
+        np.percentile(np.concatenate([np.abs(m["velocity"]) for m in motors]), 99.5)
+    )
+    best = None
+    for latency in latencies:
+        params, rms, y_std = fit_linear(motors, latency, backlashes, max_velocity)
+        b = np.argmin(rms)
+        if best is None or rms[b] < best[0]:
+            best = (rms[b], latency, backlashes[b], params[b], y_std)
+
+    rms, latency, backlash, params, y_std = best
+    model = dict(zip(LINEAR_PARAMETERS, params.tolist()))
+    model.update(
+        {
+            "backlash": float(backlash),
+            "latency": float(latency),
+            "max_velocity": max_velocity,
+            "acceleration_rms_error": float(rms),
+            "acceleration_r2": float(1 - (rms / y_std) ** 2),
+        }
+    )
+    return model
+
+
+def simulate(model, motor):
+    """
+    Position response of the model to the recorded goal, from the recorded
+    initial state
+    """
+    dt = motor["dt"]
+    goal = delayed_goal(motor, model["latency"]).tolist()
+    # python floats, the loop is much faster without numpy scalars
+    stiffness = float(model["stiffness"] + model["stiffness_per_kp"] * motor["kp"])
+    damping = float(model["damping"] + model["damping_per_kd"] * motor["kd"])
+    friction = float(model["friction"])
+    backlash = float(model["backlash"])
+    max_velocity = float(model["max_velocity"])
+
+    position = float(motor["position"][0])
+    velocity = float(motor["velocity"][0])
+    positions = np.empty(len(goal))
+    for k, g in enumerate(goal):
+        e = g - position
+        e = e - backlash if e > backlash else (e + backlash if e < -backlash else 0.0)
+        sign = (velocity > 0) - (velocity < 0)
+        velocity += (stiffness * e - damping * velocity - friction * sign) * dt
+        velocity = min(max(velocity, -max_velocity), max_velocity)
+        position += velocity * dt
+        positions[k] = position
+    return positions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "inputs", nargs="+", help="recordings (.rec or .pkl) or directories of them"
+    )
+    parser.add_argument(
+        "-o", "--output", type=str, default=None, help="save the model (json)"
+    )
+    parser.add_argument(
+        "--max_latency", type=float, default=60, help="ms, latency grid upper bound"
+    )
+    parser.add_argument("--latency_step", type=float, default=2, help="ms")
+    parser.add_argument(
+        "--max_backlash", type=float, default=3, help="deg, backlash grid upper bound"
+    )
+    parser.add_argument("--backlash_step", type=float, default=0.1, help="deg")
+    parser.add_argument(
+        "--smoothing",
+        type=int,
+        default=5,
+        help="moving average window (samples) of the position and velocity before differentiating",
+    )
+    args = parser.parse_args()
+
+    paths = []
+    for input_path in args.inputs:
+        if os.path.isdir(input_path):
+            for ext in ["rec", "pkl"]:
+                paths.extend(glob.glob(os.path.join(input_path, f"*.{ext}")))
+        else:
+            paths.append(input_path)
+    paths = sorted(paths)
+    if len(paths) == 0:
+        raise ValueError(f"No recordings found in {args.inputs}")
+
+    s = time.time()
+    motors = []
+    for path in paths:
+        motors.extend(prepare_recording(path, smoothing=args.smoothing))
+    nb_samples = sum(len(m["t"]) for m in motors)
+    print(f"Loaded {len(motors)} motor recordings ({nb_samples} samples)")
+
+    latencies = np.arange(0, args.max_latency + 1e-9, args.latency_step) / 1000
+    backlashes = np.deg2rad(np.arange(0, args.max_backlash + 1e-9, args.backlash_step))
+    model = identify(motors, latencies, backlashes)
+    print(
+        f"Fitted {len(latencies)} x {len(backlashes)} latency/backlash candidates"
+        f" in {time.time() - s:.2f}s\n"
+    )
+
+    for name, value in model.items():
+        print(f"  {name} : {value:.5g}")
+    print(
+        f"  (latency {model['latency'] * 1000:.1f}ms,"
+        f" backlash {np.rad2deg(model['backlash']):.2f}deg)\n"
+    )
+
+    print("Simulated position RMS error :")
+    for motor in motors:
+        error = simulate(model, motor) - motor["position"]
+        print(
+            f"  {motor['name']} (kp {motor['kp']:g}, kd {motor['kd']:g}) :"
+            f" {np.rad2deg(np.sqrt(np.mean(error**2))):.2f}deg"
+        )
+
+    if args.output is not None:
+        model["recordings"] = [os.path.basename(path) for path in paths]
+        json.dump(model, open(args.output, "w"), indent=4)
+        print(f"\nModel saved to {args.output}")
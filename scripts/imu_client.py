@@ -1,61 +1,39 @@
-import socket
+import argparse
 import time
+
 import numpy as np
-import pickle
-from queue import Queue
-from threading import Thread
 from scipy.spatial.transform import Rotation as R
 from FramesViewer.viewer import Viewer
-import argparse
-
-
-class IMUClient:
-    def __init__(self, host, port=1234, freq=30):
-        self.host = host
-        self.port = port
-        self.freq = freq
-        self.client_socket = socket.socket()
-        self.connected = False
-        while not self.connected:
-            try:
-                self.client_socket.connect((self.host, self.port))
-                self.connected = True
-            except Exception as e:
-                print(e)
-                time.sleep(0.5)
-        self.imu_queue = Queue(maxsize=1)
-        self.last_imu = [0, 0, 0, 0]
-
-        Thread(target=self.imu_worker, daemon=True).start()
-
-    def imu_worker(self):
-        while True:
-            try:
-                data = self.client_socket.recv(1024)  # receive response
-                data = pickle.loads(data)
-
-                self.imu_queue.put(data)
-            except:
-                print("missed imu")
-
-            time.sleep(1 / self.freq)
-
-    def get_imu(self):
-        try:
-            self.last_imu = self.imu_queue.get(False)
-        except:
-            pass
-
-        return self.last_imu
 
+from mini_bdx_runtime.imu_stream import (
+    DEFAULT_MULTICAST,
+    DEFAULT_PORT,
+    IMUStreamClient,
+    parse_group,
+)
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("--ip", type=str, required=True, help="IP address of the robot")
+    parser.add_argument("--ip", type=str, default=None, help="IP address of the robot")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--rate", type=float, default=30, help="Hz")
+    parser.add_argument(
+        "--multicast",
+        type=str,
+        nargs="?",
+        const=f"{DEFAULT_MULTICAST[0]}:{DEFAULT_MULTICAST[1]}",
+        default=None,
+        help="listen to this udp multicast group (ip:port) instead of connecting to --ip",
+    )
     args = parser.parse_args()
+    if args.ip is None and args.multicast is None:
+        parser.error("--ip or --multicast is required")
 
-    client = IMUClient(args.ip)
+    if args.multicast is not None:
+        client = IMUStreamClient(multicast=parse_group(args.multicast))
+    else:
+        client = IMUStreamClient(args.ip, args.port, rate=args.rate)
 
     fv = Viewer()
     fv.start()
@@ -1,62 +1,81 @@
-import socket
-import time
-import pickle
-from mini_bdx_runtime.imu import Imu
-from threading import Thread
-import time
-
-import argparse
-
-
-class IMUServer:
-    def __init__(self, imu=None):
-        self.host = "0.0.0.0"
-        self.port = 1234
-
-        self.server_socket = socket.socket()
-        self.server_socket.setsockopt(
-            socket.SOL_SOCKET, socket.SO_REUSEADDR, 1
-        )  # enable address reuse
-
-        self.server_socket.bind((self.host, self.port))
+"""
+Streams the imu to any number of clients (imu_client.py), see
+mini_bdx_runtime/imu_stream.py for the protocol. The imu is read in the
+server's thread at its sampling frequency whatever the clients do.
 
-        if imu is None:
-            self.imu = Imu(50, user_pitch_bias=args.pitch_bias, upside_down=False)
-        else:
-            self.imu = imu
-        self.stop = False
+    python imu_server.py
+    python imu_server.py --raw --multicast 239.255.13.37:5007
+"""
 
-        Thread(target=self.run, daemon=True).start()
-
-    def run(self):
-        while not self.stop:
-            self.server_socket.listen(1)
-            conn, address = self.server_socket.accept()  # accept new connection
-            print("Connection from: " + str(address))
-            try:
-                while True:
-                    data = self.imu.get_data()
-                    data = pickle.dumps(data)
-                    conn.send(data)  # send data to the client
-                    time.sleep(1 / 30)
-            except:
-                pass
-
-        self.server_socket.close()
-        print("thread closed")
-        time.sleep(1)
+import argparse
+import time
 
+from mini_bdx_runtime.imu_stream import (
+    DEFAULT_MULTICAST,
+    DEFAULT_PORT,
+    IMUStreamServer,
+    parse_group,
+)
+from mini_bdx_runtime.sim_sensors import make_imu, SENSOR_BACKENDS
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--pitch_bias", type=float, default=0, help="deg")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--freq", type=int, default=50, help="imu sampling frequency")
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        default=False,
+        help="stream the raw gyro / accelero (raw_imu.py) instead of the quaternion",
+    )
+    parser.add_argument(
+        "--sensors",
+        type=str,
+        default="hardware",
+        choices=SENSOR_BACKENDS,
+        help="raw imu backend, sim to test without the robot",
+    )
+    parser.add_argument(
+        "--sensor_log", type=str, default=None, help="for --sensors replay"
+    )
+    parser.add_argument(
+        "--multicast",
+        type=str,
+        nargs="?",
+        const=f"{DEFAULT_MULTICAST[0]}:{DEFAULT_MULTICAST[1]}",
+        default=None,
+        help="also send the frames to this udp multicast group (ip:port)",
+    )
+    parser.add_argument("--multicast_rate", type=float, default=30, help="Hz")
     args = parser.parse_args()
-    imu_server = IMUServer()
+
+    if args.raw or args.sensors != "hardware":
+        imu = make_imu(
+            args.sensors,
+            args.freq,
+            user_pitch_bias=args.pitch_bias,
+            sensor_log=args.sensor_log,
+        )
+    else:
+        from mini_bdx_runtime.imu import Imu
+
+        imu = Imu(args.freq, user_pitch_bias=args.pitch_bias, upside_down=False)
+
+    imu_server = IMUStreamServer(
+        imu,
+        freq=args.freq,
+        port=args.port,
+        multicast=None if args.multicast is None else parse_group(args.multicast),
+        multicast_rate=args.multicast_rate,
+    )
+    print(
+        f"Streaming on port {args.port}"
+        + (f", multicast {args.multicast}" if args.multicast else "")
+    )
     try:
         while True:
-            time.sleep(0.01)
+            time.sleep(1)
     except KeyboardInterrupt:
         print("Closing server")
-        imu_server.stop = True
-
-    time.sleep(2)
+        imu_server.close()
@@ -14,6 +14,7 @@ class Buttons:
         self.X = ButtonState(False, False)
         self.Y = ButtonState(False, False)
         self.LB = ButtonState(False, False)
+        self.RB = ButtonState(False, False)
         self.dpad_up = ButtonState(False, False)
         self.dpad_down = ButtonState(False, False)
 
@@ -39,6 +40,7 @@ class KeyboardController:
         X      : X
         Y      : Y
         LCTRL  : LB
+        TAB    : RB (next policy)
 
       Triggers:
         Z : left trigger  (0 or 1)
@@ -129,6 +131,9 @@ class KeyboardController:
         buttons.LB = self._make_button(
             keys[pygame.K_LCTRL], self.prev_keys[pygame.K_LCTRL]
         )
+        buttons.RB = self._make_button(
+            keys[pygame.K_TAB], self.prev_keys[pygame.K_TAB]
+        )
 
         buttons.dpad_up = self._make_button(keys[pygame.K_r], self.prev_keys[pygame.K_r])
         buttons.dpad_down = self._make_button(
@@ -0,0 +1,104 @@
+"""
+Runs a policy for a robot on the LAN (or localhost for testing). The robot
+sends its observations over UDP and gets the actions back, see
+mini_bdx_runtime/remote_policy.py for the protocol.
+
+On the robot :
+    python v2_rl_walk_mujoco.py --onnx_model_path <policy> --remote_policy <host>:4321
+"""
+
+import argparse
+import socket
+import time
+
+from mini_bdx_runtime.onnx_infer import OnnxInfer, BACKENDS, static_shape
+from mini_bdx_runtime.policy_worker import LatencyStats
+from mini_bdx_runtime.remote_policy import (
+    DEFAULT_PORT,
+    MAX_FRAME_SIZE,
+    pack_frame,
+    unpack_frame,
+)
+
+
+class PolicyServer:
+    def __init__(
+        self, policy, host="0.0.0.0", port=DEFAULT_PORT, delay=0, obs_size=None
+    ):
+        """
+        Requests with another number of floats than obs_size (the policy's
+        input width) are counted as invalid and not answered
+        """
+        self.policy = policy
+        self.obs_size = obs_size
+        self.delay = delay  # s, added before each reply to test the fallback
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+
+        self.recv_buffer = bytearray(MAX_FRAME_SIZE)
+        self.send_buffer = bytearray(MAX_FRAME_SIZE)
+        self.inference_time = LatencyStats()
+        self.nb_requests = 0
+        self.nb_invalid = 0
+
+    def serve_one(self):
+        size, address = self.sock.recvfrom_into(self.recv_buffer)
+        seq, obs = unpack_frame(self.recv_buffer, size)
+        if seq is None or (self.obs_size is not None and len(obs) != self.obs_size):
+            self.nb_invalid += 1
+            return
+
+        s = time.perf_counter()
+        action = self.policy.infer(obs)
+        self.inference_time.update(time.perf_counter() - s)
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+        size = pack_frame(self.send_buffer, seq, action)
+        self.sock.sendto(memoryview(self.send_buffer)[:size], address)
+        self.nb_requests += 1
+
+    def run(self, print_every=10):
+        last_print = time.time()
+        while True:
+            self.serve_one()
+            if print_every > 0 and time.time() - last_print > print_every:
+                last_print = time.time()
+                print(
+                    f"{self.nb_requests} requests, {self.nb_invalid} invalid, "
+                    + self.inference_time.summary("inference")
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--onnx_model_path", type=str, required=True)
+    parser.add_argument("--host", type=str, default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--session_profile", type=str, default=None)
+    parser.add_argument("--backend", type=str, default="onnxruntime", choices=BACKENDS)
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0,
+        help="ms added before each reply, to test the robot's deadline and fallback",
+    )
+    args = parser.parse_args()
+
+    policy = OnnxInfer(
+        args.onnx_model_path,
+        awd=True,
+        session_profile=args.session_profile,
+        backend=args.backend,
+    )
+    policy.warmup()
+
+    obs_size = static_shape(policy.ort_session.get_inputs()[0].shape)[-1]
+    server = PolicyServer(policy, args.host, args.port, args.delay / 1000, obs_size)
+    print(f"Serving {args.onnx_model_path} on {args.host}:{args.port}")
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        print("Closing server")
@@ -0,0 +1,234 @@
+"""
+Produces int8 (dynamic quantization) and float16 variants of an onnx policy,
+replays recorded observations (robot_saved_obs.rec, from --save_obs) through the
+original and the quantized models, and only writes the variants whose action
+error stays under the thresholds and that are faster than the original
+(--keep_slower to also write the slower ones).
+
+The outputs can be loaded directly with OnnxInfer (inputs/outputs stay float32)
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import onnx
+from onnx import numpy_helper, helper
+
+from mini_bdx_runtime.onnx_infer import OnnxInfer, benchmark
+from mini_bdx_runtime.run_recorder import load_observations
+
+
+def gemm_to_matmul(model):
+    """
+    onnxruntime's dynamic quantization only handles MatMul, so we rewrite
+    Gemm(x, W, b) (constant W, no transA) as MatMul(x, W') + b
+    """
+    graph = model.graph
+    initializers = {init.name: init for init in graph.initializer}
+    new_nodes = []
+    for node in graph.node:
+        attrs = {a.name: helper.get_attribute_value(a) for a in node.attribute}
+        if (
+            node.op_type != "Gemm"
+            or attrs.get("transA", 0)
+            or node.input[1] not in initializers
+        ):
+            new_nodes.append(node)
+            continue
+
+        w = numpy_helper.to_array(initializers[node.input[1]])
+        if attrs.get("transB", 0):
+            w = w.T
+        w = np.ascontiguousarray(w * attrs.get("alpha", 1.0), dtype=np.float32)
+        w_name = node.input[1] + "_matmul"
+        graph.initializer.append(numpy_helper.from_array(w, w_name))
+
+        if len(node.input) > 2 and node.input[2] != "":
+            matmul_out = node.output[0] + "_matmul"
+            new_nodes.append(
+                helper.make_node("MatMul", [node.input[0], w_name], [matmul_out])
+            )
+            b_name = node.input[2]
+            beta = attrs.get("beta", 1.0)
+            if beta != 1.0:
+                b = numpy_helper.to_array(initializers[b_name]) * beta
+                b_name = b_name + "_scaled"
+                graph.initializer.append(
+                    numpy_helper.from_array(b.astype(np.float32), b_name)
+                )
+            new_nodes.append(
+                helper.make_node("Add", [matmul_out, b_name], [node.output[0]])
+            )
+        else:
+            new_nodes.append(
+                helper.make_node("MatMul", [node.input[0], w_name], [node.output[0]])
+            )
+
+    del graph.node[:]
+    graph.node.extend(new_nodes)
+    return model
+
+
+def remove_unused_initializers(model):
+    """
+    Drops the initializers no node (nor graph output) uses anymore, e.g. the
+    original Gemm weights after gemm_to_matmul. Returns the bytes removed
+    """
+    graph = model.graph
+    used = {name for node in graph.node for name in node.input}
+    used.update(output.name for output in graph.output)
+    unused = [init for init in graph.initializer if init.name not in used]
+    removed = sum(init.ByteSize() for init in unused)
+    for init in unused:
+        graph.initializer.remove(init)
+    # old opsets also list the initializers as graph inputs
+    unused_names = {init.name for init in unused}
+    for graph_input in [i for i in graph.input if i.name in unused_names]:
+        graph.input.remove(graph_input)
+    return removed
+
+
+def make_int8(model_path, output_path):
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    model = gemm_to_matmul(onnx.load(model_path))
+    size = model.ByteSize()
+    removed = remove_unused_initializers(model)
+    print(
+        f"[int8] Removed {removed} bytes of unused initializers after the Gemm"
+        f" rewrite ({size} -> {model.ByteSize()} bytes)"
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        matmul_path = os.path.join(tmp_dir, "matmul.onnx")
+        onnx.save(model, matmul_path)
+        quantize_dynamic(matmul_path, output_path, weight_type=QuantType.QInt8)
+
+
+def make_fp16(model_path, output_path):
+    try:
+        from onnxconverter_common.float16 import convert_float_to_float16
+    except ImportError:
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    model = convert_float_to_float16(onnx.load(model_path), keep_io_types=True)
+    onnx.save(model, output_path)
+
+
+VARIANTS = {
+    "int8": make_int8,
+    "fp16": make_fp16,
+}
+
+
+def evaluate(reference, candidate, observations, nb_calls):
+    ref_actions = np.array([reference.infer(obs).copy() for obs in observations])
+    actions = np.array([candidate.infer(obs).copy() for obs in observations])
+    errors = actions - ref_actions
+
+    ref_time = np.median(benchmark(reference.infer, observations[0], nb_calls))
+    time = np.median(benchmark(candidate.infer, observations[0], nb_calls))
+    return {
+        "max_error": np.abs(errors).max(),
+        "rms_error": np.sqrt(np.mean(errors**2)),
+        "per_joint_max_error": np.abs(errors).max(axis=0),
+        "reference_time": ref_time,
+        "time": time,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-o", "--onnx_model_path", type=str, required=True)
+    parser.add_argument(
+        "--obs",
+        type=str,
+        required=True,
+        help="recorded observations (robot_saved_obs.rec from --save_obs, or a pickled list)",
+    )
+    parser.add_argument(
+        "--variants",
+        nargs="+",
+        default=list(VARIANTS.keys()),
+        choices=list(VARIANTS.keys()),
+    )
+    parser.add_argument(
+        "--max_error",
+        type=float,
+        default=0.05,
+        help="refuse a model if its max action error is above this",
+    )
+    parser.add_argument(
+        "--max_rms_error",
+        type=float,
+        default=0.01,
+        help="refuse a model if its rms action error is above this",
+    )
+    parser.add_argument(
+        "--keep_slower",
+        action="store_true",
+        default=False,
+        help="also write the variants slower than the original model (only smaller)",
+    )
+    parser.add_argument("--output_dir", type=str, default=None)
+    parser.add_argument("-n", "--nb_calls", type=int, default=1000)
+    args = parser.parse_args()
+
+    observations = np.array(load_observations(args.obs), dtype=np.float32)
+    print(f"Loaded {len(observations)} observations")
+
+    output_dir = args.output_dir or os.path.dirname(
+        os.path.abspath(args.onnx_model_path)
+    )
+    os.makedirs(output_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(args.onnx_model_path))[0]
+
+    reference = OnnxInfer(args.onnx_model_path, awd=True)
+    for variant in args.variants:
+        output_path = os.path.join(output_dir, f"{name}_{variant}.onnx")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = os.path.join(tmp_dir, f"{name}_{variant}.onnx")
+            try:
+                VARIANTS[variant](args.onnx_model_path, tmp_path)
+            except Exception as e:
+                print(f"[{variant}] Could not convert : {e}")
+                continue
+
+            candidate = OnnxInfer(tmp_path, awd=True)
+            res = evaluate(reference, candidate, observations, args.nb_calls)
+
+            print(f"[{variant}]")
+            print("  Max action error : ", res["max_error"])
+            print("  RMS action error : ", res["rms_error"])
+            print("  Per joint max error : ", np.around(res["per_joint_max_error"], 4))
+            print(
+                f"  Latency : {res['reference_time'] * 1e6:.1f}us -> {res['time'] * 1e6:.1f}us"
+                f" (x{res['reference_time'] / res['time']:.2f})"
+            )
+            print(
+                "  Size : ",
+                os.path.getsize(args.onnx_model_path),
+                "->",
+                os.path.getsize(tmp_path),
+                "bytes",
+            )
+
+            if (
+                res["max_error"] > args.max_error
+                or res["rms_error"] > args.max_rms_error
+            ):
+                print(f"  REFUSED : error above threshold, {output_path} not written")
+                continue
+            if res["time"] > res["reference_time"]:
+                if not args.keep_slower:
+                    print(
+                        f"  REFUSED : slower than the original, {output_path} not"
+                        " written (--keep_slower to write it anyway)"
+                    )
+                    continue
+                print("  WARNING : slower than the original")
+
+            shutil.move(tmp_path, output_path)
+            print(f"  Saved {output_path}")
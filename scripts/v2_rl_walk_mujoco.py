@@ -1,23 +1,28 @@
 import time
-import pickle
 
 import numpy as np
-from mini_bdx_runtime.rustypot_position_hwi import HWI
 from mini_bdx_runtime.onnx_infer import OnnxInfer
+from mini_bdx_runtime.policy_worker import PolicyWorker, LatencyStats
 
-from mini_bdx_runtime.raw_imu import Imu
+from mini_bdx_runtime.sim_sensors import make_imu, make_feet_contacts, make_hwi
 from mini_bdx_runtime.poly_reference_motion import PolyReferenceMotion
 from mini_bdx_runtime.xbox_controller import XBoxController
-from mini_bdx_runtime.feet_contacts import FeetContacts
-from mini_bdx_runtime.eyes import Eyes
-from mini_bdx_runtime.sounds import Sounds
-from mini_bdx_runtime.antennas import Antennas
-from mini_bdx_runtime.projector import Projector
-from mini_bdx_runtime.rl_utils import make_action_dict, LowPassActionFilter
+from mini_bdx_runtime.rl_utils import (
+    make_action_dict,
+    OBS_LAYOUTS,
+    get_obs_size,
+    get_obs_slices,
+    check_joint_orders,
+)
+from mini_bdx_runtime.gait_phase import GaitPhase
+from mini_bdx_runtime.filters import make_action_filter, ACTION_FILTERS
+from mini_bdx_runtime.run_recorder import RunRecorder, load_observations
+from mini_bdx_runtime.flight_recorder import FlightRecorder
 from mini_bdx_runtime.duck_config import DuckConfig
 from keyboard_controller import KeyboardController
 
 import os
+import signal
 
 HOME_DIR = os.path.expanduser("~")
 
@@ -34,8 +39,30 @@ class RLWalk:
         commands=False,
         pitch_bias=0,
         save_obs=False,
+        record_path="robot_saved_obs.rec",
         replay_obs=None,
         cutoff_frequency=None,
+        sensors="hardware",
+        sensor_log=None,
+        sim_imu={},
+        session_profile=None,
+        io_binding=False,
+        policy_backend="onnxruntime",
+        pipelined=False,
+        policy_warmup=100,
+        latency_budget=0.5,
+        ignore_latency_check=False,
+        profile_policy=0,
+        extra_policies={},
+        blend_ticks=10,
+        remote_policy=None,
+        remote_timeout=0.005,
+        time_phase=False,
+        action_filter=None,
+        filter_window=10,
+        flight_recorder_duration=10,
+        tilt_threshold=60,
+        bus_failure_ticks=5,
     ):
 
         self.duck_config = DuckConfig(config_json_path=duck_config_path)
@@ -44,7 +71,55 @@ class RLWalk:
         self.pitch_bias = pitch_bias
 
         self.onnx_model_path = onnx_model_path
-        self.policy = OnnxInfer(self.onnx_model_path, awd=True)
+        self.session_profile = session_profile
+        self.io_binding = io_binding
+        self.policy_backend = policy_backend
+        self.policy_warmup = policy_warmup
+        self.latency_budget = latency_budget
+        self.ignore_latency_check = ignore_latency_check
+        self.remote_timeout = remote_timeout
+
+        # All the policies are loaded (and warmed up) here, switching between
+        # them while running only swaps references.
+        # extra_policies is {name: {"path": ..., "obs_layout": ...}}
+        self.policies = {}
+        self.obs_layouts = {}
+        self.obs_slices = {}
+        self.obs_buffers = {}
+        self.load_policy(
+            "walk",
+            self.onnx_model_path,
+            "walk",
+            control_freq,
+            profile_policy,
+            remote=remote_policy,
+        )
+        for name, policy_config in extra_policies.items():
+            self.load_policy(
+                name,
+                policy_config["path"],
+                policy_config.get("obs_layout", "walk"),
+                control_freq,
+            )
+        self.policy_name = "walk"
+        self.policy_index = 0
+        self.policy = self.policies[self.policy_name]
+        self.requested_policy = None
+
+        # motor_targets are linearly blended from the previous policy's over
+        # blend_ticks ticks after a switch
+        self.blend_ticks = blend_ticks
+        self.blend_i = self.blend_ticks
+        self.blend_from = None
+
+        # In pipelined mode, the policy runs on a worker thread while the
+        # control thread does the bus I/O. The action computed from the
+        # observation of tick N is applied at tick N+1 (one tick of latency)
+        self.pipelined = pipelined
+        if self.pipelined:
+            self.policy_worker = PolicyWorker(self.policy)
+        # time between reading the observation and writing the resulting action
+        self.obs_to_action_latency = LatencyStats()
 
         self.num_dofs = 14
         self.max_motor_velocity = 5.24  # rad/s
@@ -53,31 +128,97 @@ class RLWalk:
         self.control_freq = control_freq
         self.pid = pid
 
+        obs_size = max(len(obs) for obs in self.obs_buffers.values())
+        self.recorded_obs = np.zeros(obs_size)
+        record_fields = {
+            "obs": obs_size,
+            "action": self.num_dofs,
+            "motor_targets": self.num_dofs,
+            "commands": 7,
+            "gyro": 3,
+            "accelero": 3,
+            "dof_pos": self.num_dofs,
+            "dof_vel": self.num_dofs,
+            "feet_contacts": 2,
+            "policy": ("<i2", ()),
+        }
+        record_metadata = {
+            "onnx_model_path": self.onnx_model_path,
+            "control_freq": control_freq,
+            "pipelined": pipelined,
+            "policies": list(self.policies.keys()),
+            "obs_layouts": self.obs_layouts,
+        }
+
+        # the run is streamed to record_path while running (see run_recorder.py)
         self.save_obs = save_obs
+        self.recorder = None
         if self.save_obs:
-            self.saved_obs = []
+            self.recorder = RunRecorder(
+                record_path, fields=record_fields, metadata=record_metadata
+            )
+
+        # The last flight_recorder_duration seconds are always kept in memory
+        # and dumped to flight_<date>_<ms>_<reason>.rec on an exception, SIGINT,
+        # SIGTERM, bus_failure_ticks consecutive failed reads or a tilt above
+        # tilt_threshold (deg)
+        self.flight_recorder = None
+        if flight_recorder_duration > 0:
+            self.flight_recorder = FlightRecorder(
+                dict(
+                    record_fields,
+                    tick_time=("<f4", ()),
+                    latency=("<f4", ()),
+                    bus_errors=("<i4", ()),
+                ),
+                freq=control_freq,
+                duration=flight_recorder_duration,
+                metadata=record_metadata,
+                tilt_threshold=(
+                    None if tilt_threshold is None else np.deg2rad(tilt_threshold)
+                ),
+            )
+        self.bus_failure_ticks = bus_failure_ticks
+        self.nb_bus_errors = 0
+        self.consecutive_bus_errors = 0
+        self.stop_reason = "sigint"
 
         self.replay_obs = replay_obs
         if self.replay_obs is not None:
-            self.replay_obs = pickle.load(open(self.replay_obs, "rb"))
-
-        self.action_filter = None
-        if cutoff_frequency is not None:
-            self.action_filter = LowPassActionFilter(
-                self.control_freq, cutoff_frequency
-            )
+            self.replay_obs = load_observations(self.replay_obs)
+
+        # "lowpass", "moving_average" or "butterworth" (filters.ACTION_FILTERS).
+        # Only a cutoff_frequency means lowpass, as before
+        if action_filter is None:
+            action_filter = "none" if cutoff_frequency is None else "lowpass"
+        self.action_filter = make_action_filter(
+            action_filter,
+            self.num_dofs,
+            self.control_freq,
+            cutoff_frequency=cutoff_frequency,
+            window_size=filter_window,
+        )
 
-        self.hwi = HWI(self.duck_config, serial_port)
+        # sim and replay run without the servos either (sim_sensors.SimServoBus)
+        self.hwi = make_hwi(sensors, self.duck_config, serial_port)
+        check_joint_orders(self.hwi, self.duck_config)
 
         self.start()
 
-        self.imu = Imu(
+        # "hardware", or "sim"/"replay" to run without the imu and feet switches
+        self.imu = make_imu(
+            sensors,
             sampling_freq=int(self.control_freq),
             user_pitch_bias=self.pitch_bias,
             upside_down=self.duck_config.imu_upside_down,
+            filter_config=self.duck_config.imu_filter,
+            sensor_log=sensor_log,
+            **(sim_imu if sensors == "sim" else {}),
         )
 
-        self.feet_contacts = FeetContacts()
+        self.feet_contacts = make_feet_contacts(
+            sensors, sensor_log=sensor_log, freq=self.control_freq
+        )
 
         # Scales
         self.action_scale = action_scale
@@ -108,28 +249,127 @@ class RLWalk:
                
         # Reference motion, but we only really need the length of one phase
         # TODO
-        self.PRM = PolyReferenceMotion("./polynomial_coefficients.pkl")
-        self.imitation_i = 0
-        self.imitation_phase = np.array([0, 0])
+        # the .npz (convert_poly_coefficients.py) is much faster to load
+        if os.path.exists("./polynomial_coefficients.npz"):
+            self.PRM = PolyReferenceMotion("./polynomial_coefficients.npz")
+        else:
+            self.PRM = PolyReferenceMotion("./polynomial_coefficients.pkl")
+        # one step per tick, or advances with the clock with time_phase
+        self.gait_phase = GaitPhase(
+            self.PRM.nb_steps_in_period, self.control_freq, use_time=time_phase
+        )
         self.phase_frequency_factor = 1.0
         self.phase_frequency_factor_offset = (
             self.duck_config.phase_frequency_factor_offset
         )
 
-        # Optional expression features
+        # Optional expression features (imported here, they need the robot's
+        # hardware libraries)
         if self.duck_config.eyes:
+            from mini_bdx_runtime.eyes import Eyes
+
             self.eyes = Eyes()
         if self.duck_config.projector:
+            from mini_bdx_runtime.projector import Projector
+
             self.projector = Projector()
         if self.duck_config.speaker:
+            from mini_bdx_runtime.sounds import Sounds
+
             self.sounds = Sounds(
                 volume=1.0, sound_directory="../mini_bdx_runtime/assets/"
             )
         if self.duck_config.antennas:
+            from mini_bdx_runtime.antennas import Antennas
+
             self.antennas = Antennas()
 
-    def get_obs(self):
+    def load_policy(
+        self,
+        name,
+        onnx_model_path,
+        obs_layout,
+        control_freq,
+        profile_calls=0,
+        remote=None,
+    ):
+        if obs_layout not in OBS_LAYOUTS:
+            raise ValueError(
+                f"Unknown observation layout {obs_layout} for policy {name}, available : {list(OBS_LAYOUTS.keys())}"
+            )
+
+        policy = OnnxInfer(
+            onnx_model_path,
+            awd=True,
+            session_profile=self.session_profile,
+            io_binding=self.io_binding,
+            backend=self.policy_backend,
+            profile_calls=profile_calls,
+            remote=remote,
+            remote_timeout=self.remote_timeout,
+        )
+
+        obs_size = len(policy.dummy_inputs())
+        if obs_size != get_obs_size(OBS_LAYOUTS[obs_layout]):
+            raise ValueError(
+                f"Policy {name} takes {obs_size} observations, layout {obs_layout} gives {get_obs_size(OBS_LAYOUTS[obs_layout])}"
+            )
 
+        # keeps the slow first inferences off the first walking ticks, and
+        # refuses to start if the policy doesn't fit in the control budget
+        if self.policy_warmup > 0:
+            policy.warmup(nb_warmup_calls=self.policy_warmup)
+            policy.check_latency(
+                control_freq,
+                self.latency_budget,
+                strict=not self.ignore_latency_check,
+            )
+
+        self.policies[name] = policy
+        self.obs_layouts[name] = OBS_LAYOUTS[obs_layout]
+        self.obs_slices[name] = get_obs_slices(OBS_LAYOUTS[obs_layout])
+        self.obs_buffers[name] = np.zeros(obs_size)
+        print(f"Loaded policy {name} ({onnx_model_path}, {obs_layout} layout)")
+
+    def switch_policy(self, name):
+        """
+        Requests a policy switch, applied between two ticks
+        """
+        if name not in self.policies:
+            print(f"Unknown policy {name}, available : {list(self.policies.keys())}")
+            return
+        self.requested_policy = name
+
+    def next_policy(self):
+        names = list(self.policies.keys())
+        self.switch_policy(names[(names.index(self.policy_name) + 1) % len(names)])
+
+    def apply_policy_switch(self):
+        """
+        Called between the action of the previous policy and the observation of
+        the new one, nothing here is slower than a reference swap
+        """
+        name = self.requested_policy
+        self.requested_policy = None
+        if name == self.policy_name:
+            return
+
+        self.policy_name = name
+        self.policy_index = list(self.policies.keys()).index(name)
+        self.policy = self.policies[name]
+        if self.pipelined:
+            self.policy_worker.policy = self.policy
+
+        # targets before the head offset, which process_action adds after the
+        # blend
+        self.blend_from = self.prev_motor_targets.copy()
+        self.blend_i = 0
+        print(f"Switched to policy {name}")
+
+    def read_sensors(self):
+        """
+        Reads the imu, joints and feet contacts. Returns None if a read failed
+        """
         imu_data = self.imu.get_data()
 
         dof_pos = self.hwi.get_present_positions(
@@ -157,28 +397,51 @@ class RLWalk:
             print(f"ERROR len(dof_vel) != {self.num_dofs}")
             return None
 
-        cmds = self.last_commands
-
         feet_contacts = self.feet_contacts.get()
 
-        obs = np.concatenate(
-            [
-                imu_data["gyro"],
-                imu_data["accelero"],
-                cmds,
-                dof_pos - self.init_pos,
-                dof_vel * 0.05,
-                self.last_action,
-                self.last_last_action,
-                self.last_last_last_action,
-                self.motor_targets,
-                feet_contacts,
-                self.imitation_phase,
-            ]
-        )
+        return {
+            "imu": imu_data,
+            "dof_pos": dof_pos,
+            "dof_vel": dof_vel,
+            "feet_contacts": feet_contacts,
+        }
+
+    def make_obs(self, sensors):
+        """
+        Fills the active policy's observation buffer following its layout.
+        Warning: the buffer is reused by the next call
+        """
+        cmds = self.last_commands
+        obs = self.obs_buffers[self.policy_name]
+        slices = self.obs_slices[self.policy_name]
+
+        fields = {
+            "gyro": sensors["imu"]["gyro"],
+            "accelero": sensors["imu"]["accelero"],
+            "commands": cmds,
+            "dof_pos": sensors["dof_pos"] - self.init_pos,
+            "dof_vel": sensors["dof_vel"] * 0.05,
+            "last_action": self.last_action,
+            "last_last_action": self.last_last_action,
+            "last_last_last_action": self.last_last_last_action,
+            "motor_targets": self.motor_targets,
+            "feet_contacts": sensors["feet_contacts"],
+        }
+        for field, value in fields.items():
+            if field in slices:
+                obs[slices[field]] = value
+
+        if "imitation_phase" in slices:
+            self.gait_phase.write(obs[slices["imitation_phase"]])
 
         return obs
 
+    def get_obs(self):
+        sensors = self.read_sensors()
+        if sensors is None:
+            return None
+        return self.make_obs(sensors)
+
     def start(self):
         kps = [self.pid[0]] * 14
         kds = [self.pid[2]] * 14
@@ -204,8 +467,112 @@ class RLWalk:
 
         return freq
 
+    def update_imitation_phase(self):
+        self.gait_phase.update(
+            self.phase_frequency_factor + self.phase_frequency_factor_offset
+        )
+
+    def check_bus(self, sensors):
+        """
+        Counts the failed reads (sensors is None), dumps the flight recorder
+        once after bus_failure_ticks consecutive ones
+        """
+        if sensors is not None:
+            self.consecutive_bus_errors = 0
+            return
+        self.nb_bus_errors += 1
+        self.consecutive_bus_errors += 1
+        if (
+            self.flight_recorder is not None
+            and self.consecutive_bus_errors == self.bus_failure_ticks
+        ):
+            self.flight_recorder.dump("bus_failure", block=False)
+
+    def get_tick_values(self, sensors, obs, action):
+        """
+        obs is the observation made this tick, action the one applied this
+        tick (computed from the previous tick's observation in pipelined mode)
+        """
+        self.recorded_obs[: len(obs)] = obs
+        self.recorded_obs[len(obs) :] = 0
+        values = {
+            "obs": self.recorded_obs,
+            "motor_targets": self.motor_targets,
+            "commands": self.last_commands,
+            "gyro": sensors["imu"]["gyro"],
+            "accelero": sensors["imu"]["accelero"],
+            "dof_pos": sensors["dof_pos"],
+            "dof_vel": sensors["dof_vel"],
+            "feet_contacts": sensors["feet_contacts"],
+            "policy": self.policy_index,
+        }
+        if action is not None:
+            values["action"] = action
+        return values
+
+    def get_policy_obs(self, obs, i):
+        """
+        Returns the observation to feed the policy (the replayed one if
+        replay_obs is set, None when it's over)
+        """
+        if self.replay_obs is not None:
+            if i < len(self.replay_obs):
+                return self.replay_obs[i]
+            return None
+
+        return obs
+
+    def process_action(self, action, start_t):
+        """
+        Updates the actions history and motor targets from the policy's action,
+        returns the targets to send to the motors
+        """
+        self.last_last_last_action = self.last_last_action.copy()
+        self.last_last_action = self.last_action.copy()
+        self.last_action = action.copy()
+
+        # action = np.zeros(10)
+
+        self.motor_targets = self.init_pos + action * self.action_scale
+
+        # self.motor_targets = np.clip(
+        #     self.motor_targets,
+        #     self.prev_motor_targets
+        #     - self.max_motor_velocity * (1 / self.control_freq),  # control dt
+        #     self.prev_motor_targets
+        #     + self.max_motor_velocity * (1 / self.control_freq),  # control dt
+        # )
+
+        if self.action_filter is not None:
+            filtered_motor_targets = self.action_filter.update(self.motor_targets)
+            if time.time() - start_t > 1:  # give time to the filter to stabilize
+                self.motor_targets = filtered_motor_targets.copy()
+
+        if self.blend_i < self.blend_ticks:
+            alpha = (self.blend_i + 1) / self.blend_ticks
+            self.motor_targets = (
+                1 - alpha
+            ) * self.blend_from + alpha * self.motor_targets
+            self.blend_i += 1
+
+        self.prev_motor_targets = self.motor_targets.copy()
+
+        head_motor_targets = self.last_commands[3:] + self.motor_targets[5:9]
+        self.motor_targets[5:9] = head_motor_targets
+
+        action_dict = make_action_dict(
+            self.motor_targets, list(self.hwi.joints.keys())
+        )
+        return action_dict
+
+    def on_sigterm(self, signum, frame):
+        # stops like ctrl+c
+        self.stop_reason = "sigterm"
+        raise KeyboardInterrupt
+
     def run(self):
         i = 0
+        signal.signal(signal.SIGTERM, self.on_sigterm)
         try:
             print("Starting")
             start_t = time.time()
@@ -247,6 +614,9 @@ class RLWalk:
                         self.antennas.set_position_left(right_trigger)
                         self.antennas.set_position_right(left_trigger)
 
+                    if self.buttons.RB.triggered and len(self.policies) > 1:
+                        self.next_policy()
+
                     if self.buttons.A.triggered:
                         self.paused = not self.paused
                         if self.paused:
@@ -255,78 +625,85 @@ class RLWalk:
                             print("UNPAUSE")
 
                 if self.paused:
+                    self.gait_phase.reset_clock()
+                    if self.pipelined:
+                        # drop the in flight action, it would be stale on unpause
+                        self.policy_worker.get_result()
                     time.sleep(0.1)
                     continue
 
-                obs = self.get_obs()
-                if obs is None:
-                    continue
-
-                self.imitation_i += 1 * (
-                    self.phase_frequency_factor + self.phase_frequency_factor_offset
-                )
-                self.imitation_i = self.imitation_i % self.PRM.nb_steps_in_period
-                self.imitation_phase = np.array(
-                    [
-                        np.cos(
-                            self.imitation_i / self.PRM.nb_steps_in_period * 2 * np.pi
-                        ),
-                        np.sin(
-                            self.imitation_i / self.PRM.nb_steps_in_period * 2 * np.pi
-                        ),
-                    ]
-                )
-
-                if self.save_obs:
-                    self.saved_obs.append(obs)
-
-                if self.replay_obs is not None:
-                    if i < len(self.replay_obs):
-                        obs = self.replay_obs[i]
-                    else:
+                if self.pipelined:
+                    # The reads for this tick overlap the inference started at
+                    # the previous tick, whose action is applied now
+                    sensors = self.read_sensors()
+                    self.check_bus(sensors)
+                    action, obs_time = self.policy_worker.get_result()
+                    action_dict = None
+                    if action is not None:
+                        action_dict = self.process_action(action, start_t)
+
+                    # after the last action of the previous policy, before the
+                    # first observation for the new one
+                    if self.requested_policy is not None:
+                        self.apply_policy_switch()
+
+                    obs = None if sensors is None else self.make_obs(sensors)
+                    if obs is not None:
+                        self.update_imitation_phase()
+                        policy_obs = self.get_policy_obs(obs, i)
+                        if policy_obs is None:
+                            print("BREAKING ")
+                            break
+                        self.policy_worker.submit(policy_obs)
+
+                    # and the bus write overlaps this tick's inference
+                    if action_dict is not None:
+                        self.hwi.set_position_all(action_dict)
+                        self.obs_to_action_latency.update(time.time() - obs_time)
+
+                    if obs is None:
+                        continue
+                else:
+                    if self.requested_policy is not None:
+                        self.apply_policy_switch()
+
+                    sensors = self.read_sensors()
+                    self.check_bus(sensors)
+                    if sensors is None:
+                        continue
+                    obs = self.make_obs(sensors)
+
+                    self.update_imitation_phase()
+
+                    policy_obs = self.get_policy_obs(obs, i)
+                    if policy_obs is None:
                         print("BREAKING ")
                         break
 
-                action = self.policy.infer(obs)
-
-                self.last_last_last_action = self.last_last_action.copy()
-                self.last_last_action = self.last_action.copy()
-                self.last_action = action.copy()
-
-                # action = np.zeros(10)
-
-                self.motor_targets = self.init_pos + action * self.action_scale
-
-                # self.motor_targets = np.clip(
-                #     self.motor_targets,
-                #     self.prev_motor_targets
-                #     - self.max_motor_velocity * (1 / self.control_freq),  # control dt
-                #     self.prev_motor_targets
-                #     + self.max_motor_velocity * (1 / self.control_freq),  # control dt
-                # )
-
-                if self.action_filter is not None:
-                    self.action_filter.push(self.motor_targets)
-                    filtered_motor_targets = self.action_filter.get_filtered_action()
-                    if (
-                        time.time() - start_t > 1
-                    ):  # give time to the filter to stabilize
-                        self.motor_targets = filtered_motor_targets
+                    obs_time = time.time()
+                    action = self.policy.infer(policy_obs)
 
-                self.prev_motor_targets = self.motor_targets.copy()
+                    action_dict = self.process_action(action, start_t)
 
-                head_motor_targets = self.last_commands[3:] + self.motor_targets[5:9]
-                self.motor_targets[5:9] = head_motor_targets
+                    self.hwi.set_position_all(action_dict)
+                    self.obs_to_action_latency.update(time.time() - obs_time)
 
-                action_dict = make_action_dict(
-                    self.motor_targets, list(self.hwi.joints.keys())
-                )
-
-                self.hwi.set_position_all(action_dict)
+                tick_values = self.get_tick_values(sensors, obs, action)
+                if self.recorder is not None:
+                    self.recorder.record(t, **tick_values)
 
                 i += 1
 
                 took = time.time() - t
+                if self.flight_recorder is not None:
+                    self.flight_recorder.record(
+                        t,
+                        tick_time=took,
+                        latency=self.obs_to_action_latency.last,
+                        bus_errors=self.nb_bus_errors,
+                        **tick_values,
+                    )
+                    self.flight_recorder.check_tilt(sensors["imu"]["accelero"])
                 # print("Full loop took", took, "fps : ", np.around(1 / took, 2))
                 if (1 / self.control_freq - took) < 0:
                     print(
@@ -336,6 +713,8 @@ class RLWalk:
                 time.sleep(max(0, 1 / self.control_freq - took))
 
         except KeyboardInterrupt:
+            if self.flight_recorder is not None:
+                self.flight_recorder.dump(self.stop_reason)
             if self.duck_config.antennas:
                 self.antennas.stop()
             if self.duck_config.eyes:
@@ -343,9 +722,30 @@ class RLWalk:
             if self.duck_config.projector:
                 self.projector.stop()
             self.feet_contacts.stop()
-
-        if self.save_obs:
-            pickle.dump(self.saved_obs, open("robot_saved_obs.pkl", "wb"))
+        except Exception:
+            if self.flight_recorder is not None:
+                self.flight_recorder.dump("exception")
+            raise
+
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.flight_recorder is not None:
+            self.flight_recorder.wait()
+        print(f"{self.nb_bus_errors} failed sensor reads")
+
+        print(self.obs_to_action_latency.summary("Observation to action latency"))
+        print(
+            f"Gait phase error relative to tick counting : {self.gait_phase.phase_error:.3f} periods"
+        )
+        for policy in self.policies.values():
+            if policy.remote is not None:
+                print(policy.remote.summary())
+        if self.pipelined:
+            print(
+                f"Pipelined mode, one tick of added latency ({1000 / self.control_freq:.1f}ms)"
+            )
+            print(self.policy_worker.inference_time.summary("Inference time"))
+            print(self.policy_worker.wait_time.summary("Waiting for inference"))
         print("TURNING OFF")
 
 
@@ -374,10 +774,15 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--save_obs",
-        type=str,
-        required=False,
+        action="store_true",
         default=False,
-        help="save the run's observations",
+        help="record the run (observations, actions, sensors) to --record_path",
+    )
+    parser.add_argument(
+        "--record_path",
+        type=str,
+        default="robot_saved_obs.rec",
+        help="load it with run_recorder.load_recording()",
     )
     parser.add_argument(
         "--replay_obs",
@@ -387,10 +792,180 @@ if __name__ == "__main__":
         help="replay the observations from a previous run (can be from the robot or from mujoco)",
     )
     parser.add_argument("--cutoff_frequency", type=float, default=None)
+    parser.add_argument(
+        "--action_filter",
+        type=str,
+        default=None,
+        choices=ACTION_FILTERS,
+        help="filter on the motor targets. Defaults to lowpass if --cutoff_frequency is set, none otherwise",
+    )
+    parser.add_argument(
+        "--filter_window",
+        type=int,
+        default=10,
+        help="window size of the moving_average action filter",
+    )
+    parser.add_argument(
+        "--sensors",
+        type=str,
+        default="hardware",
+        choices=["hardware", "sim", "replay"],
+        help="imu, feet contacts and servos backend. sim and replay run without the robot (no serial port needed)",
+    )
+    parser.add_argument(
+        "--sensor_log",
+        type=str,
+        default=None,
+        help="recorded sensor data for --sensors replay (can be a --save_obs file)",
+    )
+    parser.add_argument(
+        "--sim_gyro_noise", type=float, default=0.01, help="rad/s, --sensors sim"
+    )
+    parser.add_argument(
+        "--sim_accelero_noise", type=float, default=0.05, help="m/s^2, --sensors sim"
+    )
+    parser.add_argument(
+        "--sim_gyro_bias",
+        type=float,
+        nargs=3,
+        default=[0.0, 0.0, 0.0],
+        help="rad/s, --sensors sim",
+    )
+    parser.add_argument(
+        "--sim_accelero_bias",
+        type=float,
+        nargs=3,
+        default=[0.0, 0.0, 0.0],
+        help="m/s^2, --sensors sim",
+    )
+    parser.add_argument(
+        "--sim_dropout",
+        type=float,
+        default=0.0,
+        help="probability that a simulated imu sample is lost, --sensors sim",
+    )
+    parser.add_argument(
+        "--sim_imu_rate",
+        type=float,
+        default=None,
+        help="Hz, simulated imu sample rate (default: control_freq), --sensors sim",
+    )
+    parser.add_argument(
+        "--session_profile",
+        type=str,
+        default=None,
+        help="onnxruntime session profile (see onnx_infer.SESSION_PROFILES), pi is a good choice on the robot",
+    )
+    parser.add_argument(
+        "--io_binding",
+        action="store_true",
+        default=False,
+        help="run the policy on preallocated float32 buffers bound to onnxruntime",
+    )
+    parser.add_argument(
+        "--policy_backend",
+        type=str,
+        default="onnxruntime",
+        choices=["onnxruntime", "numpy", "auto"],
+        help="auto benchmarks onnxruntime against the pure numpy executor and keeps the fastest",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        default=False,
+        help="run the policy on a worker thread, overlapped with the servo I/O. Adds one tick of latency",
+    )
+    parser.add_argument(
+        "--policy_warmup",
+        type=int,
+        default=100,
+        help="number of dummy inferences run before starting, 0 to skip (and skip the latency check)",
+    )
+    parser.add_argument(
+        "--latency_budget",
+        type=float,
+        default=0.5,
+        help="fraction of the control period the policy's p99 latency must fit in",
+    )
+    parser.add_argument(
+        "--ignore_latency_check",
+        action="store_true",
+        default=False,
+        help="only warn if the policy is too slow for control_freq",
+    )
+    parser.add_argument(
+        "--profile_policy",
+        type=int,
+        default=0,
+        help="profile the first N policy calls with onnxruntime's profiler and print a per operator report",
+    )
+    parser.add_argument(
+        "--extra_policies",
+        nargs="+",
+        default=[],
+        help="other policies to preload, as name=path[:obs_layout] (layouts in rl_utils.OBS_LAYOUTS). RB cycles through them",
+    )
+    parser.add_argument(
+        "--blend_ticks",
+        type=int,
+        default=10,
+        help="number of ticks to blend the motor targets over when switching policies",
+    )
+
+    parser.add_argument(
+        "--remote_policy",
+        type=str,
+        default=None,
+        help="host:port of a policy server (policy_server.py) running the main policy, the local one is the fallback",
+    )
+    parser.add_argument(
+        "--remote_timeout",
+        type=float,
+        default=5,
+        help="ms, deadline for the remote policy's reply before falling back to the local policy",
+    )
+
+    parser.add_argument(
+        "--time_phase",
+        action="store_true",
+        default=False,
+        help="advance the gait phase with the clock instead of one step per tick",
+    )
+
+    parser.add_argument(
+        "--flight_recorder_duration",
+        type=float,
+        default=10,
+        help="s, the last seconds of the run are dumped to flight_<date>_<ms>_<reason>.rec on a fault or stop. 0 to disable",
+    )
+    parser.add_argument(
+        "--tilt_threshold",
+        type=float,
+        default=60,
+        help="deg, dump the flight recorder when the robot tilts more than this",
+    )
 
     args = parser.parse_args()
     pid = [args.p, args.i, args.d]
 
+    extra_policies = {}
+    for extra_policy in args.extra_policies:
+        name, path = extra_policy.split("=", 1)
+        obs_layout = "walk"
+        if ":" in path:
+            path, obs_layout = path.rsplit(":", 1)
+        extra_policies[name] = {"path": path, "obs_layout": obs_layout}
+
+    sim_imu = {
+        "gyro_noise": args.sim_gyro_noise,
+        "accelero_noise": args.sim_accelero_noise,
+        "gyro_bias": args.sim_gyro_bias,
+        "accelero_bias": args.sim_accelero_bias,
+        "dropout": args.sim_dropout,
+    }
+    if args.sim_imu_rate is not None:
+        sim_imu["rate"] = args.sim_imu_rate
+
     print("Done parsing args")
     rl_walk = RLWalk(
         args.onnx_model_path,
@@ -401,8 +976,29 @@ if __name__ == "__main__":
         commands=args.commands,
         pitch_bias=args.pitch_bias,
         save_obs=args.save_obs,
+        record_path=args.record_path,
         replay_obs=args.replay_obs,
         cutoff_frequency=args.cutoff_frequency,
+        sensors=args.sensors,
+        sensor_log=args.sensor_log,
+        sim_imu=sim_imu,
+        session_profile=args.session_profile,
+        io_binding=args.io_binding,
+        policy_backend=args.policy_backend,
+        pipelined=args.pipelined,
+        policy_warmup=args.policy_warmup,
+        latency_budget=args.latency_budget,
+        ignore_latency_check=args.ignore_latency_check,
+        profile_policy=args.profile_policy,
+        extra_policies=extra_policies,
+        blend_ticks=args.blend_ticks,
+        remote_policy=args.remote_policy,
+        remote_timeout=args.remote_timeout / 1000,
+        time_phase=args.time_phase,
+        action_filter=args.action_filter,
+        filter_window=args.filter_window,
+        flight_recorder_duration=args.flight_recorder_duration,
+        tilt_threshold=args.tilt_threshold,
     )
     print("Done instantiating RLWalk")
     rl_walk.run()